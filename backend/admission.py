@@ -0,0 +1,195 @@
+"""
+Admission control: bounded concurrency per cost class.
+
+Every request is classified by route into a cost class (cheap, medium, heavy,
+export). Each class admits at most `limit` requests at a time and queues up to
+`max_queue` more, first come first served. A request that finds the queue full
+is rejected with 429; one that waits longer than `queue_timeout` seconds gets
+503. Both carry a Retry-After estimated from the class's recent service times.
+Because every class has its own slots, a burst of heavy $unwind aggregations
+queues behind itself and never takes the worker threads the cheap dashboard
+queries need.
+"""
+import asyncio
+import collections
+import json
+import math
+import time
+
+from deadlines import current_budget
+
+
+class Overloaded(Exception):
+
+    def __init__(self, status_code, retry_after, detail):
+        super().__init__(detail)
+        self.status_code = status_code
+        self.retry_after = retry_after
+        self.detail = detail
+
+
+def _percentile(values, fraction):
+    if not values:
+        return 0.0
+    ordered = sorted(values)
+    return ordered[min(len(ordered) - 1, int(len(ordered) * fraction))]
+
+
+class CostClass:
+
+    def __init__(self, name, limit, max_queue, queue_timeout):
+        self.name = name
+        self.limit = limit
+        self.max_queue = max_queue
+        self.queue_timeout = queue_timeout
+        self.running = 0
+        self.waiters = collections.deque()
+        self.admitted = 0
+        self.rejected = 0
+        self.timed_out = 0
+        # Recent queue / service times in seconds, for metrics and Retry-After
+        self.queue_times = collections.deque(maxlen=1000)
+        self.service_times = collections.deque(maxlen=1000)
+
+    def retry_after(self):
+        """Seconds until a slot is likely free: queue length times mean service time, spread over the slots"""
+        mean = sum(self.service_times) / len(self.service_times) if self.service_times else 1.0
+        return max(1, math.ceil(mean * (len(self.waiters) + 1) / self.limit))
+
+    async def acquire(self):
+        """Wait for a slot; returns the seconds spent queued or raises Overloaded"""
+        if self.running < self.limit and not self.waiters:
+            self.running += 1
+            self.admitted += 1
+            self.queue_times.append(0.0)
+            return 0.0
+        if len(self.waiters) >= self.max_queue:
+            self.rejected += 1
+            raise Overloaded(429, self.retry_after(), f"Too many {self.name} requests queued")
+
+        started = time.monotonic()
+        slot = asyncio.get_running_loop().create_future()
+        self.waiters.append(slot)
+        try:
+            await asyncio.wait({slot}, timeout=self.queue_timeout)
+        except asyncio.CancelledError:
+            self._abandon(slot)
+            raise
+        if not slot.done():
+            self._abandon(slot)
+            self.timed_out += 1
+            raise Overloaded(503, self.retry_after(), f"Timed out waiting for a {self.name} request slot")
+
+        queued = time.monotonic() - started
+        self.admitted += 1
+        self.queue_times.append(queued)
+        return queued
+
+    def _abandon(self, slot):
+        if slot.done():
+            self.release()  # the slot was handed over just as we gave up
+        else:
+            self.waiters.remove(slot)
+
+    def release(self, service_seconds=None):
+        if service_seconds is not None:
+            self.service_times.append(service_seconds)
+        # Hand the slot straight to the next waiter, so running never drops below limit while there is a queue
+        while self.waiters:
+            slot = self.waiters.popleft()
+            if not slot.done():
+                slot.set_result(None)
+                return
+        self.running -= 1
+
+    def stats(self):
+        queue_ms = [t * 1000 for t in self.queue_times]
+        return {
+            "limit": self.limit,
+            "max_queue": self.max_queue,
+            "running": self.running,
+            "queued": len(self.waiters),
+            "admitted": self.admitted,
+            "rejected": self.rejected,
+            "timed_out": self.timed_out,
+            "queue_ms": {
+                "mean": round(sum(queue_ms) / len(queue_ms), 3) if queue_ms else 0.0,
+                "p95": round(_percentile(queue_ms, 0.95), 3),
+                "max": round(max(queue_ms), 3) if queue_ms else 0.0,
+            },
+            "service_ms_p95": round(_percentile(self.service_times, 0.95) * 1000, 3),
+        }
+
+
+class AdmissionMiddleware:
+    """
+    ASGI middleware admitting requests through their cost class.
+    `classify(path)` returns a class name, or None for requests that are never
+    queued (health probes, metrics).
+    """
+
+    def __init__(self, app, classify, classes):
+        self.app = app
+        self.classify = classify
+        self.classes = classes
+
+    async def __call__(self, scope, receive, send):
+        if scope["type"] != "http":
+            await self.app(scope, receive, send)
+            return
+        path = scope["path"]
+        if "/api/" in path:
+            path = "/api/" + path.split("/api/", 1)[1]
+        name = self.classify(path)
+        if name is None:
+            await self.app(scope, receive, send)
+            return
+
+        cost_class = self.classes[name]
+        try:
+            queued = await cost_class.acquire()
+        except Overloaded as e:
+            await self._reject(send, e)
+            return
+
+        started = time.monotonic()
+        try:
+            budget = current_budget.get()
+            if budget is not None and budget.cancelled:
+                return  # the client left while the request was queued
+
+            async def send_with_queue_time(message):
+                if message["type"] == "http.response.start":
+                    message = {**message, "headers": list(message.get("headers", [])) + [
+                        (b"x-queue-time-ms", f"{queued * 1000:.1f}".encode()),
+                        (b"x-cost-class", name.encode()),
+                    ]}
+                await send(message)
+
+            await self.app(scope, receive, send_with_queue_time)
+        finally:
+            cost_class.release(time.monotonic() - started)
+
+    async def _reject(self, send, error):
+        body = json.dumps({"detail": error.detail}).encode()
+        await send({
+            "type": "http.response.start",
+            "status": error.status_code,
+            "headers": [
+                (b"content-type", b"application/json"),
+                (b"content-length", str(len(body)).encode()),
+                (b"retry-after", str(error.retry_after).encode()),
+            ],
+        })
+        await send({"type": "http.response.body", "body": body})
+
+
+def parse_limits(spec, defaults):
+    """Override class limits from a spec like "heavy=2,medium=6" """
+    limits = dict(defaults)
+    for item in filter(None, (part.strip() for part in spec.split(","))):
+        name, _, value = item.partition("=")
+        if name not in limits or not value.isdigit() or int(value) < 1:
+            raise ValueError(f"Invalid admission limit: {item}")
+        limits[name] = int(value)
+    return limits
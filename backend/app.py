@@ -1,17 +1,229 @@
-from fastapi import FastAPI, HTTPException
+import asyncio
+from array import array
+from bisect import bisect_right
+from contextlib import asynccontextmanager
+from fastapi import Depends, FastAPI, HTTPException, Request
+from fastapi.exception_handlers import http_exception_handler
 from fastapi.middleware.cors import CORSMiddleware
+from fastapi.responses import JSONResponse, StreamingResponse
 from pymongo import MongoClient, errors
 from datetime import datetime, timedelta
 import random
 from typing import List, Dict, Any
 from dotenv import load_dotenv
+import json
 import os
+import tempfile
+import threading
+import time
+
+import cardinality
+import clusters
+import columnar
+import compare
+import compliance
+import deltas
+import domain_coverage
+import downsample
+import export
+import histograms
+import offload
+import partitions
+import sampling
+import scoring
+from datasets import Dataset, DatasetRegistry
+from domains import registrable_domain
+from admission import AdmissionMiddleware, CostClass, parse_limits
+from live import ChangeFeed, sse
+from deadlines import QueryCancelled, QueryDeadlineMiddleware, collect, current_budget
+from shared_cache import SharedResultCache
+from validity_calendar import active_at, backfill_validity_dates, expired_at, snapshot_boundary, validity_dates
 
 # Load environment variables from .env file
 load_dotenv()
 
-app = FastAPI(title="Certificate Analytics API", description="API for certificate analytics dashboard")
+@asynccontextmanager
+async def lifespan(app):
+    # Nothing here waits on MongoDB: the server accepts traffic immediately and
+    # indexes / warm-up are built in the background once it is up
+    threading.Thread(target=build_indexes, daemon=True).start()
+    if WARMUP:
+        threading.Thread(target=warm_up, daemon=True).start()
+    yield
+    # Save the scan-built snapshots so the next start resumes from them
+    for ds in datasets.datasets.values():
+        if ds.state_dir and ds.indexes_built:
+            try:
+                ds.save_state()
+            except Exception as e:
+                print(f"❌ Error saving state of {ds.name}:", e)
+    offload.shutdown()
+    # Shutdown MongoDB connection on app shutdown
+    if _client is not None:
+        _client.close()
+
+app = FastAPI(title="Certificate Analytics API", description="API for certificate analytics dashboard", lifespan=lifespan)
+
+# Get MongoDB URI and DB name from environment variables
+MONGO_URI = os.getenv("MONGO_URI")
+if not MONGO_URI:
+    raise RuntimeError("MONGO_URI not found in environment variables. Please set it in the .env file.")
+
+DB_NAME = os.getenv("DB_NAME", "my-pk-domains-multi-mini")  # Default to original if not set
 
+# Datasets (databases) this process may serve, e.g. "my-pk-domains-multi,my-pk-domains-multi-mini".
+# A request picks one with the X-Dataset header, a ?dataset= parameter or a /datasets/<name>/ path prefix.
+DATASETS = [name.strip() for name in os.getenv("DATASETS", DB_NAME).split(",") if name.strip()]
+if DB_NAME not in DATASETS:
+    DATASETS.insert(0, DB_NAME)
+
+# How often the in-process indexes (search index, validity calendar) pick up new certificates
+INDEX_REFRESH_SECONDS = int(os.getenv("INDEX_REFRESH_SECONDS", "60"))
+
+# How long a request waits for MongoDB to become reachable before failing with 503
+MONGO_TIMEOUT_MS = int(os.getenv("MONGO_TIMEOUT_MS", "5000"))
+
+# Precompute the heavy aggregates in the background after startup (WARMUP=1)
+WARMUP = os.getenv("WARMUP", "").lower() in ("1", "true", "yes")
+
+# One client, and so one connection pool, shared by every dataset. It is created
+# on first use with connect=False, so importing the app never blocks on MongoDB.
+_client = None
+_client_lock = threading.Lock()
+
+def get_client():
+    global _client
+    with _client_lock:
+        if _client is None:
+            _client = MongoClient(MONGO_URI, serverSelectionTimeoutMS=MONGO_TIMEOUT_MS, connect=False,
+                                  maxPoolSize=int(os.getenv("MONGO_MAX_POOL_SIZE", "100")))
+        return _client
+
+# ANALYTICS_ENGINE=columnar serves the distribution endpoints from in-memory NumPy columns
+ANALYTICS_ENGINE = os.getenv("ANALYTICS_ENGINE", "mongo").lower()
+if ANALYTICS_ENGINE == "columnar" and not columnar.available():
+    print("❌ ANALYTICS_ENGINE=columnar requires numpy; falling back to MongoDB aggregations")
+    ANALYTICS_ENGINE = "mongo"
+
+# Computed results and scan-built snapshots survive restarts in CACHE_DIR (see
+# warm_state.py). The result cache there is a SQLite file shared by all worker
+# processes on this host; set SHARED_CACHE_PATH to an empty value to keep
+# results per process only, and CACHE_DIR to an empty value to save no snapshots.
+CACHE_DIR = os.getenv("CACHE_DIR", os.path.join(os.path.dirname(os.path.abspath(__file__)), ".cache"))
+SHARED_CACHE_PATH = os.getenv("SHARED_CACHE_PATH",
+                              os.path.join(CACHE_DIR or tempfile.gettempdir(), "certificate-dashboard-cache.sqlite3"))
+# Size and age limits of the shared result cache (oldest results are dropped first)
+SHARED_CACHE_MAX_MB = int(os.getenv("SHARED_CACHE_MAX_MB", "1024"))
+SHARED_CACHE_MAX_AGE_HOURS = int(os.getenv("SHARED_CACHE_MAX_AGE_HOURS", "168"))
+shared_cache = SharedResultCache(SHARED_CACHE_PATH, max_bytes=SHARED_CACHE_MAX_MB * 1024 * 1024,
+                                 max_age_seconds=SHARED_CACHE_MAX_AGE_HOURS * 3600) if SHARED_CACHE_PATH else None
+
+datasets = DatasetRegistry(get_client, DATASETS, DB_NAME, refresh_seconds=INDEX_REFRESH_SECONDS,
+                           columnar=ANALYTICS_ENGINE == "columnar", shared_cache=shared_cache,
+                           state_dir=os.path.join(CACHE_DIR, "state") if CACHE_DIR else None)
+
+@app.exception_handler(errors.ConnectionFailure)
+async def mongo_unavailable(request: Request, exc: errors.ConnectionFailure):
+    # Covers ServerSelectionTimeoutError: MongoDB is (briefly) unreachable
+    return JSONResponse(status_code=503, content={"detail": f"Database unavailable: {exc}"},
+                        headers={"Retry-After": "5"})
+
+def get_dataset(request: Request):
+    """Dependency resolving the dataset a request is for (defaults to DB_NAME)"""
+    name = request.headers.get("x-dataset") or request.query_params.get("dataset")
+    try:
+        return datasets.get(name)
+    except KeyError:
+        raise HTTPException(status_code=404, detail=f"Unknown dataset: {name}")
+
+@app.middleware("http")
+async def dataset_path_prefix(request: Request, call_next):
+    # /datasets/<name>/api/... is served as /api/... with the X-Dataset header set
+    path = request.scope["path"]
+    if path.startswith("/datasets/"):
+        parts = path.split("/", 3)
+        if len(parts) == 4:
+            request.scope["path"] = "/" + parts[3]
+            request.scope["headers"] = [
+                (k, v) for k, v in request.scope["headers"] if k != b"x-dataset"
+            ] + [(b"x-dataset", parts[2].encode())]
+    return await call_next(request)
+
+# Time budget per request, passed to MongoDB as maxTimeMS. The heavy $unwind
+# aggregations get a longer budget; exports stream for as long as they need.
+QUERY_TIMEOUT_SECONDS = float(os.getenv("QUERY_TIMEOUT_SECONDS", "30"))
+HEAVY_QUERY_TIMEOUT_SECONDS = float(os.getenv("HEAVY_QUERY_TIMEOUT_SECONDS", "120"))
+HEAVY_ENDPOINTS = {
+    "/api/san-domains",
+    "/api/subject-common-names",
+    "/api/ca-domain-analysis",
+    "/api/ca-url-analysis",
+    "/api/ca-pubkey-analysis",
+    "/api/shared-pubkeys",
+    "/api/compare",
+}
+
+def query_budget(path):
+    if path.startswith("/api/export/") or path == "/api/stream":
+        return None
+    if path in HEAVY_ENDPOINTS:
+        return HEAVY_QUERY_TIMEOUT_SECONDS
+    return QUERY_TIMEOUT_SECONDS
+
+# Admission control: each cost class has its own concurrency limit and queue.
+# Together they stay below the 40 worker threads, so the heavy analyses can
+# never occupy all threads the cheap interactive queries run on.
+ADMISSION_LIMITS = parse_limits(os.getenv("ADMISSION_LIMITS", ""), {"cheap": 16, "medium": 8, "heavy": 4, "export": 2})
+ADMISSION_QUEUE_TIMEOUT_SECONDS = float(os.getenv("ADMISSION_QUEUE_TIMEOUT_SECONDS", "10"))
+ADMISSION_CLASSES = {
+    name: CostClass(name, limit, max_queue=limit * 4, queue_timeout=ADMISSION_QUEUE_TIMEOUT_SECONDS)
+    for name, limit in ADMISSION_LIMITS.items()
+}
+CHEAP_ENDPOINTS = {
+    "/api/overview",
+    "/api/types",
+    "/api/issuers",
+    "/api/regions",
+    "/api/departments",
+    "/api/hash-algorithms",
+    "/api/signature-algorithms",
+    "/api/certificate-authorities",
+    "/api/issuer-organization",
+    "/api/issuer-country",
+    "/api/expiring",
+    "/api/expiring/summary",
+    "/api/search",
+    "/api/cardinality-trends",
+    "/api/key-clusters",
+    "/api/key-clusters/lookup",
+    "/api/intermediate-cas",
+    "/api/ca-graph",
+    "/api/compliance",
+    "/api/compliance/offenders",
+    "/api/domains/coverage-gaps",
+}
+UNMETERED_PATHS = {"/", "/healthz", "/readyz", "/api/admission", "/api/datasets", "/api/engine/memory",
+                   "/api/engine/offload", "/api/stream"}
+
+def route_cost(path):
+    """Cost class of a request path (None: never queued)"""
+    if path in UNMETERED_PATHS:
+        return None
+    if path.startswith("/api/export/"):
+        return "export"
+    if path in HEAVY_ENDPOINTS:
+        return "heavy"
+    if path in CHEAP_ENDPOINTS:
+        return "cheap"
+    return "medium"
+
+app.add_middleware(AdmissionMiddleware, classify=route_cost, classes=ADMISSION_CLASSES)
+
+# Around admission, so time spent queued counts against the budget and
+# clients that leave while queued are noticed
+app.add_middleware(QueryDeadlineMiddleware, budget_for=query_budget)
+
+# Outermost, so every response (including 429 / 503 from admission control) carries CORS headers
 app.add_middleware(
     CORSMiddleware,
     allow_origins=["*"],
@@ -20,60 +232,291 @@ app.add_middleware(
     allow_headers=["*"],
 )
 
-# Get MongoDB URI and DB name from environment variables
-MONGO_URI = os.getenv("MONGO_URI")
-if not MONGO_URI:
-    raise RuntimeError("MONGO_URI not found in environment variables. Please set it in the .env file.")
-
-DB_NAME = os.getenv("DB_NAME", "my-pk-domains-multi-mini")  # Default to original if not set
+@app.exception_handler(errors.ExecutionTimeout)
+async def query_timed_out(request: Request, exc: errors.ExecutionTimeout):
+    budget = current_budget.get()
+    seconds = budget.seconds if budget else None
+    return JSONResponse(status_code=504, content={"detail": f"Query exceeded its time budget of {seconds}s"})
+
+@app.exception_handler(QueryCancelled)
+async def query_cancelled(request: Request, exc: QueryCancelled):
+    # Nobody is listening any more; 499 only shows up in the access log
+    return JSONResponse(status_code=499, content={"detail": "Client closed request"})
+
+@app.exception_handler(HTTPException)
+async def endpoint_error(request: Request, exc: HTTPException):
+    # Endpoints wrap failures in HTTPException(500); report deadlines and cancellations for what they are
+    budget = current_budget.get()
+    if budget is not None and budget.cancelled:
+        return await query_cancelled(request, QueryCancelled(budget.comment))
+    if isinstance(exc.__context__, errors.ExecutionTimeout):
+        return await query_timed_out(request, exc.__context__)
+    return await http_exception_handler(request, exc)
+
+def as_of_boundary(as_of):
+    """Turn an as_of query parameter into the snapshot instant, or None for "now" """
+    if not as_of:
+        return None
+    try:
+        return snapshot_boundary(as_of)
+    except ValueError as e:
+        raise HTTPException(status_code=400, detail=str(e))
+
+def as_of_stages(as_of):
+    """Pipeline prefix restricting an aggregation to certificates active on the as_of date"""
+    boundary = as_of_boundary(as_of)
+    return [{"$match": active_at(boundary)}] if boundary else []
+
+def columns_for(ds):
+    """The dataset's columnar snapshot when the columnar engine is enabled, else None"""
+    if ds.columns is None:
+        return None
+    ds.columns.refresh_if_stale(ds.collection)
+    return ds.columns
+
+# Mongo field behind each dictionary-encoded column of the columnar snapshot
+GROUP_FIELDS = {
+    "signature_algorithm": "parsed.signature_algorithm.name",
+    "hash_algorithm": "parsed.signature_algorithm.hash_algorithm",
+    "issuer_cn": "parsed.issuer.common_name",
+    "issuer_org": "parsed.issuer.organization",
+    "issuer_country": "parsed.issuer.country",
+}
+
+# Columns served from the canonical issuer dimension (see issuers.py)
+ISSUER_COLUMNS = {"issuer_org": "organization", "issuer_country": "country"}
+
+def issuer_rows(ds, stages, accumulators=None):
+    """Aggregates per issuer_id: one $group on the indexed integer, after new certificates got their ids"""
+    ds.issuers.refresh_if_stale(ds.collection, ds.version())
+    group = {"_id": "$issuer_id", **(accumulators or {"count": {"$sum": 1}})}
+    return list(ds.certificates.aggregate(stages + [{"$group": group}]))
+
+def group_counts(ds, column, as_of=None, unwind=False):
+    """Certificates per value of a field ([{"_id", "count"}], largest first), from RAM when possible"""
+    columns = columns_for(ds)
+    if columns is not None:
+        mask = columns.active_mask(as_of_boundary(as_of))
+        if column in ISSUER_COLUMNS:
+            # Array values are expanded there like the issuer rollup of the Mongo path, so both engines
+            # return the same buckets
+            ds.issuers.refresh_if_stale(ds.collection, ds.version())
+            return ds.issuers.canonical_counts(columns.group_counts(column, mask), ISSUER_COLUMNS[column])
+        return columns.unwound_counts(column, mask) if unwind else columns.group_counts(column, mask)
+
+    if column in ISSUER_COLUMNS:
+        # Issuer values are unwound by the rollup, as with $unwind
+        return ds.issuers.rollup(issuer_rows(ds, as_of_stages(as_of)), ISSUER_COLUMNS[column])
+
+    field = "$" + GROUP_FIELDS[column]
+    pipeline = as_of_stages(as_of)
+    if unwind:
+        pipeline.append({"$unwind": {"path": field, "preserveNullAndEmptyArrays": True}})
+    pipeline += [
+        {"$group": {"_id": field, "count": {"$sum": 1}}},
+        {"$sort": {"count": -1}}
+    ]
+    return list(ds.certificates.aggregate(pipeline))
 
-try:
-    client = MongoClient(MONGO_URI, serverSelectionTimeoutMS=10000)
-    client.server_info()  # Force connection to verify
-    db = client[DB_NAME]
-    certificates_collection = db["certificates"]
-except errors.ServerSelectionTimeoutError as err:
-    raise RuntimeError("Could not connect to MongoDB: " + str(err))
+def approximate(ds, key, compute_exact, compute_sampled, sample, refine):
+    """
+    The exact result when it is cached, otherwise an estimate from a random
+    sample: compute_sampled(size, population). With refine, the exact result is
+    computed in the background for later requests. Returns (result, metadata).
+    """
+    found, result = ds.cache.peek(key, ds.version())
+    if found:
+        return result, {"approximate": False}
+    population = ds.collection.estimated_document_count()
+    size = sampling.sample_size(population, sample)
+    result = compute_sampled(size, population)
+    if refine:
+        sampling.refine_in_background(f"{ds.name}:{key}", lambda: ds.cached(key, compute_exact))
+    return result, sampling.metadata(size, population, refine)
+
+def versioned(ds, key, since, compute):
+    """
+    compute()'s response tagged with the dataset version, or only what changed
+    since the client's `since` version (see deltas.py). The version is read
+    first, so a result is never labelled newer than the data it was built from.
+    A client already at the current version is answered without computing, and
+    otherwise the response comes from the result cache of this version.
+    """
+    version = ds.version()
+    if since is not None and since == version:
+        return {"version": version, "since": since, "unchanged": True}
+    return deltas.respond(ds.history, key, version, ds.cached(f"versioned:{key}", compute), since)
+
+def downsampled(response, field, max_points, method, x_field="date", y_field="count"):
+    """The response with its `field` series reduced to at most max_points rows (see downsample.py)"""
+    if method not in downsample.METHODS:
+        raise HTTPException(status_code=400, detail=f"downsampling must be one of: {', '.join(downsample.METHODS)}")
+    if max_points is not None and max_points < 1:
+        raise HTTPException(status_code=400, detail="max_points must be >= 1")
+    rows, meta = downsample.downsample(response[field], max_points, method, x_field, y_field)
+    return {**response, field: rows, "downsampled": meta} if meta else response
+
+def partitions_for(ds):
+    """$match filters of the dataset's partitions, one empty filter when it is too small to split"""
+    if (partitions.PARALLEL_PARTITIONS <= 1
+            or ds.collection.estimated_document_count() < partitions.PARALLEL_MIN_DOCUMENTS):
+        return [{}]
+    return ds.cached(f"partitions:{partitions.PARALLEL_PARTITIONS}",
+                     lambda: partitions.partition_matches(ds.collection, partitions.PARALLEL_PARTITIONS))
+
+def build_indexes():
+    for ds in datasets.all():
+        try:
+            ds.build_indexes()
+        except errors.PyMongoError as e:
+            # Requests rebuild the in-process indexes on demand once MongoDB is back
+            print(f"❌ Error building indexes for {ds.name}:", e)
+
+def warm_up():
+    """Run the heavy aggregations once per dataset so the first users hit a warm cache"""
+    started = time.perf_counter()
+    for ds in datasets.all():
+        for endpoint in WARMUP_ENDPOINTS:
+            try:
+                endpoint(ds=ds)
+            except Exception as e:
+                print(f"❌ Warm-up of {endpoint.__name__} failed for {ds.name}:", e)
+    print(f"Warm-up finished in {time.perf_counter() - started:.1f}s")
 
 @app.get("/")
 def read_root():
     return {"message": "Certificate Analytics API", "version": "1.0"}
 
+@app.get("/healthz")
+def liveness():
+    """Liveness: the process is up and serving requests (never touches MongoDB)"""
+    return {"status": "ok"}
+
+@app.get("/readyz")
+def readiness():
+    """Readiness: MongoDB is reachable. Does not block on server selection."""
+    client = get_client()
+    if not client.topology_description.has_readable_server():
+        # Kick off server selection in the background so the next probe can succeed
+        threading.Thread(target=_ping, daemon=True).start()
+        return JSONResponse(status_code=503, content={"status": "unavailable", "database": False})
+    default = datasets.get()
+    return {
+        "status": "ready",
+        "database": True,
+        "search_index_ready": default.domain_index.ready,
+        "calendar_ready": default.validity_calendar.ready,
+    }
+
+def _ping():
+    try:
+        get_client().admin.command("ping")
+    except errors.PyMongoError:
+        pass
+
+@app.get("/api/engine/memory")
+def get_engine_memory(ds: Dataset = Depends(get_dataset)):
+    """Memory used by the columnar analytics engine for this dataset"""
+    columns = columns_for(ds)
+    if columns is None:
+        raise HTTPException(status_code=404, detail="The columnar analytics engine is not enabled (ANALYTICS_ENGINE=columnar)")
+    return columns.memory_report()
+
+@app.get("/api/engine/offload")
+def get_offload_metrics():
+    """Process pool used for CPU-bound stages: runs, rows, chunks and time spent"""
+    return offload.metrics()
+
+@app.get("/api/admission")
+def get_admission_stats():
+    """Concurrency, queue and rejection metrics per cost class (this worker process)"""
+    return {"worker_pid": os.getpid(), "classes": {name: c.stats() for name, c in ADMISSION_CLASSES.items()}}
+
+@app.get("/api/datasets")
+def list_datasets():
+    """Datasets served by this process, with the state of their indexes and caches"""
+    loaded = datasets.datasets
+    return {
+        "default": datasets.default,
+        "worker_pid": os.getpid(),
+        "shared_cache": shared_cache.stats() if shared_cache else None,
+        "datasets": [
+            {
+                "name": name,
+                "loaded": name in loaded,
+                "indexes_built": name in loaded and loaded[name].indexes_built,
+                "state_loaded": loaded[name].state_loaded if name in loaded else [],
+                "search_index_ready": name in loaded and loaded[name].domain_index.ready,
+                "calendar_ready": name in loaded and loaded[name].validity_calendar.ready,
+                "cardinality_ready": name in loaded and loaded[name].cardinality.ready,
+                "cache": loaded[name].cache.stats() if name in loaded else None,
+                "delta_history": loaded[name].history.stats() if name in loaded else None,
+            }
+            for name in datasets.names
+        ],
+    }
+
 # New debug endpoint to fetch and return the first few documents
 @app.get("/api/debug/first_docs")
-def get_first_docs(limit: int = 5):
+def get_first_docs(limit: int = 5, ds: Dataset = Depends(get_dataset)):
     """
     Debug endpoint to return the first N documents from the collection.
     Use this to verify the collection contents and structure.
     """
-    docs = list(certificates_collection.find({}, {"_id": 0}).limit(limit))
-    total_count = certificates_collection.count_documents({})
+    docs = list(ds.certificates.find({}, {"_id": 0}).limit(limit))
+    total_count = ds.certificates.count_documents({})
     return {
-        "db_name": DB_NAME,
+        "db_name": ds.name,
         "collection_name": "certificates",
         "total_documents": total_count,
         "first_docs": docs
     }
 
+def count_expiring(ds, start, end):
+    """
+    Certificates with start < not_after <= end, the bounds of the expiring rows: the whole days in
+    between from the validity calendar, the partial first and last day from the not_after index
+    """
+    next_day = datetime(start.year, start.month, start.day) + timedelta(days=1)
+    last_day = datetime(end.year, end.month, end.day)
+    if next_day > last_day:
+        return ds.certificates.count_documents({"not_after": {"$gt": start, "$lte": end}})
+    ds.validity_calendar.refresh_if_stale(ds.collection)
+    return (ds.certificates.count_documents({"not_after": {"$gt": start, "$lt": next_day}})
+            + ds.validity_calendar.count_expiring(next_day, last_day - timedelta(days=1))
+            + ds.certificates.count_documents({"not_after": {"$gte": last_day, "$lte": end}}))
+
+def horizon_counts(ds, now, horizons):
+    """Certificates expiring within each horizon, counted like the /api/expiring total"""
+    return {str(days): count_expiring(ds, now, now + timedelta(days=days)) for days in horizons}
+
 @app.get("/api/overview")
-def get_overview():
-    now = datetime.utcnow().isoformat()
-    soon = (datetime.utcnow() + timedelta(days=30)).isoformat()
+def get_overview(as_of: str = None, ds: Dataset = Depends(get_dataset)):
+    boundary = as_of_boundary(as_of)
+    ds.validity_calendar.refresh_if_stale(ds.collection)
+
+    if boundary:
+        # Historical snapshot: counts come straight from the per-day rollups
+        snapshot = ds.validity_calendar.snapshot(boundary)
+        total = snapshot["issued"]
+        active = snapshot["active"]
+        expired = snapshot["expired"]
+        expiring_soon = count_expiring(ds, boundary, boundary + timedelta(days=30))
+    else:
+        now = datetime.utcnow().isoformat()
+        total = ds.certificates.count_documents({})
+        active = ds.certificates.count_documents({"parsed.validity.end": {"$gt": now}})
+        expired = ds.certificates.count_documents({"parsed.validity.end": {"$lt": now}})
+        # Same window as /api/expiring
+        start = datetime.utcnow()
+        expiring_soon = count_expiring(ds, start, start + timedelta(days=30))
 
-    total = certificates_collection.count_documents({})
-    active = certificates_collection.count_documents({"parsed.validity.end": {"$gt": now}})
-    expired = certificates_collection.count_documents({"parsed.validity.end": {"$lt": now}})
-    expiring_soon = certificates_collection.count_documents({"parsed.validity.end": {"$gt": now, "$lt": soon}})
+    types = group_counts(ds, "signature_algorithm", as_of)
 
-    types = list(certificates_collection.aggregate([
-        {"$group": {"_id": "$parsed.signature_algorithm.name", "count": {"$sum": 1}}},
-        {"$sort": {"count": -1}}
-    ]))
+    issuers = group_counts(ds, "issuer_cn", as_of)
 
-    issuers = list(certificates_collection.aggregate([
-        {"$group": {"_id": "$parsed.issuer.common_name", "count": {"$sum": 1}}},
-        {"$sort": {"count": -1}}
-    ]))
+    # Approximate distinct counts over the whole dataset (HyperLogLog)
+    ds.cardinality.refresh_if_stale(ds.collection)
 
     return {
         "total": total,
@@ -81,43 +524,49 @@ def get_overview():
         "expired": expired,
         "expiring_soon": expiring_soon,
         "types": types,
-        "issuers": issuers
+        "issuers": issuers,
+        "distinct": ds.cardinality.estimates(),
+        "distinct_relative_error": ds.cardinality.relative_errors()["total"],
     }
 
 @app.get("/api/certificates")
-def get_certificates():
-    certs = list(certificates_collection.find({}, {"_id": 0}))
+def get_certificates(ds: Dataset = Depends(get_dataset)):
+    certs = collect(ds.certificates.find({}, {"_id": 0}))
     for cert in certs:
         cert["issue_date"] = cert.get("parsed", {}).get("validity", {}).get("start")
         cert["expiry_date"] = cert.get("parsed", {}).get("validity", {}).get("end")
     return certs
 
 @app.get("/api/certificates/active")
-def get_active_certificates():
+def get_active_certificates(as_of: str = None, ds: Dataset = Depends(get_dataset)):
+    boundary = as_of_boundary(as_of)
+    if boundary:
+        return collect(ds.certificates.find(active_at(boundary), {"_id": 0}))
     now = datetime.utcnow().isoformat()
-    certs = list(certificates_collection.find({"parsed.validity.end": {"$gt": now}}, {"_id": 0}))
+    certs = collect(ds.certificates.find({"parsed.validity.end": {"$gt": now}}, {"_id": 0}))
     return certs
 
 @app.get("/api/certificates/expired")
-def get_expired_certificates():
+def get_expired_certificates(as_of: str = None, ds: Dataset = Depends(get_dataset)):
+    boundary = as_of_boundary(as_of)
+    if boundary:
+        return collect(ds.certificates.find(expired_at(boundary), {"_id": 0}))
     now = datetime.utcnow().isoformat()
-    certs = list(certificates_collection.find({"parsed.validity.end": {"$lt": now}}, {"_id": 0}))
+    certs = collect(ds.certificates.find({"parsed.validity.end": {"$lt": now}}, {"_id": 0}))
     return certs
 
 @app.get("/api/types")
-def get_certificate_types():
-    types = list(certificates_collection.aggregate([
-        {"$group": {"_id": "$parsed.signature_algorithm.name", "count": {"$sum": 1}}},
-        {"$sort": {"count": -1}}
-    ]))
-    return {"types": types}
+def get_certificate_types(as_of: str = None, since: str = None, ds: Dataset = Depends(get_dataset)):
+    return versioned(ds, f"types:{as_of}", since,
+                     lambda: {"types": group_counts(ds, "signature_algorithm", as_of)})
 
 @app.get("/api/timeline")
-def get_issuance_timeline():
+def get_issuance_timeline(max_points: int = None, downsampling: str = "lttb", since: str = None,
+                          ds: Dataset = Depends(get_dataset)):
 
-    try:
+    def build_timeline():
         # Fetch only the start dates to limit bandwidth
-        cursor = certificates_collection.find(
+        cursor = ds.certificates.find(
             {"parsed.validity.start": {"$exists": True}},
             {"_id": 0, "parsed.validity.start": 1}
         )
@@ -138,82 +587,128 @@ def get_issuance_timeline():
             counts[key] = counts.get(key, 0) + 1
 
         # Build sorted timeline list
-        timeline = [
+        return [
             {"date": f"{year}-{month:02d}-01", "count": counts[(year, month)]}
             for (year, month) in sorted(counts.keys())
         ]
 
-        return {"timeline": timeline}
+    def compute_timeline():
+        columns = columns_for(ds)
+        timeline = columns.timeline() if columns is not None else ds.cached("timeline", build_timeline)
+        return downsampled({"timeline": timeline}, "timeline", max_points, downsampling)
+
+    try:
+        return versioned(ds, f"timeline:{max_points}:{downsampling}", since, compute_timeline)
+    except HTTPException:
+        raise
     except Exception as e:
         # Provide a clearer error message in the response for debugging
         raise HTTPException(status_code=500, detail=f"Error building timeline: {e}")
 
 @app.get("/api/issuers")
-def get_top_issuers():
-    issuers = list(certificates_collection.aggregate([
-        {"$group": {"_id": "$parsed.issuer.common_name", "count": {"$sum": 1}}},
-        {"$sort": {"count": -1}}
-    ]))
-    return {"issuers": issuers}
+def get_top_issuers(as_of: str = None, since: str = None, ds: Dataset = Depends(get_dataset)):
+    return versioned(ds, f"issuers:{as_of}", since, lambda: {"issuers": group_counts(ds, "issuer_cn", as_of)})
 
 @app.get("/api/expiring")
-def get_expiring_certificates():
-    now = datetime.utcnow().isoformat()
-    soon = (datetime.utcnow() + timedelta(days=30)).isoformat()
-    certs = list(certificates_collection.find({"parsed.validity.end": {"$gt": now, "$lt": soon}}, {"_id": 0}))
+def get_expiring_certificates(days: int = 30, issuer: str = None, page: int = 1, page_size: int = 100, ds: Dataset = Depends(get_dataset)):
+    """Certificates expiring within the next `days` days, soonest first, optionally for one issuer CN"""
+    if days < 0:
+        raise HTTPException(status_code=400, detail="days must be >= 0")
+    page = max(page, 1)
+    page_size = max(1, min(page_size, 1000))
+
+    now = datetime.utcnow()
+    query = {"not_after": {"$gt": now, "$lte": now + timedelta(days=days)}}
+    if issuer:
+        query["parsed.issuer.common_name"] = issuer
+        total = ds.certificates.count_documents(query)
+    else:
+        total = count_expiring(ds, now, now + timedelta(days=days))
+
+    # Served straight from the not_after index, no date parsing per document
+    certs = list(ds.certificates.find(query, {"_id": 0})
+                 .sort("not_after", 1)
+                 .skip((page - 1) * page_size)
+                 .limit(page_size))
     for cert in certs:
-        expiry = cert.get("parsed", {}).get("validity", {}).get("end")
-        if expiry:
-            cert["days_remaining"] = (datetime.fromisoformat(expiry.replace("Z", "")) - datetime.utcnow()).days
-    return {"expiring": certs}
+        cert["days_remaining"] = (cert["not_after"] - now).days
+    return {"expiring": certs, "total": total, "days": days, "page": page, "page_size": page_size}
+
+@app.get("/api/cardinality-trends")
+def get_cardinality_trends(dimensions: str = None, cumulative: bool = False, ds: Dataset = Depends(get_dataset)):
+    """
+    Approximate distinct DNS names, registrable domains, subject CNs, issuer
+    organizations and key fingerprints per month of issuance (cumulative=true:
+    distinct values issued up to and including each month).
+    """
+    selected = [d.strip() for d in dimensions.split(",") if d.strip()] if dimensions else list(cardinality.DIMENSIONS)
+    unknown = [d for d in selected if d not in cardinality.DIMENSIONS]
+    if unknown:
+        raise HTTPException(status_code=400, detail=f"Unknown dimensions: {', '.join(unknown)}")
+    ds.cardinality.refresh_if_stale(ds.collection)
+    return {
+        "dimensions": selected,
+        "cumulative": cumulative,
+        "relative_standard_error": ds.cardinality.relative_errors(),
+        "trends": ds.cardinality.trends(selected, cumulative),
+    }
+
+@app.get("/api/expiring/summary")
+def get_expiring_summary(horizons: str = "7,30,90", histogram_days: int = 90, ds: Dataset = Depends(get_dataset)):
+    """Expiring counts for several horizons plus a per-day histogram, mostly served from the expiry calendar"""
+    try:
+        horizon_days = [int(h) for h in horizons.split(",") if h.strip()]
+    except ValueError:
+        raise HTTPException(status_code=400, detail="horizons must be a comma separated list of days")
+
+    ds.validity_calendar.refresh_if_stale(ds.collection)
+    now = datetime.utcnow()
+    return {
+        "counts": horizon_counts(ds, now, horizon_days),
+        "histogram": ds.validity_calendar.histogram(now, now + timedelta(days=histogram_days)),
+    }
 
 @app.get("/api/regions")
-def get_region_breakdown():
-    regions = list(certificates_collection.aggregate([
-        {"$group": {"_id": "$parsed.issuer.country", "count": {"$sum": 1}}},
-        {"$sort": {"count": -1}}
-    ]))
-    return {"regions": regions}
+def get_region_breakdown(as_of: str = None, since: str = None, ds: Dataset = Depends(get_dataset)):
+    return versioned(ds, f"regions:{as_of}", since, lambda: {"regions": group_counts(ds, "issuer_country", as_of)})
 
 @app.get("/api/departments")
-def get_department_distribution():
-    departments = list(certificates_collection.aggregate([
-        {"$group": {"_id": "$parsed.issuer.organization", "count": {"$sum": 1}}},
-        {"$sort": {"count": -1}}
-    ]))
-    return {"departments": departments}
+def get_department_distribution(as_of: str = None, since: str = None, ds: Dataset = Depends(get_dataset)):
+    return versioned(ds, f"departments:{as_of}", since,
+                     lambda: {"departments": group_counts(ds, "issuer_org", as_of)})
 
 # Mock ML Endpoints
 @app.get("/api/ml/predict-expiry")
-def predict_expiry():
+def predict_expiry(ds: Dataset = Depends(get_dataset)):
     """Mock endpoint that simulates ML predictions for certificate expiry risk"""
     # Get active certificates
-    active_certs = list(certificates_collection.find({"status": "Active"}, {"_id": 0}))
-    predictions = []
-    
+    active_certs = list(ds.certificates.find({"status": "Active"}, {"_id": 0}))
+    now = datetime.now()
     for cert in active_certs:
+        cert["days_remaining"] = (cert["expiry_date"] - now).days
         # Convert datetime objects for JSON serialization
         cert["issue_date"] = cert["issue_date"].isoformat()
         cert["expiry_date"] = cert["expiry_date"].isoformat()
-        
-        # Mock risk calculation based on various factors
-        days_until_expiry = (datetime.fromisoformat(cert["expiry_date"]) - datetime.now()).days
-        auto_renewal_factor = 0.3 if cert["auto_renewal"] else 0.7
-        
-        # Risk calculation combines days until expiry, key strength, auto-renewal status
-        risk_score = min(10, max(0, 
-            (1.0 - (days_until_expiry / 365)) * 7 +  # Time factor
-            (1.0 - (cert["key_strength"] / 4096)) * 1.5 +  # Key strength factor
-            auto_renewal_factor +  # Auto-renewal factor
-            random.uniform(-1, 1)  # Add some randomness
-        ))
-        
+
+    # Score in the process pool (offload.py) so large inputs do not hold the GIL
+    scores = offload.run_columns(
+        scoring.expiry_risk,
+        {
+            "days_remaining": array("d", (cert["days_remaining"] for cert in active_certs)),
+            "key_strength": array("d", (cert["key_strength"] for cert in active_certs)),
+            "auto_renewal": array("b", (bool(cert["auto_renewal"]) for cert in active_certs)),
+        },
+        {"risk_score": "d"},
+    )["risk_score"]
+
+    predictions = []
+    for cert, risk_score in zip(active_certs, scores):
         predictions.append({
             "certificate_id": cert["certificate_id"],
             "name": cert["name"],
             "expiry_date": cert["expiry_date"],
-            "days_remaining": days_until_expiry,
-            "risk_score": round(risk_score, 1),
+            "days_remaining": cert["days_remaining"],
+            "risk_score": risk_score,
             "risk_category": "High" if risk_score > 7 else "Medium" if risk_score > 4 else "Low",
             "recommendations": get_mock_recommendations(risk_score, cert)
         })
@@ -223,9 +718,9 @@ def predict_expiry():
     return {"predictions": predictions}
 
 @app.get("/api/ml/anomalies")
-def detect_anomalies():
+def detect_anomalies(ds: Dataset = Depends(get_dataset)):
     """Mock endpoint that simulates ML anomaly detection"""
-    certificates = list(certificates_collection.find({}, {"_id": 0}))
+    certificates = list(ds.certificates.find({}, {"_id": 0}))
     anomalies = []
     
     # Simulate finding a few anomalies
@@ -296,199 +791,213 @@ def get_anomaly_recommendation(anomaly_type, cert):
     else:
         return "Investigate anomaly and take appropriate action"
 
+# Bucket boundaries (in days / number of SANs) for the distribution endpoints
+VALIDITY_BOUNDARIES = [0, 30, 90, 180, 365, 730, 1095, 1825, 3650]
+VALIDITY_LABELS = ["< 30 days", "30-90 days", "90-180 days", "180-365 days", "1-2 years", "2-3 years",
+                   "3-5 years", "5-10 years", "> 10 years"]
+SAN_BOUNDARIES = [0, 1, 2, 3, 5, 10, 20, 50, 100]
+
+def histogram_for(ds, field, binning="explicit", boundaries=None, bins=10, base=2, group_by=None, group_limit=20,
+                  issuer=None, as_of=None):
+    """Histogram of a certificate field, from the columnar engine when enabled, else one cached aggregation"""
+    histograms.validate(field, binning, group_by)
+    boundary = as_of_boundary(as_of)
+    columns = columns_for(ds) if histograms.supports_columnar(field) else None
+    if columns is not None:
+        mask = columns.active_mask(boundary)
+        if issuer:
+            issuer_mask = columns.value_mask("issuer_cn", issuer)
+            mask = issuer_mask if mask is None else mask & issuer_mask
+        return histograms.histogram(ds.certificates, field, binning, boundaries, bins, base, group_by, group_limit,
+                                    columns=columns, column_mask=mask)
+
+    match = active_at(boundary) if boundary else {}
+    if issuer:
+        match["parsed.issuer.common_name"] = issuer
+    key = "histogram:" + json.dumps([field, binning, boundaries, bins, base, group_by, group_limit, issuer, as_of])
+
+    def compute():
+        # Validity fields and the as_of filter read the native dates, which new certificates may not have yet
+        backfill_validity_dates(ds.collection)
+        return histograms.histogram(ds.certificates, field, binning, boundaries, bins, base, group_by, group_limit,
+                                    match=match)
+
+    return ds.cached(key, compute)
+
 @app.get("/api/validity-distribution")
-def get_validity_distribution():
+def get_validity_distribution(as_of: str = None, ds: Dataset = Depends(get_dataset)):
     """Endpoint that returns the distribution of certificate validity periods"""
-    valid_periods = list(certificates_collection.aggregate([
-        {
-            "$project": {
-                "validity_days": {
-                    "$divide": [
-                        {"$subtract": [
-                            {"$toDate": "$parsed.validity.end"},
-                            {"$toDate": "$parsed.validity.start"}
-                        ]},
-                        1000 * 60 * 60 * 24  # Convert milliseconds to days
-                    ]
-                }
-            }
-        },
-        {
-            "$bucket": {
-                "groupBy": "$validity_days",
-                "boundaries": [0, 30, 90, 180, 365, 730, 1095, 1825, 3650],
-                "default": "3650+",
-                "output": {
-                    "count": {"$sum": 1}
-                }
-            }
-        }
-    ]))
-    
+    distribution = histogram_for(ds, "validity_days", boundaries=VALIDITY_BOUNDARIES, as_of=as_of)
     return {
         "validity_periods": [
-            {"range": "< 30 days", "count": next((item["count"] for item in valid_periods if item["_id"] == 0), 0)},
-            {"range": "30-90 days", "count": next((item["count"] for item in valid_periods if item["_id"] == 30), 0)},
-            {"range": "90-180 days", "count": next((item["count"] for item in valid_periods if item["_id"] == 90), 0)},
-            {"range": "180-365 days", "count": next((item["count"] for item in valid_periods if item["_id"] == 180), 0)},
-            {"range": "1-2 years", "count": next((item["count"] for item in valid_periods if item["_id"] == 365), 0)},
-            {"range": "2-3 years", "count": next((item["count"] for item in valid_periods if item["_id"] == 730), 0)},
-            {"range": "3-5 years", "count": next((item["count"] for item in valid_periods if item["_id"] == 1095), 0)},
-            {"range": "5-10 years", "count": next((item["count"] for item in valid_periods if item["_id"] == 1825), 0)},
-            {"range": "> 10 years", "count": next((item["count"] for item in valid_periods if item["_id"] == "3650+"), 0)}
+            {"range": label, "count": bucket["count"]}
+            for label, bucket in zip(VALIDITY_LABELS, distribution["buckets"])
         ]
     }
 
 @app.get("/api/hash-algorithms")
-def get_hash_algorithms():
+def get_hash_algorithms(as_of: str = None, since: str = None, ds: Dataset = Depends(get_dataset)):
     """Endpoint that returns the distribution of hash algorithms used in certificates"""
-    hash_algorithms = list(certificates_collection.aggregate([
-        {"$group": {"_id": "$parsed.signature_algorithm.hash_algorithm", "count": {"$sum": 1}}},
-        {"$sort": {"count": -1}}
-    ]))
-    return {"hash_algorithms": hash_algorithms}
+    return versioned(ds, f"hash-algorithms:{as_of}", since,
+                     lambda: {"hash_algorithms": group_counts(ds, "hash_algorithm", as_of)})
 
 @app.get("/api/signature-algorithms")
-def get_signature_algorithms():
+def get_signature_algorithms(as_of: str = None, since: str = None, ds: Dataset = Depends(get_dataset)):
     """Endpoint that returns the distribution of signature algorithms used in certificates"""
-    sig_algorithms = list(certificates_collection.aggregate([
-        {"$group": {"_id": "$parsed.signature_algorithm.name", "count": {"$sum": 1}}},
-        {"$sort": {"count": -1}}
-    ]))
-    return {"signature_algorithms": sig_algorithms}
+    return versioned(ds, f"signature-algorithms:{as_of}", since,
+                     lambda: {"signature_algorithms": group_counts(ds, "signature_algorithm", as_of)})
 
 @app.get("/api/certificate-authorities")
-def get_certificate_authorities():
+def get_certificate_authorities(as_of: str = None, since: str = None, ds: Dataset = Depends(get_dataset)):
     """Endpoint that returns the distribution of root certificate authorities"""
-    cas = list(certificates_collection.aggregate([
-        {"$group": {"_id": "$parsed.issuer.common_name", "count": {"$sum": 1}}},
-        {"$sort": {"count": -1}}
-    ]))
-    return {"certificate_authorities": cas}
+    return versioned(ds, f"certificate-authorities:{as_of}", since,
+                     lambda: {"certificate_authorities": group_counts(ds, "issuer_cn", as_of)})
 
 @app.get("/api/intermediate-cas")
-def get_intermediate_cas():
-    """Endpoint that returns the distribution of intermediate certificate authorities"""
+def get_intermediate_cas(ds: Dataset = Depends(get_dataset)):
+    """Intermediate CAs by number of certificates issued, from the CA graph"""
     try:
-        intermediate_cas = list(certificates_collection.aggregate([
-            {
-                "$match": {
-                    "$and": [
-                        {"parsed.issuer.common_name": {"$exists": True}},
-                        {"parsed.subject.common_name": {"$exists": True}},
-                        {"$expr": {"$ne": ["$parsed.issuer.common_name", "$parsed.subject.common_name"]}}
-                    ]
-                }
-            },
-            {"$group": {"_id": "$parsed.subject.common_name", "count": {"$sum": 1}}},
-            {"$sort": {"count": -1}}
-        ]))
-
+        ds.ca_graph.refresh_if_stale(ds.collection)
+        intermediates = sorted(ds.ca_graph.by_role("intermediate"), key=lambda node: -node.issued)
+        intermediate_cas = [
+            {"_id": node.common_name or node.dn, "dn": node.dn, "count": node.issued, "depth": node.depth,
+             "inferred": node.inferred}
+            for node in intermediates
+        ]
         return {"intermediate_cas": intermediate_cas}
 
     except Exception as e:
         print("❌ Error:", e)
         raise HTTPException(status_code=500, detail=f"Error computing intermediate CAs: {e}")
 
+@app.get("/api/ca-graph")
+def get_ca_graph(role: str = None, ds: Dataset = Depends(get_dataset)):
+    """
+    The CA hierarchy: every CA with its role (root / intermediate), chain depth,
+    parents, children and leaf counts, plus certificates per role and leaf
+    certificates per chain depth.
+    """
+    if role not in (None, "root", "intermediate"):
+        raise HTTPException(status_code=400, detail=f"Unknown role: {role}")
+    ds.ca_graph.refresh_if_stale(ds.collection)
+    nodes = [node for node in ds.ca_graph.nodes.values() if role is None or node.role == role]
+    nodes.sort(key=lambda node: (node.depth if node.depth is not None else 99, -node.issued))
+    return {
+        **ds.ca_graph.summary(),
+        "cas": [{**node.as_dict(), "subtree_leaves": ds.ca_graph.subtree_leaves(node.dn)} for node in nodes],
+    }
+
 
 @app.get("/api/san-distribution")
-def get_san_distribution():
+def get_san_distribution(as_of: str = None, ds: Dataset = Depends(get_dataset)):
     """Endpoint that returns the distribution of Subject Alternative Names (SAN) counts"""
-    san_counts = list(certificates_collection.aggregate([
-        {
-            "$project": {
-                "san_count": {"$size": {"$ifNull": ["$parsed.extensions.subject_alt_name.dns_names", []]}}
-            }
-        },
-        {
-            "$bucket": {
-                "groupBy": "$san_count",
-                "boundaries": [0, 1, 2, 3, 5, 10, 20, 50, 100],
-                "default": "100+",
-                "output": {
-                    "count": {"$sum": 1}
-                }
-            }
-        }
-    ]))
-    
+    distribution = histogram_for(ds, "san_count", boundaries=SAN_BOUNDARIES, as_of=as_of)
     return {
         "san_distribution": [
-            {"range": "0", "count": next((item["count"] for item in san_counts if item["_id"] == 0), 0)},
-            {"range": "1", "count": next((item["count"] for item in san_counts if item["_id"] == 1), 0)},
-            {"range": "2-3", "count": next((item["count"] for item in san_counts if item["_id"] == 2), 0)},
-            {"range": "4-5", "count": next((item["count"] for item in san_counts if item["_id"] == 3), 0)},
-            {"range": "5-10", "count": next((item["count"] for item in san_counts if item["_id"] == 5), 0)},
-            {"range": "10-20", "count": next((item["count"] for item in san_counts if item["_id"] == 10), 0)},
-            {"range": "20-50", "count": next((item["count"] for item in san_counts if item["_id"] == 20), 0)},
-            {"range": "50-100", "count": next((item["count"] for item in san_counts if item["_id"] == 50), 0)},
-            {"range": "> 100", "count": next((item["count"] for item in san_counts if item["_id"] == "100+"), 0)}
+            {"range": bucket["label"], "count": bucket["count"]} for bucket in distribution["buckets"]
         ]
     }
 
+@app.get("/api/histogram")
+def get_histogram(field: str, boundaries: str = None, binning: str = "explicit", bins: int = 10, base: int = 2,
+                  group_by: str = None, group_limit: int = 20, issuer: str = None, as_of: str = None,
+                  ds: Dataset = Depends(get_dataset)):
+    """
+    Histogram of a numeric field (validity_days, san_count, key_size) with
+    explicit boundaries ("0,30,90,365"), log-scale or equal-count ("auto")
+    buckets, optionally per issuer / signature_algorithm / issue_year.
+    """
+    try:
+        parsed_boundaries = histograms.parse_boundaries(boundaries) if boundaries else None
+        return histogram_for(ds, field, binning, parsed_boundaries, max(1, min(bins, 100)), base, group_by,
+                             max(1, min(group_limit, 200)), issuer, as_of)
+    except ValueError as e:
+        raise HTTPException(status_code=400, detail=str(e))
+
 @app.get("/api/san-domains")
-def get_san_domains():
+def get_san_domains(ds: Dataset = Depends(get_dataset)):
     """Endpoint that returns the most common domains in Subject Alternative Names"""
-    pipeline = [
+    stages = [
         {"$unwind": {"path": "$parsed.extensions.subject_alt_name.dns_names", "preserveNullAndEmptyArrays": False}},
         {"$group": {"_id": "$parsed.extensions.subject_alt_name.dns_names", "count": {"$sum": 1}}},
-        {"$sort": {"count": -1}},
-        {"$limit": 20}
     ]
-    domains = list(certificates_collection.aggregate(pipeline))
+    domains = ds.cached("san-domains", lambda: partitions.top_groups(
+        ds.certificates, partitions_for(ds), stages, 20, "parsed.extensions.subject_alt_name.dns_names"))
     return {"san_domains": domains}
 
 @app.get("/api/validity-trends")
-def get_validity_trends():
-    """Endpoint that returns validity period trends over time"""
-    trends = list(certificates_collection.aggregate([
-        {
-            "$project": {
-                "year_issued": {"$year": {"$toDate": "$parsed.validity.start"}},
-                "validity_days": {
-                    "$divide": [
-                        {"$subtract": [
-                            {"$toDate": "$parsed.validity.end"},
-                            {"$toDate": "$parsed.validity.start"}
-                        ]},
-                        1000 * 60 * 60 * 24  # Convert milliseconds to days
-                    ]
-                }
-            }
-        },
-        {
-            "$group": {
-                "_id": "$year_issued",
-                "avg_validity": {"$avg": "$validity_days"},
-                "count": {"$sum": 1}
-            }
-        },
-        {"$sort": {"_id": 1}}
-    ]))
-    
-    return {"validity_trends": trends}
+def get_validity_trends(approx: bool = False, sample: int = sampling.DEFAULT_SAMPLE, refine: bool = True,
+                        max_points: int = None, downsampling: str = "lttb", since: str = None,
+                        ds: Dataset = Depends(get_dataset)):
+    """
+    Endpoint that returns validity period trends over time (approx=true: estimated from a random sample;
+    max_points: downsampled on average validity)
+    """
+    def reduce(response):
+        return downsampled(response, "validity_trends", max_points, downsampling, "_id", "avg_validity")
 
+    key = f"validity-trends:{max_points}:{downsampling}"
+    columns = columns_for(ds)
+    if columns is not None:
+        return versioned(ds, key, since, lambda: reduce({"validity_trends": columns.validity_trends()}))
 
-@app.get("/api/algorithm-trends")
-def get_algorithm_trends():
-    """Endpoint that returns algorithm usage trends over time"""
-    try:
-        # Fetch only the fields we need
-        cursor = certificates_collection.find(
+    def trends_pipeline(stages=()):
+        return list(stages) + [
             {
-                "parsed.validity.start": {"$exists": True},
-                "parsed.signature_algorithm.name": {"$exists": True}
+                "$project": {
+                    "year_issued": {"$year": {"$toDate": "$parsed.validity.start"}},
+                    "validity_days": {
+                        "$divide": [
+                            {"$subtract": [
+                                {"$toDate": "$parsed.validity.end"},
+                                {"$toDate": "$parsed.validity.start"}
+                            ]},
+                            1000 * 60 * 60 * 24  # Convert milliseconds to days
+                        ]
+                    }
+                }
             },
             {
-                "_id": 0,
-                "parsed.validity.start": 1,
-                "parsed.signature_algorithm.name": 1
-            }
-        )
+                "$group": {
+                    "_id": "$year_issued",
+                    "avg_validity": {"$avg": "$validity_days"},
+                    "count": {"$sum": 1},
+                    **({"std_validity": {"$stdDevSamp": "$validity_days"}} if stages else {})
+                }
+            },
+            {"$sort": {"_id": 1}}
+        ]
+
+    def compute_trends():
+        return list(ds.certificates.aggregate(trends_pipeline()))
+
+    if not approx:
+        return versioned(ds, key, since,
+                         lambda: reduce({"validity_trends": ds.cached("validity-trends", compute_trends)}))
+
+    def estimate_trends(size, population):
+        trends = list(ds.certificates.aggregate(trends_pipeline(sampling.sample_stages(size))))
+        for row in trends:
+            row["avg_validity_ci"] = sampling.mean_interval(row["avg_validity"], row.pop("std_validity"), row["count"])
+            sampling.scale(row, size, population)
+        return trends
 
+    trends, meta = approximate(ds, "validity-trends", compute_trends, estimate_trends, sample, refine)
+    return reduce({"validity_trends": trends, **meta})
+
+
+@app.get("/api/algorithm-trends")
+def get_algorithm_trends(approx: bool = False, sample: int = sampling.DEFAULT_SAMPLE, refine: bool = True,
+                         since: str = None, ds: Dataset = Depends(get_dataset)):
+    """Endpoint that returns algorithm usage trends over time (approx=true: estimated from a random sample)"""
+    columns = columns_for(ds)
+    if columns is not None:
+        return versioned(ds, "algorithm-trends", since, lambda: {"algorithm_trends": columns.algorithm_trends()})
+
+    def count_trends(docs):
         # Count occurrences of (year, algorithm)
         trends = {}
-        for doc in cursor:
+        for doc in docs:
             start = doc.get("parsed", {}).get("validity", {}).get("start")
             algorithm = doc.get("parsed", {}).get("signature_algorithm", {}).get("name")
 
@@ -514,228 +1023,646 @@ def get_algorithm_trends():
         # Sort by year for cleaner output
         sorted_result = sorted(result.items())
 
-        return {
-            "algorithm_trends": [
-                {"year": year, "algorithms": algos} for year, algos in sorted_result
-            ]
-        }
+        return [{"year": year, "algorithms": algos} for year, algos in sorted_result]
+
+    projection = {"_id": 0, "parsed.validity.start": 1, "parsed.signature_algorithm.name": 1}
+
+    def compute_trends():
+        # Fetch only the fields we need
+        return count_trends(ds.certificates.find(
+            {
+                "parsed.validity.start": {"$exists": True},
+                "parsed.signature_algorithm.name": {"$exists": True}
+            },
+            projection
+        ))
+
+    def estimate_trends(size, population):
+        trends = count_trends(ds.certificates.aggregate(sampling.sample_stages(size) + [{"$project": projection}]))
+        for year in trends:
+            for row in year["algorithms"]:
+                sampling.scale(row, size, population)
+        return trends
+
+    try:
+        if not approx:
+            return versioned(ds, "algorithm-trends", since,
+                             lambda: {"algorithm_trends": ds.cached("algorithm-trends", compute_trends)})
+        trends, meta = approximate(ds, "algorithm-trends", compute_trends, estimate_trends, sample, refine)
+        return {"algorithm_trends": trends, **meta}
 
     except Exception as e:
         raise HTTPException(status_code=500, detail=f"Error computing algorithm trends: {e}")
 
 
-
 @app.get("/api/issuer-organization")
-def get_issuer_organization():
+def get_issuer_organization(as_of: str = None, since: str = None, ds: Dataset = Depends(get_dataset)):
     """Endpoint that returns the distribution of issuer organizations"""
-    pipeline = [
-        {"$unwind": {"path": "$parsed.issuer.organization", "preserveNullAndEmptyArrays": True}},
-        {"$group": {"_id": "$parsed.issuer.organization", "count": {"$sum": 1}}},
-        {"$sort": {"count": -1}}
-    ]
-    organizations = list(certificates_collection.aggregate(pipeline))
-    return {"issuer_organizations": organizations}
+    return versioned(ds, f"issuer-organization:{as_of}", since,
+                     lambda: {"issuer_organizations": group_counts(ds, "issuer_org", as_of, unwind=True)})
 
 @app.get("/api/issuer-country")
-def get_issuer_country():
+def get_issuer_country(as_of: str = None, since: str = None, ds: Dataset = Depends(get_dataset)):
     """Endpoint that returns the distribution of issuer countries"""
-    pipeline = [
-        {"$unwind": {"path": "$parsed.issuer.country", "preserveNullAndEmptyArrays": True}},
-        {"$group": {"_id": "$parsed.issuer.country", "count": {"$sum": 1}}},
-        {"$sort": {"count": -1}}
-    ]
-    countries = list(certificates_collection.aggregate(pipeline))
-    return {"issuer_countries": countries}
+    return versioned(ds, f"issuer-country:{as_of}", since,
+                     lambda: {"issuer_countries": group_counts(ds, "issuer_country", as_of, unwind=True)})
 
 @app.get("/api/subject-common-names")
-def get_subject_common_names():
+def get_subject_common_names(ds: Dataset = Depends(get_dataset)):
     """Endpoint that returns the distribution of subject common names (owners)"""
-    pipeline = [
+    stages = [
         {"$unwind": {"path": "$parsed.subject.common_name", "preserveNullAndEmptyArrays": True}},
         {"$group": {"_id": "$parsed.subject.common_name", "count": {"$sum": 1}}},
-        {"$sort": {"count": -1}},
-        {"$limit": 50}  # Limit to top 50 to avoid overwhelming response
     ]
-    common_names = list(certificates_collection.aggregate(pipeline))
+    # Limit to top 50 to avoid overwhelming response
+    common_names = ds.cached("subject-common-names",
+                             lambda: partitions.top_groups(ds.certificates, partitions_for(ds), stages, 50,
+                                                          "parsed.subject.common_name"))
     return {"subject_common_names": common_names}
 
 @app.get("/api/ca-domain-analysis")
-def get_ca_domain_analysis():
-    """Endpoint that returns analysis of CAs vs Domain Names"""
+def get_ca_domain_analysis(approx: bool = False, sample: int = sampling.DEFAULT_SAMPLE, refine: bool = True,
+                           ds: Dataset = Depends(get_dataset)):
+    """Endpoint that returns analysis of CAs vs Domain Names (approx=true: estimated from a random sample)"""
     pipeline = [
-        {"$unwind": {"path": "$parsed.issuer.organization", "preserveNullAndEmptyArrays": True}},
         {"$unwind": {"path": "$parsed.extensions.subject_alt_name.dns_names", "preserveNullAndEmptyArrays": True}},
         {
             "$group": {
                 "_id": {
-                    "ca": "$parsed.issuer.organization",
+                    "issuer": "$issuer_id",
                     "domain": {"$arrayElemAt": [{"$split": ["$parsed.extensions.subject_alt_name.dns_names", "."]}, -2]}
                 },
                 "count": {"$sum": 1}
             }
         },
-        {"$sort": {"count": -1}},
-        {
-            "$group": {
-                "_id": "$_id.ca",
-                "domains": {
-                    "$push": {
-                        "domain": "$_id.domain",
-                        "count": "$count"
-                    }
-                },
-                "total": {"$sum": "$count"}
-            }
-        },
-        {"$sort": {"total": -1}}
     ]
-    ca_domains = list(certificates_collection.aggregate(pipeline))
-    return {"ca_domains": ca_domains}
+
+    def compute_ca_domains(stages=()):
+        ds.issuers.refresh_if_stale(ds.collection, ds.version())
+        cas = {}
+        for row in ds.certificates.aggregate(list(stages) + pipeline):
+            domain = row["_id"].get("domain")
+            for ca in ds.issuers.values(row["_id"].get("issuer"), "organization"):
+                entry = cas.setdefault(ca, {"_id": ca, "domains": {}, "total": 0})
+                entry["domains"][domain] = entry["domains"].get(domain, 0) + row["count"]
+                entry["total"] += row["count"]
+        result = [
+            {
+                "_id": entry["_id"],
+                "domains": [{"domain": domain, "count": count}
+                            for domain, count in sorted(entry["domains"].items(), key=lambda kv: -kv[1])],
+                "total": entry["total"],
+            }
+            for entry in cas.values()
+        ]
+        result.sort(key=lambda entry: -entry["total"])
+        return result
+
+    if not approx:
+        return {"ca_domains": ds.cached("ca-domain-analysis", compute_ca_domains)}
+
+    def estimate_ca_domains(size, population):
+        ca_domains = compute_ca_domains(sampling.sample_stages(size))
+        for entry in ca_domains:
+            sampling.scale(entry, size, population, ("total",), unwound=True)
+            for domain in entry["domains"]:
+                sampling.scale(domain, size, population, unwound=True)
+        return ca_domains
+
+    ca_domains, meta = approximate(ds, "ca-domain-analysis", compute_ca_domains, estimate_ca_domains, sample, refine)
+    return {"ca_domains": ca_domains, **meta}
 
 
 @app.get("/api/ca-url-analysis")
-def get_ca_url_analysis():
+def get_ca_url_analysis(ds: Dataset = Depends(get_dataset)):
     """Endpoint that returns analysis of CAs vs URLs"""
-    try:
-        # Only fetch the fields we actually need
-        cursor = certificates_collection.find(
-            {
+    dns_names = "$parsed.extensions.subject_alt_name.dns_names"
+
+    def compute_ca_urls():
+        rows = issuer_rows(
+            ds,
+            [{"$match": {
                 "parsed.extensions.subject_alt_name.dns_names": {"$exists": True},
                 "parsed.issuer.organization": {"$exists": True}
+            }}],
+            {
+                "cert_count": {"$sum": 1},
+                "url_count": {"$sum": {"$cond": [{"$isArray": dns_names}, {"$size": dns_names}, 0]}},
             },
+        )
+        result = [
             {
-                "_id": 0,
-                "parsed.issuer.organization": 1,
-                "parsed.extensions.subject_alt_name.dns_names": 1
+                "ca": row["_id"],
+                "url_count": row["url_count"],
+                "cert_count": row["cert_count"],
+                "avg_urls_per_cert": row["url_count"] / row["cert_count"] if row["cert_count"] > 0 else 0
             }
-        )
-
-        ca_stats = {}
+            for row in ds.issuers.rollup(rows, "organization", ("url_count", "cert_count"))
+            if row["_id"] is not None
+        ]
+        # Sorted by URL count descending (by the rollup)
+        return result
 
-        for doc in cursor:
-            # Extract CA organization name
-            issuer_org = doc.get("parsed", {}).get("issuer", {}).get("organization")
-
-            # Handle cases where organization is a list or string
-            if isinstance(issuer_org, list):
-                orgs = issuer_org
-            elif isinstance(issuer_org, str):
-                orgs = [issuer_org]
-            else:
-                continue  # skip if malformed
-
-            # Extract list of URLs (DNS names)
-            dns_names = (
-                doc.get("parsed", {})
-                   .get("extensions", {})
-                   .get("subject_alt_name", {})
-                   .get("dns_names", [])
-            )
-
-            url_count = len(dns_names)
-
-            # Update counts for each CA organization
-            for org in orgs:
-                if not org:
-                    continue
-                if org not in ca_stats:
-                    ca_stats[org] = {"url_count": 0, "cert_count": 0}
-
-                ca_stats[org]["url_count"] += url_count
-                ca_stats[org]["cert_count"] += 1
-
-        # Compute averages and build response
-        result = []
-        for ca, stats in ca_stats.items():
-            avg_urls = (
-                stats["url_count"] / stats["cert_count"]
-                if stats["cert_count"] > 0 else 0
-            )
-            result.append({
-                "ca": ca,
-                "url_count": stats["url_count"],
-                "cert_count": stats["cert_count"],
-                "avg_urls_per_cert": avg_urls
-            })
-
-        # Sort by URL count descending
-        result.sort(key=lambda x: x["url_count"], reverse=True)
-
-        return {"ca_urls": result}
+    try:
+        return {"ca_urls": ds.cached("ca-url-analysis", compute_ca_urls)}
 
     except Exception as e:
         raise HTTPException(status_code=500, detail=f"Error computing CA-URL analysis: {e}")
 
 
-
-
-
 @app.get("/api/ca-pubkey-analysis")
-def get_ca_pubkey_analysis():
+def get_ca_pubkey_analysis(ds: Dataset = Depends(get_dataset)):
     """Endpoint that returns analysis of CAs vs Public Keys (looking for duplications)"""
     pipeline = [
-        {"$unwind": {"path": "$parsed.issuer.organization", "preserveNullAndEmptyArrays": True}},
         {
             "$group": {
                 "_id": {
-                    "ca": "$parsed.issuer.organization",
+                    "issuer": "$issuer_id",
                     "pubkey_fingerprint": "$parsed.subject_key_info.fingerprint_sha256"
                 },
                 "count": {"$sum": 1},
                 "domains": {"$push": {"$arrayElemAt": ["$parsed.subject.common_name", 0]}},
             }
         },
-        {"$match": {"count": {"$gt": 1}}},  # Only include duplicated keys
-        {"$sort": {"count": -1}},
+        {"$project": {"count": 1, "domains": {"$slice": ["$domains", 5]}}},
         {
             "$group": {
-                "_id": "$_id.ca",
-                "duplicated_keys": {
-                    "$push": {
-                        "pubkey_fingerprint": "$_id.pubkey_fingerprint",
-                        "count": "$count",
-                        "sample_domains": {"$slice": ["$domains", 5]}
-                    }
-                },
-                "total_duplications": {"$sum": 1}
+                "_id": "$_id.pubkey_fingerprint",
+                "issuers": {"$push": {"issuer": "$_id.issuer", "count": "$count", "domains": "$domains"}},
+                "total": {"$sum": "$count"}
             }
         },
-        {"$sort": {"total_duplications": -1}}
+        {"$match": {"total": {"$gt": 1}}},  # Only keys used more than once
     ]
-    ca_pubkeys = list(certificates_collection.aggregate(pipeline))
+
+    def compute_ca_pubkeys():
+        ds.issuers.refresh_if_stale(ds.collection, ds.version())
+        cas = {}
+        for row in ds.certificates.aggregate(pipeline):
+            # Issuers of the same canonical organization share their counts
+            per_ca = {}
+            for issuer in row["issuers"]:
+                for ca in ds.issuers.values(issuer.get("issuer"), "organization"):
+                    entry = per_ca.setdefault(ca, {"count": 0, "domains": []})
+                    entry["count"] += issuer["count"]
+                    entry["domains"] += issuer["domains"]
+            for ca, entry in per_ca.items():
+                if entry["count"] > 1:  # Only include duplicated keys
+                    cas.setdefault(ca, []).append({
+                        "pubkey_fingerprint": row["_id"],
+                        "count": entry["count"],
+                        "sample_domains": entry["domains"][:5]
+                    })
+        result = [
+            {"_id": ca, "duplicated_keys": sorted(keys, key=lambda key: -key["count"]), "total_duplications": len(keys)}
+            for ca, keys in cas.items()
+        ]
+        result.sort(key=lambda entry: -entry["total_duplications"])
+        return result
+
+    ca_pubkeys = ds.cached("ca-pubkey-analysis", compute_ca_pubkeys)
     return {"ca_pubkeys": ca_pubkeys}
 
 @app.get("/api/shared-pubkeys")
-def get_shared_pubkeys():
+def get_shared_pubkeys(ds: Dataset = Depends(get_dataset)):
     """Endpoint that returns analysis of shared public keys across certificates"""
-    pipeline = [
-        {
-            "$group": {
-                "_id": "$parsed.subject_key_info.fingerprint_sha256",
-                "count": {"$sum": 1},
-                "issuers": {"$addToSet": {"$arrayElemAt": ["$parsed.issuer.organization", 0]}},
-                "domains": {"$addToSet": {"$arrayElemAt": ["$parsed.subject.common_name", 0]}},
-                "certificates": {"$push": {
-                    "serial_number": "$parsed.serial_number",
-                    "issuer": {"$arrayElemAt": ["$parsed.issuer.organization", 0]},
-                    "subject": {"$arrayElemAt": ["$parsed.subject.common_name", 0]},
-                    "validity_start": "$parsed.validity.start",
-                    "validity_end": "$parsed.validity.end"
-                }}
-            }
-        },
-        {"$match": {"count": {"$gt": 1}}},  # Only include shared keys
-        {"$sort": {"count": -1}},
-        {"$limit": 100}  # Limit to top 100 to avoid overwhelming response
-    ]
-    shared_pubkeys = list(certificates_collection.aggregate(pipeline))
+    group = {
+        "$group": {
+            "_id": "$parsed.subject_key_info.fingerprint_sha256",
+            "count": {"$sum": 1},
+            "issuers": {"$addToSet": {"$arrayElemAt": ["$parsed.issuer.organization", 0]}},
+            "domains": {"$addToSet": {"$arrayElemAt": ["$parsed.subject.common_name", 0]}},
+            "certificates": {"$push": {
+                "serial_number": "$parsed.serial_number",
+                "issuer": {"$arrayElemAt": ["$parsed.issuer.organization", 0]},
+                "subject": {"$arrayElemAt": ["$parsed.subject.common_name", 0]},
+                "validity_start": "$parsed.validity.start",
+                "validity_end": "$parsed.validity.end"
+            }}
+        }
+    }
+
+    def compute_shared_pubkeys():
+        matches = partitions_for(ds)
+        if len(matches) == 1:
+            return list(ds.certificates.aggregate([
+                group,
+                {"$match": {"count": {"$gt": 1}}},  # Only include shared keys
+                {"$sort": {"count": -1}},
+                {"$limit": 100}  # Limit to top 100 to avoid overwhelming response
+            ]))
+        # Top 100 keys by count across partitions, then the details of the shared ones only
+        counts = partitions.top_groups(ds.certificates, matches, [
+            {"$group": {"_id": "$parsed.subject_key_info.fingerprint_sha256", "count": {"$sum": 1}}},
+        ], 100, "parsed.subject_key_info.fingerprint_sha256")
+        keys = [row["_id"] for row in counts if row["count"] > 1]
+        details = partitions.run_partitioned(ds.certificates, matches, [
+            {"$match": {"parsed.subject_key_info.fingerprint_sha256": {"$in": keys}}},
+            group,
+        ])
+        return partitions.top(partitions.merge_groups(details, sets=("issuers", "domains"), lists=("certificates",)), 100)
+
+    shared_pubkeys = ds.cached("shared-pubkeys", compute_shared_pubkeys)
     return {"shared_pubkeys": shared_pubkeys}
 
-# Shutdown MongoDB connection on app shutdown
-@app.on_event("shutdown")
-def shutdown_db_client():
-    client.close()
+@app.get("/api/key-clusters")
+def get_key_clusters(sort: str = "size", min_size: int = 2, page: int = 1, page_size: int = 50,
+                     ds: Dataset = Depends(get_dataset)):
+    """
+    Clusters of certificates connected by shared public keys, SAN DNS names or
+    (issuer, serial) pairs, largest first (sort=size|domains|keys). Built by the
+    batch job in clusters.py; see POST /api/key-clusters/rebuild.
+    """
+    page = max(page, 1)
+    page_size = max(1, min(page_size, 500))
+    try:
+        result = clusters.top_clusters(ds.db, sort, min_size, page, page_size)
+    except ValueError as e:
+        raise HTTPException(status_code=400, detail=str(e))
+    return {**result, "page": page, "page_size": page_size, "build": clusters.build_state(ds.db),
+            "building": clusters.is_running(ds.db)}
+
+@app.get("/api/key-clusters/lookup")
+def lookup_key_cluster(fingerprint: str = None, key_fingerprint: str = None, ds: Dataset = Depends(get_dataset)):
+    """Cluster of one certificate (by its SHA-256 fingerprint) or of a public key fingerprint"""
+    if not fingerprint and not key_fingerprint:
+        raise HTTPException(status_code=400, detail="Pass fingerprint or key_fingerprint")
+    cert, cluster = clusters.cluster_of(ds.db, ds.certificates, fingerprint, key_fingerprint)
+    if cert is None:
+        raise HTTPException(status_code=404, detail="Certificate not found")
+    return {"certificate": cert, "cluster": cluster, "singleton": cluster is None}
+
+@app.get("/api/key-clusters/{cluster}")
+def get_key_cluster(cluster: int, limit: int = 100, ds: Dataset = Depends(get_dataset)):
+    """One cluster and (up to `limit` of) its certificates"""
+    summary = ds.db[clusters.CLUSTERS_COLLECTION].find_one({"_id": cluster})
+    if summary is None:
+        raise HTTPException(status_code=404, detail=f"Unknown cluster: {cluster}")
+    summary["cluster"] = summary.pop("_id")
+    limit = max(1, min(limit, 1000))
+    return {**summary, "certificates": clusters.cluster_members(ds.db, ds.certificates, cluster, limit)}
+
+@app.post("/api/key-clusters/rebuild", status_code=202)
+def rebuild_key_clusters(ds: Dataset = Depends(get_dataset)):
+    """Start rebuilding the clusters in the background"""
+    started = clusters.rebuild_in_background(ds.collection)
+    return {"started": started, "building": True}
+
+def comparison_summary(ds):
+    """The distributions /api/compare diffs, computed once per dataset version"""
+    def compute():
+        validity = histogram_for(ds, "validity_days", boundaries=VALIDITY_BOUNDARIES)
+        return {
+            "issuers": group_counts(ds, "issuer_cn"),
+            "signature_algorithms": group_counts(ds, "signature_algorithm"),
+            "hash_algorithms": group_counts(ds, "hash_algorithm"),
+            "validity_periods": [
+                {"_id": label, "count": bucket["count"]}
+                for label, bucket in zip(VALIDITY_LABELS, validity["buckets"])
+            ],
+        }
+    return ds.cached("compare-summary", compute)
+
+@app.get("/api/compare")
+def compare_datasets(a: str, b: str, certificates: bool = True, limit: int = 100, horizons: str = "7,30,90"):
+    """Differences between two datasets: distributions, expiring counts and (certificates=true) fingerprint sets"""
+    try:
+        ds_a, ds_b = datasets.get(a), datasets.get(b)
+    except KeyError as e:
+        raise HTTPException(status_code=404, detail=f"Unknown dataset: {e.args[0]}")
+    try:
+        horizon_days = [int(h) for h in horizons.split(",") if h.strip()]
+    except ValueError:
+        raise HTTPException(status_code=400, detail="horizons must be a comma separated list of days")
+    limit = max(0, min(limit, 1000))
+
+    summary_a, summary_b = comparison_summary(ds_a), comparison_summary(ds_b)
+    now = datetime.utcnow()
+    expiring = []
+    for ds in (ds_a, ds_b):
+        ds.validity_calendar.refresh_if_stale(ds.collection)
+        counts = horizon_counts(ds, now, horizon_days)
+        expiring.append([{"_id": int(days), "count": count} for days, count in counts.items()])
+
+    result = {
+        "a": {"name": ds_a.name, "version": ds_a.version(), "total": ds_a.collection.estimated_document_count()},
+        "b": {"name": ds_b.name, "version": ds_b.version(), "total": ds_b.collection.estimated_document_count()},
+        "distributions": {name: compare.diff_counts(summary_a[name], summary_b[name]) for name in summary_a},
+        "expiring": sorted(compare.diff_counts(*expiring), key=lambda row: row["_id"]),
+    }
+    if certificates:
+        # Off the fingerprint indexes built at startup; cached with dataset a's results, for this version of b
+        result["certificates"] = ds_a.cached(
+            f"compare:{ds_b.name}:{ds_b.version()}:{limit}",
+            lambda: compare.diff_certificates(ds_a.certificates, ds_b.certificates, limit))
+    return result
+
+def compliance_match(ds, active=True, issuer=None):
+    """$match for the certificates a compliance query covers, after new certificates got their masks"""
+    ds.compliance.refresh_if_stale(ds.collection, ds.version())
+    match = {}
+    if active:
+        now = datetime.utcnow()
+        match.update(active_at(now))
+    if issuer:
+        ds.issuers.refresh_if_stale(ds.collection, ds.version())
+        match["issuer_id"] = {"$in": ds.issuers.ids("organization", issuer)}
+    return match
+
+@app.get("/api/compliance")
+def get_compliance(active: bool = True, issuer: str = None, ds: Dataset = Depends(get_dataset)):
+    """Violations of the weak-crypto rules per rule, per issuer organization and per month of issue"""
+    match = compliance_match(ds, active, issuer)
+    ds.issuers.refresh_if_stale(ds.collection, ds.version())
+
+    def compute():
+        violating, per_rule, per_issuer, per_month = compliance.summarize(
+            compliance.violation_groups(ds.certificates, match))
+        fields = ("violating", *compliance.ENABLED)
+        issuers = ds.issuers.rollup([{"_id": issuer_id, **counts} for issuer_id, counts in per_issuer.items()],
+                                    "organization", fields)
+        return {
+            "rules": compliance.describe_rules(),
+            "violating": violating,
+            "per_rule": [{"rule": name, "count": count} for name, count in per_rule.items()],
+            "per_issuer": issuers,
+            "per_month": [{"month": month, **counts} for month, counts in sorted(per_month.items(),
+                                                                                 key=lambda kv: kv[0] or "")],
+        }
+
+    # Active certificates change with the clock as well as the data: recomputed at least hourly
+    moment = datetime.utcnow().strftime("%Y-%m-%dT%H") if active else ""
+    return ds.cached(f"compliance:{active}:{issuer}:{moment}", compute)
+
+@app.get("/api/compliance/offenders")
+def get_compliance_offenders(rule: str, active: bool = True, issuer: str = None, page: int = 1, page_size: int = 100,
+                             ds: Dataset = Depends(get_dataset)):
+    """Certificates violating one rule, in compliance index order (by mask, then soonest expiry)"""
+    if rule not in compliance.ENABLED:
+        raise HTTPException(status_code=400, detail=f"rule must be one of: {', '.join(compliance.ENABLED)}")
+    page = max(page, 1)
+    page_size = max(1, min(page_size, 1000))
+
+    query = {**compliance_match(ds, active, issuer), compliance.COMPLIANCE_FIELD: {"$in": compliance.masks_with(rule)}}
+    total = ds.certificates.count_documents(query)
+    certs = list(ds.certificates.find(query, {"_id": 0})
+                 .sort([(compliance.COMPLIANCE_FIELD, 1), ("not_after", 1)])
+                 .skip((page - 1) * page_size)
+                 .limit(page_size))
+    for cert in certs:
+        cert["violations"] = compliance.rules_violated(cert.get(compliance.COMPLIANCE_FIELD, 0))
+    return {"offenders": certs, "rule": rule, "total": total, "page": page, "page_size": page_size}
+
+@app.get("/api/domains/coverage-gaps")
+def get_coverage_gaps(days: int = 30, suffix: str = None, page: int = 1, page_size: int = 100,
+                      ds: Dataset = Depends(get_dataset)):
+    """Registrable domains whose certificate coverage lapses within `days` days, soonest first"""
+    if days < 0:
+        raise HTTPException(status_code=400, detail="days must be >= 0")
+    page = max(page, 1)
+    page_size = max(1, min(page_size, 1000))
+    ds.domain_coverage.refresh_if_stale(ds.collection, ds.version())
+
+    now = datetime.utcnow()
+    # Recomputed at least hourly, as coverage lapses with the clock (the shared cache prunes old hours)
+    lapsing = ds.cached(f"coverage-gaps:{days}:{suffix}:{now:%Y-%m-%dT%H}",
+                        lambda: domain_coverage.lapsing_domains(ds.db, now, now + timedelta(days=days), suffix))
+    return {
+        "domains": lapsing[(page - 1) * page_size:page * page_size],
+        "total": len(lapsing),
+        "days": days,
+        "page": page,
+        "page_size": page_size,
+    }
+
+@app.get("/api/domains/{domain}")
+def get_domain_coverage(domain: str, limit: int = 100, ds: Dataset = Depends(get_dataset)):
+    """Certificates covering a registrable domain, its coverage intervals and gaps, and its issuers"""
+    registrable = registrable_domain(domain)
+    if registrable is None:
+        raise HTTPException(status_code=400, detail=f"Not a registrable domain: {domain}")
+    ds.domain_coverage.refresh_if_stale(ds.collection, ds.version())
+    ds.issuers.refresh_if_stale(ds.collection, ds.version())
+
+    entries = domain_coverage.domain_entries(ds.db, registrable)
+    now = datetime.utcnow()
+    merged = domain_coverage.merge_intervals((entry["not_before"], entry["not_after"]) for entry in entries)
+    lapses_at, covered_again_at = domain_coverage.lapse(merged, now)
+
+    issuers = {}
+    for entry in entries:
+        name = ds.issuers.canonical("organization", entry["issuer"])
+        issuer = issuers.setdefault(name, {"_id": name, "count": 0, "last_not_after": entry["not_after"]})
+        issuer["count"] += 1
+        issuer["last_not_after"] = max(issuer["last_not_after"], entry["not_after"])
+
+    return {
+        "domain": registrable,
+        "total": len(entries),
+        "covered": bool(merged) and lapses_at > now,
+        "covered_until": lapses_at if lapses_at > now else None,
+        "next_coverage": covered_again_at,
+        "coverage": [{"start": start, "end": end} for start, end in merged],
+        "gaps": [{"start": merged[i][1], "end": merged[i + 1][0]} for i in range(len(merged) - 1)],
+        "issuers": sorted(issuers.values(), key=lambda issuer: -issuer["count"]),
+        "certificates": sorted(entries, key=lambda entry: entry["not_after"], reverse=True)[:max(0, limit)],
+    }
+
+@app.get("/api/search")
+def search_domains(q: str, mode: str = "exact", limit: int = 50, ds: Dataset = Depends(get_dataset)):
+    """
+    Search certificates by subject CN / SAN DNS name.
+    Modes: exact ("www.example.pk"), prefix ("www.exa"), suffix ("example.pk"
+    matches example.pk and all its subdomains) and wildcard ("*.example.pk" or
+    any fnmatch-style pattern with a literal prefix or domain suffix, such as
+    "mail*.example.pk" or "*mail.example.pk").
+    """
+    if mode not in ("exact", "prefix", "suffix", "wildcard"):
+        raise HTTPException(status_code=400, detail=f"Unknown search mode: {mode}")
+    limit = max(1, min(limit, 1000))
+
+    started = time.perf_counter()
+    ds.domain_index.refresh_if_stale(ds.collection)
+    try:
+        names = ds.domain_index.search(q, mode, limit)
+    except ValueError as e:
+        raise HTTPException(status_code=400, detail=str(e))
+    cert_ids = ds.domain_index.cert_ids(names, limit)
+    took_ms = (time.perf_counter() - started) * 1000
+
+    certs = list(ds.certificates.find(
+        {"_id": {"$in": cert_ids}},
+        {
+            "_id": 0,
+            "parsed.subject.common_name": 1,
+            "parsed.issuer.common_name": 1,
+            "parsed.validity": 1,
+            "parsed.extensions.subject_alt_name.dns_names": 1,
+            "parsed.fingerprint_sha256": 1,
+        }
+    ))
+    return {
+        "query": q,
+        "mode": mode,
+        "matches": [{"name": name, "count": len(ds.domain_index.certs_by_name[name])} for name in names],
+        "certificates": certs,
+        "index_took_ms": round(took_ms, 3),
+    }
+
+def export_response(rows, columns, fmt, filename, batch_size):
+    if fmt not in export.FORMATS:
+        raise HTTPException(status_code=400, detail=f"Unknown export format: {fmt} (use csv, parquet or arrow)")
+    if not export.format_available(fmt):
+        raise HTTPException(status_code=501, detail=f"{fmt} export requires pyarrow to be installed")
+    media_type, extension = export.FORMATS[fmt]
+    return StreamingResponse(
+        export.stream(rows, columns, fmt, batch_size=max(100, min(batch_size, 100000))),
+        media_type=media_type,
+        headers={"Content-Disposition": f'attachment; filename="{filename}.{extension}"'},
+    )
+
+@app.get("/api/export/certificates")
+def export_certificates(format: str = "csv", fields: str = None, issuer: str = None, as_of: str = None,
+                        batch_size: int = 10000, ds: Dataset = Depends(get_dataset)):
+    """
+    Stream certificate rows as CSV, Parquet or Arrow IPC. `fields` is a comma
+    separated list of dotted paths (e.g. parsed.subject.common_name,not_after).
+    """
+    try:
+        columns = export.parse_fields(fields)
+    except ValueError as e:
+        raise HTTPException(status_code=400, detail=str(e))
+
+    query = {}
+    if issuer:
+        query["parsed.issuer.common_name"] = issuer
+    boundary = as_of_boundary(as_of)
+    if boundary:
+        query.update(active_at(boundary))
+
+    # Only the exported fields leave MongoDB; the cursor is consumed batch by batch while streaming
+    projection = {"_id": 0, **{field: 1 for field in columns}}
+    cursor = ds.certificates.find(query, projection).batch_size(max(100, min(batch_size, 100000)))
+    return export_response(export.certificate_rows(cursor, columns), columns, format,
+                           f"{ds.name}-certificates", batch_size)
+
+@app.get("/api/export/analytics/{name:path}")
+def export_analytics(name: str, format: str = "csv", batch_size: int = 10000, ds: Dataset = Depends(get_dataset)):
+    """Export the result of an analytics endpoint (e.g. issuers, timeline, ca-url-analysis) as a table"""
+    endpoint = EXPORTABLE_ANALYTICS.get(name)
+    if endpoint is None:
+        raise HTTPException(status_code=404, detail=f"Unknown analytics result: {name}")
+    result = endpoint(ds=ds)
+    records = next(value for value in result.values() if isinstance(value, list))
+    rows = [export.flatten_record(record) for record in records]
+
+    columns = []
+    for row in rows:
+        columns.extend(column for column in row if column not in columns)
+    return export_response(([row.get(column) for column in columns] for row in rows), columns, format,
+                           f"{ds.name}-{name.replace('/', '-')}", batch_size)
+
+# Analytics results available from /api/export/analytics/<name>
+EXPORTABLE_ANALYTICS = {
+    "types": get_certificate_types,
+    "timeline": get_issuance_timeline,
+    "issuers": get_top_issuers,
+    "regions": get_region_breakdown,
+    "departments": get_department_distribution,
+    "validity-distribution": get_validity_distribution,
+    "hash-algorithms": get_hash_algorithms,
+    "signature-algorithms": get_signature_algorithms,
+    "certificate-authorities": get_certificate_authorities,
+    "intermediate-cas": get_intermediate_cas,
+    "san-distribution": get_san_distribution,
+    "san-domains": get_san_domains,
+    "validity-trends": get_validity_trends,
+    "algorithm-trends": get_algorithm_trends,
+    "issuer-organization": get_issuer_organization,
+    "issuer-country": get_issuer_country,
+    "subject-common-names": get_subject_common_names,
+    "ca-domain-analysis": get_ca_domain_analysis,
+    "ca-url-analysis": get_ca_url_analysis,
+    "ca-pubkey-analysis": get_ca_pubkey_analysis,
+    "shared-pubkeys": get_shared_pubkeys,
+}
+
+# Live updates follow a change stream when MongoDB supports one (LIVE_UPDATES=polling forces
+# polling), checking for new certificates every LIVE_POLL_SECONDS otherwise
+LIVE_UPDATES = os.getenv("LIVE_UPDATES", "").lower() or None
+LIVE_POLL_SECONDS = float(os.getenv("LIVE_POLL_SECONDS", "5"))
+_live_feeds = {}
+_live_feeds_lock = threading.Lock()
+
+def live_dimensions(doc):
+    """Buckets a new certificate adds to, keyed like the endpoints' group _ids"""
+    parsed = doc.get("parsed", {})
+    # Inserted documents get their native dates on the next backfill
+    not_before, not_after = validity_dates(doc)
+    validity = None
+    if not_before is not None and not_after is not None:
+        days = (not_after - not_before).total_seconds() / 86400
+        index = bisect_right(VALIDITY_BOUNDARIES, days) - 1
+        validity = VALIDITY_BOUNDARIES[index] if 0 <= index < len(VALIDITY_BOUNDARIES) - 1 else "3650+"
+    now = datetime.utcnow()
+    return {
+        "types": parsed.get("signature_algorithm", {}).get("name"),
+        "issuers": parsed.get("issuer", {}).get("common_name"),
+        "status": "active" if not_after is not None and not_after > now else "expired",
+        "validity-distribution": validity,
+    }
+
+def live_feed(ds):
+    with _live_feeds_lock:
+        if ds.name not in _live_feeds:
+            _live_feeds[ds.name] = ChangeFeed(ds.collection, live_dimensions, on_change=ds.expire_version,
+                                              mode=LIVE_UPDATES, poll_seconds=LIVE_POLL_SECONDS)
+        return _live_feeds[ds.name]
+
+@app.get("/api/stream")
+async def stream_updates(ds: Dataset = Depends(get_dataset)):
+    """
+    Server-Sent Events with incremental updates for the dataset: a `hello`
+    event, then a `delta` event per batch of changes (inserted / deleted counts,
+    +n per bucket, new certificates expiring soon). A `resync` event means the
+    client fell behind and should reload.
+    """
+    feed = live_feed(ds)
+    queue = feed.subscribe()
+
+    async def events():
+        try:
+            yield sse("hello", {"dataset": ds.name, "mode": feed.mode, "id": feed.sequence})
+            while True:
+                try:
+                    event = await asyncio.wait_for(queue.get(), timeout=15)
+                except asyncio.TimeoutError:
+                    yield ": keep-alive\n\n"  # keeps proxies from closing an idle connection
+                    continue
+                yield sse(event["type"], event)
+        finally:
+            feed.unsubscribe(queue)
+
+    return StreamingResponse(events(), media_type="text/event-stream",
+                             headers={"Cache-Control": "no-cache", "X-Accel-Buffering": "no"})
+
+# Heavy aggregations precomputed by warm_up()
+WARMUP_ENDPOINTS = [
+    get_overview,
+    get_issuance_timeline,
+    get_validity_distribution,
+    get_san_distribution,
+    get_san_domains,
+    get_validity_trends,
+    get_algorithm_trends,
+    get_ca_domain_analysis,
+    get_ca_url_analysis,
+    get_ca_pubkey_analysis,
+    get_shared_pubkeys,
+]
 
 if __name__ == "__main__":
     import uvicorn
-    uvicorn.run("app:app", host="0.0.0.0", port=8000, reload=True)
\ No newline at end of file
+    # Auto-reload is for development only (RELOAD=1); it doubles start-up time
+    uvicorn.run("app:app", host="0.0.0.0", port=int(os.getenv("PORT", "8000")),
+                reload=os.getenv("RELOAD", "").lower() in ("1", "true", "yes"))
\ No newline at end of file
@@ -0,0 +1,165 @@
+"""
+Benchmarks for the Certificate Analytics API.
+
+Starts the API in a subprocess (against the MONGO_URI / DB_NAME configured in
+the environment or .env) and reports:
+
+- cold start: time until /healthz answers (process up, accepting traffic) and
+  until /readyz reports the database reachable
+- per-endpoint latency: first (cold) request, then median / p95 of warm requests
+- throughput scaling: requests/second with 1..N uvicorn workers under
+  concurrent load (results are shared between workers through the SQLite
+  result cache)
+
+Usage:
+    python bench.py                 # default endpoint set
+    python bench.py --runs 20 --endpoints /api/overview /api/timeline
+    python bench.py --workers 1 2 4 --duration 15
+"""
+import argparse
+import concurrent.futures
+import os
+import statistics
+import subprocess
+import sys
+import time
+import urllib.error
+import urllib.request
+
+DEFAULT_ENDPOINTS = [
+    "/api/overview",
+    "/api/types",
+    "/api/timeline",
+    "/api/expiring/summary",
+    "/api/validity-distribution",
+    "/api/san-domains",
+    "/api/ca-domain-analysis",
+    "/api/shared-pubkeys",
+]
+
+
+def get(url, timeout=300):
+    """GET a URL; returns (status, seconds)"""
+    started = time.perf_counter()
+    try:
+        with urllib.request.urlopen(url, timeout=timeout) as response:
+            response.read()
+            status = response.status
+    except urllib.error.HTTPError as e:
+        status = e.code
+    return status, time.perf_counter() - started
+
+
+def wait_for(url, expected_status=200, timeout=120):
+    """Poll url until it returns expected_status; returns the seconds waited"""
+    started = time.perf_counter()
+    while time.perf_counter() - started < timeout:
+        try:
+            status, _ = get(url, timeout=2)
+            if status == expected_status:
+                return time.perf_counter() - started
+        except (urllib.error.URLError, ConnectionError, OSError):
+            pass
+        time.sleep(0.02)
+    raise TimeoutError(f"{url} did not return {expected_status} within {timeout}s")
+
+
+def start_server(port, workers=1, extra_env=None):
+    env = dict(os.environ, **(extra_env or {}))
+    command = [sys.executable, "-m", "uvicorn", "app:app", "--host", "127.0.0.1", "--port", str(port),
+               "--log-level", "warning"]
+    if workers > 1:
+        command += ["--workers", str(workers)]
+    return subprocess.Popen(command, cwd=os.path.dirname(os.path.abspath(__file__)), env=env)
+
+
+def stop_server(process):
+    process.terminate()
+    try:
+        process.wait(timeout=10)
+    except subprocess.TimeoutExpired:
+        process.kill()
+
+
+def bench_cold_start(port):
+    started = time.perf_counter()
+    process = start_server(port)
+    try:
+        wait_for(f"http://127.0.0.1:{port}/healthz")
+        live = time.perf_counter() - started
+        wait_for(f"http://127.0.0.1:{port}/readyz")
+        ready = time.perf_counter() - started
+    finally:
+        stop_server(process)
+    print(f"cold start: live after {live * 1000:.0f} ms, ready after {ready * 1000:.0f} ms")
+
+
+def bench_endpoints(port, endpoints, runs):
+    process = start_server(port)
+    try:
+        wait_for(f"http://127.0.0.1:{port}/readyz")
+        print(f"{'endpoint':32} {'cold ms':>10} {'median ms':>10} {'p95 ms':>10}")
+        for endpoint in endpoints:
+            url = f"http://127.0.0.1:{port}{endpoint}"
+            _, cold = get(url)
+            warm = sorted(get(url)[1] for _ in range(runs))
+            p95 = warm[min(len(warm) - 1, int(len(warm) * 0.95))]
+            print(f"{endpoint:32} {cold * 1000:10.1f} {statistics.median(warm) * 1000:10.1f} {p95 * 1000:10.1f}")
+    finally:
+        stop_server(process)
+
+
+def bench_scaling(port, worker_counts, endpoints, duration, concurrency):
+    print(f"{'workers':>8} {'requests':>10} {'req/s':>10} {'errors':>8}")
+    baseline = None
+    for workers in worker_counts:
+        process = start_server(port, workers=workers)
+        try:
+            wait_for(f"http://127.0.0.1:{port}/readyz")
+            urls = [f"http://127.0.0.1:{port}{endpoint}" for endpoint in endpoints]
+            for url in urls:
+                get(url)  # make sure every result is cached before measuring
+
+            deadline = time.perf_counter() + duration
+
+            def client(offset):
+                done = errors = 0
+                i = offset
+                while time.perf_counter() < deadline:
+                    status, _ = get(urls[i % len(urls)])
+                    done += 1
+                    errors += status != 200
+                    i += 1
+                return done, errors
+
+            with concurrent.futures.ThreadPoolExecutor(max_workers=concurrency) as pool:
+                results = list(pool.map(client, range(concurrency)))
+            requests = sum(done for done, _ in results)
+            errors = sum(errs for _, errs in results)
+            rate = requests / duration
+            baseline = baseline or rate
+            print(f"{workers:>8} {requests:>10} {rate:>10.1f} {errors:>8}   ({rate / baseline:.2f}x)")
+        finally:
+            stop_server(process)
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("--port", type=int, default=8765)
+    parser.add_argument("--runs", type=int, default=10, help="warm requests per endpoint")
+    parser.add_argument("--endpoints", nargs="*", default=DEFAULT_ENDPOINTS)
+    parser.add_argument("--workers", type=int, nargs="*",
+                        help="measure throughput with each of these worker counts, e.g. --workers 1 2 4")
+    parser.add_argument("--duration", type=float, default=10, help="seconds of load per worker count")
+    parser.add_argument("--concurrency", type=int, default=32, help="concurrent client threads")
+    args = parser.parse_args()
+
+    if args.workers:
+        bench_scaling(args.port, args.workers, args.endpoints, args.duration, args.concurrency)
+        return
+    bench_cold_start(args.port)
+    bench_endpoints(args.port, args.endpoints, args.runs)
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,246 @@
+"""
+CA hierarchy graph: issuer DN -> subject DN edges between certificate authorities.
+
+Every certificate adds one to the `issued` counter of its issuer DN. CA
+certificates (basicConstraints CA:TRUE or self-signed) also add an edge from
+their issuer to their subject DN, marked self-signed when both are equal.
+The counters and edges are kept in the small `ca_graph` collection, updated
+incrementally by _id watermark like the validity calendar, and loaded into
+memory, where roles (root / intermediate), chain depths and per-CA leaf
+counts are derived by walking the graph instead of comparing fields on every
+certificate.
+
+Scan datasets mostly hold leaf certificates, so many CAs appear only as
+issuers. A CA whose own certificate is not in the dataset is presumed to be an
+intermediate if it issues leaves (the Baseline Requirements forbid issuing
+leaves from roots) and a root otherwise; such nodes are marked `inferred`.
+"""
+import threading
+import time
+
+from pymongo import UpdateOne, errors
+
+from validity_calendar import STATE_COLLECTION
+
+GRAPH_COLLECTION = "ca_graph"
+# Bump when the stored graph format changes so it is rebuilt from scratch
+GRAPH_VERSION = 1
+
+
+def _first(value):
+    if isinstance(value, list):
+        return value[0] if value else None
+    return value
+
+
+class CANode:
+    __slots__ = ("dn", "common_name", "organization", "issued", "issued_ca", "parents", "children",
+                 "self_signed", "has_certificate", "role", "inferred", "depth")
+
+    def __init__(self, doc):
+        self.dn = doc["_id"]
+        self.common_name = doc.get("common_name")
+        self.organization = doc.get("organization")
+        self.issued = doc.get("issued", 0)
+        self.issued_ca = doc.get("issued_ca", 0)
+        self.parents = [parent for parent in doc.get("parents", []) if parent != self.dn]
+        self.children = []
+        self.self_signed = doc.get("self_signed", False)
+        self.has_certificate = doc.get("has_certificate", False)
+        self.role = None
+        self.inferred = False
+        self.depth = None
+
+    @property
+    def leaves(self):
+        """Leaf (non-CA) certificates issued directly by this CA"""
+        return self.issued - self.issued_ca
+
+    def as_dict(self):
+        return {
+            "dn": self.dn,
+            "common_name": self.common_name,
+            "organization": self.organization,
+            "role": self.role,
+            "inferred": self.inferred,
+            "self_signed": self.self_signed,
+            "depth": self.depth,
+            "parents": self.parents,
+            "children": self.children,
+            "issued": self.issued,
+            "leaves": self.leaves,
+        }
+
+
+class CAGraph:
+    """The CA graph, persisted in Mongo and cached in memory with derived roles and depths"""
+
+    def __init__(self, refresh_seconds=60):
+        self.refresh_seconds = refresh_seconds
+        self.nodes = {}
+        self.last_refresh = 0.0
+        self.ready = False
+        self._lock = threading.Lock()
+
+    def refresh(self, collection):
+        """Add the edges of new certificates to the stored graph, then reload it"""
+        with self._lock:
+            db = collection.database
+            state = db[STATE_COLLECTION]
+            graph = db[GRAPH_COLLECTION]
+
+            latest = collection.find_one({}, {"_id": 1}, sort=[("_id", -1)])
+            if latest is not None:
+                max_id = latest["_id"]
+                previous = state.find_one({"_id": GRAPH_COLLECTION}) or {}
+                if previous and previous.get("version") != GRAPH_VERSION:
+                    state.delete_one({"_id": GRAPH_COLLECTION})
+                    graph.drop()
+                    previous = {}
+                last_id = previous.get("last_id")
+                if last_id != max_id:
+                    # Claim the range first so concurrent workers never count it twice
+                    try:
+                        claimed = state.update_one(
+                            {"_id": GRAPH_COLLECTION, "last_id": last_id},
+                            {"$set": {"last_id": max_id, "version": GRAPH_VERSION}},
+                            upsert=last_id is None,
+                        )
+                    except errors.DuplicateKeyError:
+                        claimed = None  # another worker created the state first
+                    if claimed and (claimed.modified_count or claimed.upserted_id is not None):
+                        self._add_range(collection, graph, last_id, max_id)
+
+            self._load(graph)
+            self.last_refresh = time.monotonic()
+            self.ready = True
+
+    def _add_range(self, collection, graph, after_id, max_id):
+        id_range = {"$lte": max_id}
+        if after_id is not None:
+            id_range["$gt"] = after_id
+        is_ca = {"$or": [
+            {"$eq": ["$parsed.extensions.basic_constraints.is_ca", True]},
+            {"$eq": ["$parsed.issuer_dn", "$parsed.subject_dn"]},
+        ]}
+        rows = collection.aggregate([
+            {"$match": {"_id": id_range, "parsed.issuer_dn": {"$type": "string"}}},
+            {"$group": {
+                "_id": {
+                    "issuer": "$parsed.issuer_dn",
+                    "ca_subject": {"$cond": [is_ca, "$parsed.subject_dn", None]},
+                },
+                "count": {"$sum": 1},
+                "issuer_cn": {"$first": "$parsed.issuer.common_name"},
+                "issuer_org": {"$first": "$parsed.issuer.organization"},
+                "subject_cn": {"$first": "$parsed.subject.common_name"},
+                "subject_org": {"$first": "$parsed.subject.organization"},
+            }},
+        ])
+        updates = []
+        for row in rows:
+            issuer, subject = row["_id"]["issuer"], row["_id"].get("ca_subject")
+            increments = {"issued": row["count"]}
+            if subject:
+                increments["issued_ca"] = row["count"]
+            updates.append(UpdateOne(
+                {"_id": issuer},
+                {"$inc": increments,
+                 "$setOnInsert": {"common_name": _first(row["issuer_cn"]), "organization": _first(row["issuer_org"])}},
+                upsert=True,
+            ))
+            if not subject:
+                continue
+            if subject == issuer:
+                updates.append(UpdateOne({"_id": subject}, {"$set": {"self_signed": True, "has_certificate": True}}))
+            else:
+                updates.append(UpdateOne(
+                    {"_id": subject},
+                    {"$addToSet": {"parents": issuer},
+                     "$set": {"has_certificate": True},
+                     "$setOnInsert": {"common_name": _first(row["subject_cn"]),
+                                      "organization": _first(row["subject_org"])}},
+                    upsert=True,
+                ))
+        if updates:
+            graph.bulk_write(updates, ordered=False)
+
+    def _load(self, graph):
+        nodes = {doc["_id"]: CANode(doc) for doc in graph.find()}
+        for node in nodes.values():
+            node.parents = [parent for parent in node.parents if parent in nodes]
+            for parent in node.parents:
+                nodes[parent].children.append(node.dn)
+        _classify(nodes)
+        self.nodes = nodes
+
+    def refresh_if_stale(self, collection):
+        if not self.ready or time.monotonic() - self.last_refresh > self.refresh_seconds:
+            self.refresh(collection)
+
+    def by_role(self, role):
+        return [node for node in self.nodes.values() if node.role == role]
+
+    def subtree_leaves(self, dn):
+        """Leaf certificates issued anywhere below a CA, each CA counted once"""
+        seen, stack, total = {dn}, [dn], 0
+        while stack:
+            node = self.nodes[stack.pop()]
+            total += node.leaves
+            for child in node.children:
+                if child not in seen:
+                    seen.add(child)
+                    stack.append(child)
+        return total
+
+    def chain_depths(self):
+        """Leaf certificates per chain length (root = depth 0, so a leaf under one intermediate has depth 2)"""
+        depths = {}
+        for node in self.nodes.values():
+            if node.leaves and node.depth is not None:
+                depths[node.depth + 1] = depths.get(node.depth + 1, 0) + node.leaves
+        return dict(sorted(depths.items()))
+
+    def summary(self):
+        ca_certificates = sum(node.issued_ca for node in self.nodes.values())
+        self_signed = sum(1 for node in self.nodes.values() if node.self_signed)
+        return {
+            "roots": len(self.by_role("root")),
+            "intermediates": len(self.by_role("intermediate")),
+            "certificates": {
+                "root": self_signed,
+                "intermediate": ca_certificates - self_signed,
+                "leaf": sum(node.leaves for node in self.nodes.values()),
+            },
+            "chain_depths": self.chain_depths(),
+        }
+
+
+def _classify(nodes):
+    """Assign roles, then depths breadth-first from the roots (cross-signed CAs take their shortest chain)"""
+    for node in nodes.values():
+        if node.self_signed:
+            node.role = "root"
+        elif node.parents:
+            node.role = "intermediate"
+        else:
+            node.role = "intermediate" if node.leaves else "root"
+            node.inferred = True
+
+    # Intermediates without a known parent sit under a root that is not in the dataset
+    starts = {0: [node for node in nodes.values() if node.role == "root"],
+              1: [node for node in nodes.values() if node.role == "intermediate" and not node.parents]}
+    frontier, depth = [], 0
+    while frontier or depth in starts:
+        for node in starts.get(depth, []):
+            if node.depth is None:
+                node.depth = depth
+                frontier.append(node)
+        following = []
+        for node in frontier:
+            for child in node.children:
+                child = nodes[child]
+                if child.depth is None:
+                    child.depth = depth + 1
+                    following.append(child)
+        frontier, depth = following, depth + 1
@@ -0,0 +1,168 @@
+"""
+Approximate distinct counts per dataset, kept in HyperLogLog sketches.
+
+For every dimension (DNS names, registrable domains, subject CNs, issuer
+organizations, public key fingerprints) there is one sketch over the whole
+dataset and one per month of issuance (not_before). New certificates are
+added incrementally by _id watermark, like the search index. Monthly sketches
+merge into the distinct count of any range of months without rescanning.
+"""
+import threading
+import time
+
+import warm_state
+from domains import registrable_domain
+from hll import HyperLogLog
+from validity_calendar import backfill_validity_dates
+
+DIMENSIONS = ("dns_names", "registrable_domains", "subject_cns", "issuer_orgs", "key_fingerprints")
+
+
+def _strings(value):
+    if isinstance(value, str):
+        value = [value]
+    return {item.strip().lower() for item in value or [] if isinstance(item, str) and item.strip()}
+
+
+def dimension_values(doc):
+    """The values a certificate contributes to each dimension"""
+    parsed = doc.get("parsed", {})
+    dns_names = _strings(parsed.get("extensions", {}).get("subject_alt_name", {}).get("dns_names"))
+    fingerprint = parsed.get("subject_key_info", {}).get("fingerprint_sha256")
+    return {
+        "dns_names": dns_names,
+        "registrable_domains": {domain for domain in map(registrable_domain, dns_names) if domain},
+        "subject_cns": _strings(parsed.get("subject", {}).get("common_name")),
+        "issuer_orgs": _strings(parsed.get("issuer", {}).get("organization")),
+        "key_fingerprints": {fingerprint} if fingerprint else set(),
+    }
+
+
+class CardinalityIndex:
+
+    PROJECTION = {
+        "_id": 1,
+        "not_before": 1,
+        "parsed.extensions.subject_alt_name.dns_names": 1,
+        "parsed.subject.common_name": 1,
+        "parsed.issuer.organization": 1,
+        "parsed.subject_key_info.fingerprint_sha256": 1,
+    }
+
+    def __init__(self, refresh_seconds=60, precision=14, monthly_precision=12):
+        self.refresh_seconds = refresh_seconds
+        self.precision = precision
+        self.monthly_precision = monthly_precision
+        self.totals = {dimension: HyperLogLog(precision) for dimension in DIMENSIONS}
+        self.monthly = {}
+        self.last_id = None
+        self.rows = 0
+        self.last_refresh = 0.0
+        self.ready = False
+        self._estimates = None
+        self._lock = threading.Lock()
+
+    def refresh(self, collection):
+        """Add the certificates inserted since the last refresh"""
+        with self._lock:
+            cursor = []
+            latest = collection.find_one({}, {"_id": 1}, sort=[("_id", -1)])
+            if latest is not None:
+                # Native dates first: the watermark moves past every certificate read here
+                backfill_validity_dates(collection, latest["_id"])
+                id_range = {"$lte": latest["_id"]}
+                if self.last_id is not None:
+                    id_range["$gt"] = self.last_id
+                cursor = collection.find({"_id": id_range}, self.PROJECTION).sort("_id", 1).batch_size(5000)
+            added = 0
+            for doc in cursor:
+                values = dimension_values(doc)
+                not_before = doc.get("not_before")
+                month = None
+                if hasattr(not_before, "strftime"):
+                    month = self.monthly.setdefault(not_before.strftime("%Y-%m"), {})
+                for dimension, items in values.items():
+                    for item in items:
+                        self.totals[dimension].add(item)
+                        if month is not None:
+                            if dimension not in month:
+                                month[dimension] = HyperLogLog(self.monthly_precision)
+                            month[dimension].add(item)
+                self.last_id = doc["_id"]
+                added += 1
+            if added:
+                self.rows += added
+                self._estimates = None
+            self.last_refresh = time.monotonic()
+            self.ready = True
+            return added
+
+    def save_state(self, path):
+        with self._lock:
+            if not self.ready:
+                return
+            document = {
+                "last_id": self.last_id,
+                "rows": self.rows,
+                "precision": self.precision,
+                "monthly_precision": self.monthly_precision,
+                "totals": {dimension: sketch.to_bytes() for dimension, sketch in self.totals.items()},
+                "monthly": {
+                    month: {dimension: sketch.to_bytes() for dimension, sketch in sketches.items()}
+                    for month, sketches in self.monthly.items()
+                },
+            }
+        warm_state.save_document(path, document)
+
+    def load_state(self, path, collection):
+        """Resume from sketches saved by save_state if they still match the collection; returns whether they did"""
+        document = warm_state.load_document(path)
+        if (document is None or document["precision"] != self.precision
+                or document["monthly_precision"] != self.monthly_precision
+                or set(document["totals"]) != set(DIMENSIONS)
+                or not warm_state.covers(collection, document["last_id"], document["rows"])):
+            return False
+        with self._lock:
+            self.totals = {dimension: HyperLogLog.from_bytes(data) for dimension, data in document["totals"].items()}
+            self.monthly = {
+                month: {dimension: HyperLogLog.from_bytes(data) for dimension, data in sketches.items()}
+                for month, sketches in document["monthly"].items()
+            }
+            self.last_id = document["last_id"]
+            self.rows = document["rows"]
+            self._estimates = None
+        return True
+
+    def refresh_if_stale(self, collection):
+        if not self.ready or time.monotonic() - self.last_refresh > self.refresh_seconds:
+            self.refresh(collection)
+
+    def estimates(self):
+        """Estimated distinct values per dimension over the whole dataset"""
+        if self._estimates is None:
+            self._estimates = {dimension: sketch.count() for dimension, sketch in self.totals.items()}
+        return self._estimates
+
+    def trends(self, dimensions=DIMENSIONS, cumulative=False):
+        """Per month of issuance: distinct values issued that month (or up to and including it)"""
+        with self._lock:
+            months = sorted(self.monthly)
+            running = {dimension: HyperLogLog(self.monthly_precision) for dimension in dimensions}
+            result = []
+            for month in months:
+                row = {"month": month}
+                for dimension in dimensions:
+                    sketch = self.monthly[month].get(dimension)
+                    if cumulative:
+                        if sketch is not None:
+                            running[dimension].merge(sketch)
+                        sketch = running[dimension]
+                    row[dimension] = sketch.count() if sketch is not None else 0
+                result.append(row)
+            return result
+
+    def relative_errors(self):
+        return {
+            "total": round(self.totals[DIMENSIONS[0]].relative_error, 4),
+            "monthly": round(HyperLogLog(self.monthly_precision).relative_error, 4),
+        }
@@ -0,0 +1,312 @@
+"""
+Key-reuse clusters: connected components of certificates linked by a shared
+public key, a shared SAN DNS name or a shared (issuer, serial number).
+
+A batch job streams (certificate, key fingerprint, DNS names, serial) tuples
+from MongoDB and joins them with an array-backed union-find (union by size,
+path halving), which runs in near-linear time. A second streaming pass
+summarizes every cluster of two or more certificates. The results are written
+to `key_clusters` (one document per cluster, numbered by size) and
+`key_cluster_members` (certificate _id -> cluster), each built in a temporary
+collection and swapped in with a rename so readers never see a partial build.
+Certificates that are not in `key_cluster_members` are singletons.
+
+Run it with `python clusters.py [dataset ...]` or POST /api/key-clusters/rebuild.
+"""
+import threading
+import time
+from array import array
+from datetime import datetime
+
+from pymongo import ASCENDING, DESCENDING
+
+from domains import registrable_domain
+from validity_calendar import STATE_COLLECTION
+
+CLUSTERS_COLLECTION = "key_clusters"
+MEMBERS_COLLECTION = "key_cluster_members"
+LINKS = ("keys", "names", "serials")
+
+PROJECTION = {
+    "_id": 1,
+    "not_before": 1,
+    "parsed.subject_key_info.fingerprint_sha256": 1,
+    "parsed.extensions.subject_alt_name.dns_names": 1,
+    "parsed.serial_number": 1,
+    "parsed.issuer.common_name": 1,
+    "parsed.issuer_dn": 1,
+}
+
+# Sample sizes stored per cluster
+SAMPLE_SIZE = 10
+
+
+class UnionFind:
+    """Disjoint sets over 0..n-1 in two flat integer arrays"""
+
+    def __init__(self):
+        self.parent = array("q")
+        self.size = array("q")
+
+    def add(self):
+        index = len(self.parent)
+        self.parent.append(index)
+        self.size.append(1)
+        return index
+
+    def find(self, index):
+        parent = self.parent
+        while parent[index] != index:
+            parent[index] = parent[parent[index]]  # path halving
+            index = parent[index]
+        return index
+
+    def union(self, a, b):
+        a, b = self.find(a), self.find(b)
+        if a == b:
+            return a
+        if self.size[a] < self.size[b]:
+            a, b = b, a
+        self.parent[b] = a
+        self.size[a] += self.size[b]
+        return a
+
+
+def _link_keys(doc, links):
+    """The link keys of a certificate: any two certificates sharing one end up in the same cluster"""
+    parsed = doc.get("parsed", {})
+    keys = []
+    if "keys" in links:
+        fingerprint = parsed.get("subject_key_info", {}).get("fingerprint_sha256")
+        if fingerprint:
+            keys.append("k:" + fingerprint)
+    if "names" in links:
+        for name in parsed.get("extensions", {}).get("subject_alt_name", {}).get("dns_names") or []:
+            name = name.strip().lower() if isinstance(name, str) else ""
+            if "." in name:  # skips "localhost" and similar placeholders shared by unrelated certificates
+                keys.append("n:" + name)
+    if "serials" in links:
+        serial = parsed.get("serial_number")
+        if serial:
+            keys.append(f"s:{parsed.get('issuer_dn')}:{serial}")
+    return keys
+
+
+def _stream(collection, query=None):
+    return collection.find(query or {}, PROJECTION).sort("_id", ASCENDING).batch_size(10000)
+
+
+def build_clusters(collection, links=LINKS):
+    """Compute clusters and swap them into place; returns the build summary"""
+    started = time.perf_counter()
+    db = collection.database
+    ensure_lookup_indexes(collection)
+    uf = UnionFind()
+    ids = []
+    owner = {}  # link key -> first certificate index carrying it
+
+    # Pass 1: union certificates sharing a link key
+    for doc in _stream(collection):
+        index = uf.add()
+        ids.append(doc["_id"])
+        for key in _link_keys(doc, links):
+            first = owner.setdefault(key, index)
+            if first != index:
+                uf.union(first, index)
+    owner = None
+
+    # Pass 2: summarize the non-singleton clusters. Documents come back in the
+    # same _id order; ones inserted since pass 1 are skipped, deleted ones are stepped over.
+    summaries = {}
+    members = []
+    position = 0
+    query = {"_id": {"$lte": ids[-1]}} if ids else {"_id": None}
+    for doc in _stream(collection, query):
+        while position < len(ids) and ids[position] < doc["_id"]:
+            position += 1
+        if position == len(ids) or ids[position] != doc["_id"]:
+            continue
+        root = uf.find(position)
+        position += 1
+        if uf.size[root] < 2:
+            continue
+
+        summary = summaries.get(root)
+        if summary is None:
+            summary = summaries[root] = {"keys": set(), "names": set(), "domains": set(), "issuers": set(),
+                                         "first_issued": None, "last_issued": None}
+        parsed = doc.get("parsed", {})
+        fingerprint = parsed.get("subject_key_info", {}).get("fingerprint_sha256")
+        if fingerprint:
+            summary["keys"].add(fingerprint)
+        for name in parsed.get("extensions", {}).get("subject_alt_name", {}).get("dns_names") or []:
+            if isinstance(name, str):
+                summary["names"].add(name.lower())
+                domain = registrable_domain(name)
+                if domain:
+                    summary["domains"].add(domain)
+        issuer = parsed.get("issuer", {}).get("common_name")
+        summary["issuers"].update(issuer if isinstance(issuer, list) else [issuer] if issuer else [])
+        issued = doc.get("not_before")
+        if isinstance(issued, datetime):
+            summary["first_issued"] = min(filter(None, [summary["first_issued"], issued]))
+            summary["last_issued"] = max(filter(None, [summary["last_issued"], issued]))
+        members.append((doc["_id"], root))
+
+    # Number clusters by size, largest first
+    order = sorted(summaries, key=lambda root: (-uf.size[root], root))
+    numbers = {root: number for number, root in enumerate(order, 1)}
+    cluster_docs = [
+        {
+            "_id": numbers[root],
+            "size": int(uf.size[root]),
+            "distinct_keys": len(summaries[root]["keys"]),
+            "distinct_names": len(summaries[root]["names"]),
+            "distinct_domains": len(summaries[root]["domains"]),
+            "sample_keys": sorted(summaries[root]["keys"])[:SAMPLE_SIZE],
+            "sample_domains": sorted(summaries[root]["domains"])[:SAMPLE_SIZE],
+            "issuers": sorted(summaries[root]["issuers"])[:SAMPLE_SIZE],
+            "first_issued": summaries[root]["first_issued"],
+            "last_issued": summaries[root]["last_issued"],
+        }
+        for root in order
+    ]
+    member_docs = [{"_id": cert_id, "cluster": numbers[root]} for cert_id, root in members]
+
+    _swap_in(db, CLUSTERS_COLLECTION, cluster_docs,
+             [[("size", DESCENDING)], [("distinct_domains", DESCENDING)], [("distinct_keys", DESCENDING)]])
+    _swap_in(db, MEMBERS_COLLECTION, member_docs, [[("cluster", ASCENDING)]])
+
+    result = {
+        "built_at": datetime.utcnow(),
+        "links": list(links),
+        "certificates": len(ids),
+        "clusters": len(cluster_docs),
+        "clustered_certificates": len(member_docs),
+        "largest_cluster": cluster_docs[0]["size"] if cluster_docs else 1,
+        "seconds": round(time.perf_counter() - started, 2),
+    }
+    db[STATE_COLLECTION].replace_one({"_id": CLUSTERS_COLLECTION}, {"_id": CLUSTERS_COLLECTION, **result}, upsert=True)
+    return result
+
+
+def _swap_in(db, name, docs, indexes, batch_size=10000):
+    temporary = db[name + "_building"]
+    temporary.drop()
+    for start in range(0, len(docs), batch_size):
+        temporary.insert_many(docs[start:start + batch_size], ordered=False)
+    for keys in indexes:
+        temporary.create_index(keys)
+    if docs:
+        temporary.rename(name, dropTarget=True)
+    else:
+        db[name].drop()
+
+
+def ensure_lookup_indexes(collection):
+    collection.create_index([("parsed.fingerprint_sha256", ASCENDING)])
+    collection.create_index([("parsed.subject_key_info.fingerprint_sha256", ASCENDING)])
+
+
+SORTS = {"size": "size", "domains": "distinct_domains", "keys": "distinct_keys"}
+
+
+def top_clusters(db, sort="size", min_size=2, page=1, page_size=50):
+    """A page of clusters ordered by size, distinct registrable domains or distinct keys"""
+    if sort not in SORTS:
+        raise ValueError(f"Unknown sort: {sort} (use {', '.join(SORTS)})")
+    query = {"size": {"$gte": min_size}} if min_size > 2 else {}
+    clusters = db[CLUSTERS_COLLECTION]
+    total = clusters.count_documents(query)
+    page_docs = list(clusters.find(query)
+                     .sort([(SORTS[sort], DESCENDING), ("_id", ASCENDING)])
+                     .skip((page - 1) * page_size)
+                     .limit(page_size))
+    for doc in page_docs:
+        doc["cluster"] = doc.pop("_id")
+    return {"clusters": page_docs, "total": total}
+
+
+def cluster_of(db, collection, fingerprint=None, key_fingerprint=None):
+    """
+    Cluster of the certificate with this SHA-256 fingerprint, or of the
+    certificates using this public key. Returns (certificate, cluster), where
+    cluster is None for a singleton; certificate is None when nothing matches.
+    """
+    query = ({"parsed.fingerprint_sha256": fingerprint} if fingerprint
+             else {"parsed.subject_key_info.fingerprint_sha256": key_fingerprint})
+    cert = collection.find_one(query, {"_id": 1, "parsed.fingerprint_sha256": 1,
+                                       "parsed.subject.common_name": 1,
+                                       "parsed.subject_key_info.fingerprint_sha256": 1})
+    if cert is None:
+        return None, None
+    member = db[MEMBERS_COLLECTION].find_one({"_id": cert["_id"]})
+    cluster = db[CLUSTERS_COLLECTION].find_one({"_id": member["cluster"]}) if member else None
+    if cluster is not None:
+        cluster["cluster"] = cluster.pop("_id")
+    cert.pop("_id")
+    return cert, cluster
+
+
+def cluster_members(db, collection, cluster, limit=100):
+    """Certificates of a cluster (up to `limit`)"""
+    ids = [member["_id"] for member in db[MEMBERS_COLLECTION].find({"cluster": cluster}, {"_id": 1}).limit(limit)]
+    return list(collection.find({"_id": {"$in": ids}}, {
+        "_id": 0,
+        "parsed.fingerprint_sha256": 1,
+        "parsed.subject.common_name": 1,
+        "parsed.issuer.common_name": 1,
+        "parsed.serial_number": 1,
+        "parsed.subject_key_info.fingerprint_sha256": 1,
+        "parsed.extensions.subject_alt_name.dns_names": 1,
+        "not_before": 1,
+        "not_after": 1,
+    }))
+
+
+def build_state(db):
+    """Summary of the last build, or None if clusters were never built"""
+    return db[STATE_COLLECTION].find_one({"_id": CLUSTERS_COLLECTION}, {"_id": 0})
+
+
+_running = set()
+_running_lock = threading.Lock()
+
+
+def rebuild_in_background(collection, links=LINKS):
+    """Start a build unless one is already running for this database; returns whether one was started"""
+    name = collection.database.name
+    with _running_lock:
+        if name in _running:
+            return False
+        _running.add(name)
+
+    def run():
+        try:
+            result = build_clusters(collection, links)
+            print(f"Key clusters for {name}: {result['clusters']} clusters in {result['seconds']}s")
+        except Exception as e:
+            print(f"❌ Error building key clusters for {name}:", e)
+        finally:
+            with _running_lock:
+                _running.discard(name)
+
+    threading.Thread(target=run, daemon=True).start()
+    return True
+
+
+def is_running(db):
+    return db.name in _running
+
+
+if __name__ == "__main__":
+    import os
+    import sys
+
+    from dotenv import load_dotenv
+    from pymongo import MongoClient
+
+    load_dotenv()
+    client = MongoClient(os.environ["MONGO_URI"])
+    for dataset in sys.argv[1:] or [os.getenv("DB_NAME", "my-pk-domains-multi-mini")]:
+        print(dataset, build_clusters(client[dataset]["certificates"]))
@@ -0,0 +1,344 @@
+"""
+Optional in-memory columnar snapshot of the fields the distribution endpoints group on.
+
+Enabled with ANALYTICS_ENGINE=columnar (requires NumPy). The scalar fields behind
+types, issuers, regions, departments, validity distribution, timeline and trends
+are loaded once into compact NumPy columns: strings are dictionary encoded into
+int32 codes, dates are int64 epoch seconds. Group-bys become `np.bincount` over
+the code column, so each endpoint is answered in microseconds from RAM. New
+certificates are appended incrementally by _id watermark, after their native
+validity dates are backfilled.
+"""
+import calendar
+import glob
+import os
+import threading
+import time
+from datetime import datetime
+
+import warm_state
+from validity_calendar import backfill_validity_dates
+
+try:
+    import numpy as np
+except ImportError:  # the engine is optional; endpoints fall back to MongoDB
+    np = None
+
+MISSING_DATE = -(2 ** 63)
+SECONDS_PER_DAY = 86400
+
+PROJECTION = {
+    "_id": 1,
+    "not_before": 1,
+    "not_after": 1,
+    "parsed.signature_algorithm.name": 1,
+    "parsed.signature_algorithm.hash_algorithm": 1,
+    "parsed.issuer.common_name": 1,
+    "parsed.issuer.organization": 1,
+    "parsed.issuer.country": 1,
+    "parsed.subject_key_info.fingerprint_sha256": 1,
+    "parsed.extensions.subject_alt_name.dns_names": 1,
+}
+
+
+def available():
+    return np is not None
+
+
+def _freeze(value):
+    # Lists (e.g. issuer organization arrays) are grouped by their whole value, like Mongo does
+    return tuple(value) if isinstance(value, list) else value
+
+
+def _thaw(value):
+    return list(value) if isinstance(value, tuple) else value
+
+
+def _epoch(value):
+    # pymongo returns naive UTC datetimes; timegm reads them as UTC (datetime.timestamp would not)
+    return calendar.timegm(value.utctimetuple()) if isinstance(value, datetime) else MISSING_DATE
+
+
+class _Dictionary:
+    """Dictionary encoding: distinct values <-> dense int codes"""
+
+    def __init__(self):
+        self.codes = {}
+        self.values = []
+
+    def encode(self, value):
+        key = _freeze(value)
+        code = self.codes.get(key)
+        if code is None:
+            code = self.codes[key] = len(self.values)
+            self.values.append(key)
+        return code
+
+    def decode(self, code):
+        return _thaw(self.values[code])
+
+
+class ColumnarSnapshot:
+    """Columns for one dataset's certificates"""
+
+    STRING_COLUMNS = {
+        "signature_algorithm": ("signature_algorithm", "name"),
+        "hash_algorithm": ("signature_algorithm", "hash_algorithm"),
+        "issuer_cn": ("issuer", "common_name"),
+        "issuer_org": ("issuer", "organization"),
+        "issuer_country": ("issuer", "country"),
+        "key_fingerprint": ("subject_key_info", "fingerprint_sha256"),
+    }
+
+    def __init__(self, refresh_seconds=60):
+        self.refresh_seconds = refresh_seconds
+        self.last_refresh = 0.0
+        self.load_seconds = 0.0
+        self.ready = False
+        self._lock = threading.Lock()
+        self._reset()
+
+    def _reset(self):
+        self.dictionaries = {name: _Dictionary() for name in self.STRING_COLUMNS}
+        self.columns = {name: np.zeros(0, dtype=np.int32) for name in self.STRING_COLUMNS}
+        self.columns["not_before"] = np.zeros(0, dtype=np.int64)
+        self.columns["not_after"] = np.zeros(0, dtype=np.int64)
+        self.columns["san_count"] = np.zeros(0, dtype=np.int32)
+        self.rows = 0
+        self.last_id = None
+
+    def refresh(self, collection):
+        """Append certificates added since the last refresh (reload everything if some were removed)"""
+        with self._lock:
+            started = time.perf_counter()
+            if self.ready and collection.estimated_document_count() < self.rows:
+                self._reset()
+
+            cursor = []
+            latest = collection.find_one({}, {"_id": 1}, sort=[("_id", -1)])
+            if latest is not None:
+                # Native dates first: the watermark moves past every certificate read here
+                backfill_validity_dates(collection, latest["_id"])
+                id_range = {"$lte": latest["_id"]}
+                if self.last_id is not None:
+                    id_range["$gt"] = self.last_id
+                cursor = collection.find({"_id": id_range}, PROJECTION).sort("_id", 1).batch_size(10000)
+
+            chunk = {name: [] for name in self.columns}
+            for doc in cursor:
+                parsed = doc.get("parsed", {})
+                for name, (section, field) in self.STRING_COLUMNS.items():
+                    chunk[name].append(self.dictionaries[name].encode(parsed.get(section, {}).get(field)))
+                chunk["not_before"].append(_epoch(doc.get("not_before")))
+                chunk["not_after"].append(_epoch(doc.get("not_after")))
+                dns_names = parsed.get("extensions", {}).get("subject_alt_name", {}).get("dns_names")
+                chunk["san_count"].append(len(dns_names) if isinstance(dns_names, list) else 0)
+                self.last_id = doc["_id"]
+
+            added = len(chunk["san_count"])
+            if added:
+                self.columns = {
+                    name: np.concatenate([column, np.asarray(chunk[name], dtype=column.dtype)])
+                    for name, column in self.columns.items()
+                }
+                self.rows += added
+
+            self.last_refresh = time.monotonic()
+            self.load_seconds = time.perf_counter() - started
+            self.ready = True
+            return added
+
+    def refresh_if_stale(self, collection):
+        if not self.ready or time.monotonic() - self.last_refresh > self.refresh_seconds:
+            self.refresh(collection)
+
+    def save_state(self, directory):
+        """Columns as .npy files (memory-mapped when loaded) plus the dictionaries and watermark"""
+        with self._lock:
+            if not self.ready:
+                return
+            columns, rows, last_id = self.columns, self.rows, self.last_id
+            dictionaries = {name: list(dictionary.values) for name, dictionary in self.dictionaries.items()}
+        token = f"{rows}-{last_id}"
+        for name, column in columns.items():
+            path = os.path.join(directory, f"{name}-{token}.npy")
+            if not os.path.exists(path):
+                warm_state.write_atomic(path, lambda f, column=column: np.save(f, column))
+        warm_state.save_document(os.path.join(directory, "columns.bson"), {
+            "token": token, "rows": rows, "last_id": last_id, "dictionaries": dictionaries,
+        })
+        for path in glob.glob(os.path.join(directory, "*.npy")):
+            if not path.endswith(f"-{token}.npy"):
+                os.remove(path)
+
+    def load_state(self, directory, collection):
+        """Resume from columns saved by save_state if they still match the collection; returns whether they did"""
+        document = warm_state.load_document(os.path.join(directory, "columns.bson"))
+        if document is None or not warm_state.covers(collection, document["last_id"], document["rows"]):
+            return False
+        try:
+            columns = {
+                name: np.load(os.path.join(directory, f"{name}-{document['token']}.npy"), mmap_mode="r")
+                for name in self.columns
+            }
+        except (OSError, ValueError):
+            return False
+        if any(len(column) != document["rows"] for column in columns.values()):
+            return False
+        with self._lock:
+            for name, values in document["dictionaries"].items():
+                dictionary = self.dictionaries[name] = _Dictionary()
+                dictionary.values = [_freeze(value) for value in values]
+                dictionary.codes = {value: code for code, value in enumerate(dictionary.values)}
+            self.columns = columns
+            self.rows = document["rows"]
+            self.last_id = document["last_id"]
+        return True
+
+    def active_mask(self, boundary):
+        """Certificates valid at the given instant (same rule as validity_calendar.active_at)"""
+        if boundary is None:
+            return None
+        ts = _epoch(boundary)
+        not_before, not_after = self.columns["not_before"], self.columns["not_after"]
+        return (not_before != MISSING_DATE) & (not_before < ts) & (not_after >= ts)
+
+    def group_counts(self, column, mask=None):
+        """[{"_id": value, "count": n}] sorted by count, like a Mongo $group + $sort"""
+        codes = self.columns[column]
+        if mask is not None:
+            codes = codes[mask]
+        dictionary = self.dictionaries[column]
+        counts = np.bincount(codes, minlength=len(dictionary.values))
+        order = np.argsort(-counts, kind="stable")
+        return [{"_id": dictionary.decode(int(code)), "count": int(counts[code])} for code in order if counts[code]]
+
+    def unwound_counts(self, column, mask=None):
+        """Counts per array element, like $unwind (preserveNullAndEmptyArrays) + $group"""
+        totals = {}
+        for row in self.group_counts(column, mask):
+            value = row["_id"]
+            if isinstance(value, list):
+                elements = value or [None]  # empty arrays are kept as null
+            else:
+                elements = [value]
+            for element in elements:
+                totals[element] = totals.get(element, 0) + row["count"]
+        return [{"_id": value, "count": count} for value, count in sorted(totals.items(), key=lambda kv: -kv[1])]
+
+    def value_mask(self, column, value):
+        """Rows whose value equals `value` or, for array values, contains it (Mongo equality semantics)"""
+        matching = [
+            code for code, stored in enumerate(self.dictionaries[column].values)
+            if stored == value or (isinstance(stored, tuple) and value in stored)
+        ]
+        return np.isin(self.columns[column], matching)
+
+    def histogram_counts(self, values, boundaries, mask=None, groups=None):
+        """
+        {(group, bucket index): count} for float values (NaN = missing). The index
+        is the number of boundaries <= value (0: below the first boundary,
+        len(boundaries): at or above the last), -1 for missing values.
+        """
+        edges = np.asarray(boundaries, dtype=np.float64)
+        index = np.searchsorted(edges, values, side="right").astype(np.int64)
+        index[np.isnan(values)] = -1
+        if mask is not None:
+            index = index[mask]
+            groups = groups[mask] if groups is not None else None
+        width = len(edges) + 2
+        keys = index + 1 if groups is None else groups.astype(np.int64) * width + index + 1
+        unique, counts = np.unique(keys, return_counts=True)
+        result = {}
+        for key, count in zip(unique.tolist(), counts.tolist()):
+            group, slot = divmod(key, width)
+            result[(None if groups is None else group, slot - 1)] = count
+        return result
+
+    def quantile_boundaries(self, values, bins, mask=None):
+        """Boundaries splitting the non-missing values into `bins` equally full buckets"""
+        if mask is not None:
+            values = values[mask]
+        values = values[~np.isnan(values)]
+        if not len(values):
+            return []
+        edges = np.unique(np.quantile(values, np.linspace(0, 1, bins + 1)))
+        edges[-1] = np.nextafter(edges[-1], np.inf)  # the maximum belongs in the last bucket
+        return edges.tolist()
+
+    def issue_years(self):
+        """Year of not_before per row, -1 where it is missing"""
+        not_before = self.columns["not_before"]
+        years = np.full(self.rows, -1, dtype=np.int64)
+        valid = not_before != MISSING_DATE
+        years[valid] = not_before[valid].astype("datetime64[s]").astype("datetime64[Y]").astype(np.int64) + 1970
+        return years
+
+    def validity_days(self):
+        """Validity period in days for every row, NaN where a date is missing"""
+        not_before, not_after = self.columns["not_before"], self.columns["not_after"]
+        valid = (not_before != MISSING_DATE) & (not_after != MISSING_DATE)
+        days = np.full(self.rows, np.nan)
+        days[valid] = (not_after[valid] - not_before[valid]) / SECONDS_PER_DAY
+        return days
+
+    def _issued(self, unit):
+        not_before = self.columns["not_before"]
+        valid = not_before != MISSING_DATE
+        return valid, not_before[valid].astype("datetime64[s]").astype(f"datetime64[{unit}]")
+
+    def timeline(self):
+        valid, months = self._issued("M")
+        values, counts = np.unique(months, return_counts=True)
+        return [{"date": f"{month}-01", "count": int(count)} for month, count in zip(values.astype(str), counts)]
+
+    def validity_trends(self):
+        valid, years = self._issued("Y")
+        years = years.astype(np.int64) + 1970
+        days = self.validity_days()[valid]
+        has_days = ~np.isnan(days)
+        result = []
+        for year in np.unique(years):
+            in_year = years == year
+            with_days = in_year & has_days
+            result.append({
+                "_id": int(year),
+                "avg_validity": float(days[with_days].mean()) if with_days.any() else None,
+                "count": int(in_year.sum()),
+            })
+        return result
+
+    def algorithm_trends(self):
+        valid, years = self._issued("Y")
+        years = years.astype(np.int64) + 1970
+        codes = self.columns["signature_algorithm"][valid]
+        dictionary = self.dictionaries["signature_algorithm"]
+        width = len(dictionary.values)
+        keys, counts = np.unique(years * width + codes, return_counts=True)
+
+        by_year = {}
+        for key, count in zip(keys, counts):
+            year, code = divmod(int(key), width)
+            algorithm = dictionary.decode(code)
+            if algorithm is None:
+                continue
+            by_year.setdefault(year, []).append({"algorithm": algorithm, "count": int(count)})
+        return [{"year": year, "algorithms": algos} for year, algos in sorted(by_year.items())]
+
+    def memory_report(self):
+        column_bytes = {name: int(column.nbytes) for name, column in self.columns.items()}
+        # Dictionaries are Python objects; approximate them by the size of their values
+        dictionary_bytes = {
+            name: sum(len(str(value)) + 80 for value in dictionary.values)
+            for name, dictionary in self.dictionaries.items()
+        }
+        total = sum(column_bytes.values()) + sum(dictionary_bytes.values())
+        return {
+            "rows": self.rows,
+            "column_bytes": column_bytes,
+            "dictionary_bytes": dictionary_bytes,
+            "dictionary_sizes": {name: len(d.values) for name, d in self.dictionaries.items()},
+            "total_bytes": total,
+            "bytes_per_million_certificates": int(total / self.rows * 1_000_000) if self.rows else 0,
+            "last_load_seconds": round(self.load_seconds, 3),
+        }
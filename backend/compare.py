@@ -0,0 +1,88 @@
+"""
+Differences between two scan datasets.
+
+Distributions are compared from each dataset's summaries (the per-value
+counts the distribution endpoints serve, cached per dataset version), so only
+the bucket rows are held in memory. The certificate sets are compared by
+SHA-256 fingerprint with a merge join: both collections are read in
+fingerprint order off the fingerprint index and the two cursors are advanced
+in step. Memory stays bounded by the cursor batches and the `limit` sample
+fingerprints kept per side, however large the scans are.
+"""
+from pymongo import ASCENDING
+
+FINGERPRINT = "parsed.fingerprint_sha256"
+BATCH_SIZE = 10000
+
+
+def _hashable(value):
+    return tuple(_hashable(item) for item in value) if isinstance(value, list) else value
+
+
+def diff_counts(a_rows, b_rows, key="_id", field="count"):
+    """
+    Per-bucket counts of both datasets, with the change from a to b, largest
+    absolute change first. A bucket missing from one dataset counts 0 there.
+    """
+    buckets = {}
+    for side, rows in (("a", a_rows), ("b", b_rows)):
+        for row in rows:
+            entry = buckets.setdefault(_hashable(row[key]), {key: row[key], "a": 0, "b": 0})
+            entry[side] += row[field]
+    rows = list(buckets.values())
+    for row in rows:
+        row["change"] = row["b"] - row["a"]
+    return sorted(rows, key=lambda row: -abs(row["change"]))
+
+
+def ensure_fingerprint_index(collection):
+    collection.create_index([(FINGERPRINT, ASCENDING)])
+
+
+def fingerprints(collection):
+    """The dataset's distinct certificate fingerprints in ascending order, streamed"""
+    cursor = collection.find(
+        {FINGERPRINT: {"$type": "string"}}, {"_id": 0, FINGERPRINT: 1}
+    ).sort(FINGERPRINT, ASCENDING).batch_size(BATCH_SIZE)
+    previous = None
+    for doc in cursor:
+        fingerprint = doc["parsed"]["fingerprint_sha256"]
+        if fingerprint != previous:
+            yield fingerprint
+            previous = fingerprint
+
+
+def merge_join(a, b):
+    """Walk two ascending streams together, yielding ("a" | "b" | "both", value)"""
+    a = iter(a)
+    b = iter(b)
+    x = next(a, None)
+    y = next(b, None)
+    while x is not None or y is not None:
+        if y is None or (x is not None and x < y):
+            yield "a", x
+            x = next(a, None)
+        elif x is None or y < x:
+            yield "b", y
+            y = next(b, None)
+        else:
+            yield "both", x
+            x = next(a, None)
+            y = next(b, None)
+
+
+def diff_certificates(a_collection, b_collection, limit=100):
+    """Certificates only in a, only in b and in both, with up to `limit` sample fingerprints per side"""
+    counts = {"a": 0, "b": 0, "both": 0}
+    samples = {"a": [], "b": []}
+    for side, fingerprint in merge_join(fingerprints(a_collection), fingerprints(b_collection)):
+        counts[side] += 1
+        if side != "both" and len(samples[side]) < limit:
+            samples[side].append(fingerprint)
+    return {
+        "only_a": counts["a"],
+        "only_b": counts["b"],
+        "both": counts["both"],
+        "only_a_sample": samples["a"],
+        "only_b_sample": samples["b"],
+    }
@@ -0,0 +1,176 @@
+"""
+Weak-crypto compliance flags.
+
+Every certificate carries a `compliance` bitmask of the rules it violates
+(SHA-1 or MD5 signatures, RSA keys below COMPLIANCE_MIN_RSA_BITS, leaf
+validity above COMPLIANCE_MAX_VALIDITY_DAYS). The mask is evaluated once per
+certificate by MongoDB itself (a pipeline update, like the native validity
+dates in validity_calendar.py), for the certificates that have none yet, so
+new certificates are flagged on the first refresh after they are inserted.
+Changing the rule set (COMPLIANCE_RULES, thresholds) clears the masks and
+they are evaluated again.
+
+The `compliance` index keeps queries off the certificates that comply: counts
+group the violating certificates by (mask, issuer_id, month of issue), which
+are few rows, and expand the bits here; offender lists match the masks that
+contain a rule's bit with $in, which unlike $bitsAnySet uses the index.
+"""
+import hashlib
+import json
+import os
+import threading
+import time
+
+from pymongo import ASCENDING
+
+from validity_calendar import STATE_COLLECTION, backfill_validity_dates
+
+COMPLIANCE_FIELD = "compliance"
+MIN_RSA_BITS = int(os.getenv("COMPLIANCE_MIN_RSA_BITS", "2048"))
+MAX_VALIDITY_DAYS = int(os.getenv("COMPLIANCE_MAX_VALIDITY_DAYS", "398"))
+
+
+def _string(field):
+    return {"$convert": {"input": field, "to": "string", "onError": "", "onNull": ""}}
+
+
+def _matches(field, pattern):
+    return {"$regexMatch": {"input": _string(field), "regex": pattern, "options": "i"}}
+
+
+_signature = "$parsed.signature_algorithm.name"
+_hash = "$parsed.signature_algorithm.hash_algorithm"
+_rsa_bits = "$parsed.subject_key_info.rsa_public_key.length"
+
+# Rule name -> bit, description and the expression that is true for a violating certificate.
+# Bits are fixed per rule so stored masks keep their meaning when rules are enabled or disabled.
+RULES = {
+    "sha1": {
+        "bit": 0,
+        "description": "SHA-1 signature",
+        "violated": {"$or": [_matches(_signature, "sha-?1([^0-9]|$)"), _matches(_hash, "^sha-?1$")]},
+    },
+    "md5": {
+        "bit": 1,
+        "description": "MD5 signature",
+        "violated": {"$or": [_matches(_signature, "md5"), _matches(_hash, "^md5$")]},
+    },
+    "rsa_weak": {
+        "bit": 2,
+        "description": f"RSA key shorter than {MIN_RSA_BITS} bits",
+        "violated": {"$and": [{"$isNumber": _rsa_bits}, {"$lt": [_rsa_bits, MIN_RSA_BITS]}]},
+    },
+    "long_validity": {
+        "bit": 3,
+        "description": f"Leaf certificate valid for more than {MAX_VALIDITY_DAYS} days",
+        "violated": {"$and": [
+            {"$ne": [{"$ifNull": ["$parsed.extensions.basic_constraints.is_ca", False]}, True]},
+            {"$gt": [{"$subtract": ["$not_after", "$not_before"]}, MAX_VALIDITY_DAYS * 24 * 60 * 60 * 1000]},
+        ]},
+    },
+}
+ENABLED = [name.strip() for name in os.getenv("COMPLIANCE_RULES", ",".join(RULES)).split(",")
+           if name.strip() in RULES]
+
+
+def rule_set_id(names=None):
+    """Fingerprint of the enabled rules and their thresholds (masks are re-evaluated when it changes)"""
+    rules = {name: RULES[name] for name in (names or ENABLED)}
+    return hashlib.blake2b(json.dumps(rules, sort_keys=True).encode(), digest_size=8).hexdigest()
+
+
+def mask_expression(names=None):
+    return {"$add": [{"$cond": [RULES[name]["violated"], 1 << RULES[name]["bit"], 0]} for name in (names or ENABLED)]}
+
+
+def masks_with(name):
+    """Every mask value that has the rule's bit set (for an index-backed $in)"""
+    bit = 1 << RULES[name]["bit"]
+    return [mask for mask in range(1 << (max(rule["bit"] for rule in RULES.values()) + 1)) if mask & bit]
+
+
+def rules_violated(mask):
+    return [name for name in ENABLED if mask & (1 << RULES[name]["bit"])]
+
+
+def describe_rules():
+    return [{"rule": name, "bit": RULES[name]["bit"], "description": RULES[name]["description"]} for name in ENABLED]
+
+
+def evaluate(collection, names=None):
+    """Store the violation mask on every certificate that has none yet; returns the number updated"""
+    result = collection.update_many(
+        {COMPLIANCE_FIELD: {"$exists": False}},
+        [{"$set": {COMPLIANCE_FIELD: mask_expression(names)}}],
+    )
+    return result.modified_count
+
+
+class ComplianceFlags:
+    """Keeps the per-certificate compliance masks in step with new certificates and the rule set"""
+
+    def __init__(self, refresh_seconds=60):
+        self.refresh_seconds = refresh_seconds
+        self.last_refresh = 0.0
+        self.last_version = None
+        self.ready = False
+        self._lock = threading.Lock()
+
+    def refresh(self, collection, version=None):
+        with self._lock:
+            collection.create_index([(COMPLIANCE_FIELD, ASCENDING), ("not_after", ASCENDING)])
+            state = collection.database[STATE_COLLECTION]
+            rule_set = rule_set_id()
+            previous = state.find_one({"_id": COMPLIANCE_FIELD}) or {}
+            if previous.get("rule_set") != rule_set:
+                collection.update_many({COMPLIANCE_FIELD: {"$exists": True}}, {"$unset": {COMPLIANCE_FIELD: ""}})
+                state.update_one({"_id": COMPLIANCE_FIELD}, {"$set": {"rule_set": rule_set}}, upsert=True)
+            # The validity rule needs the native dates, which new certificates may not have yet
+            backfill_validity_dates(collection)
+            evaluate(collection)
+            self.last_refresh = time.monotonic()
+            self.last_version = version
+            self.ready = True
+
+    def refresh_if_stale(self, collection, version=None):
+        if (not self.ready or version != self.last_version
+                or time.monotonic() - self.last_refresh > self.refresh_seconds):
+            self.refresh(collection, version)
+
+
+def violation_groups(collection, match=None):
+    """Violating certificates per (mask, issuer_id, month of issue)"""
+    return list(collection.aggregate([
+        {"$match": {COMPLIANCE_FIELD: {"$gt": 0}, **(match or {})}},
+        {"$group": {
+            "_id": {
+                "mask": "$" + COMPLIANCE_FIELD,
+                "issuer_id": "$issuer_id",
+                "month": {"$dateToString": {"format": "%Y-%m", "date": "$not_before"}},
+            },
+            "count": {"$sum": 1},
+        }},
+    ]))
+
+
+def summarize(groups):
+    """Expand mask groups into violation counts per rule, per issuer_id and per month"""
+    per_rule = {name: 0 for name in ENABLED}
+    per_issuer = {}
+    per_month = {}
+    violating = 0
+    for group in groups:
+        rules = rules_violated(group["_id"]["mask"])
+        if not rules:
+            continue  # only rules that are no longer enabled
+        count = group["count"]
+        violating += count
+        issuer = per_issuer.setdefault(group["_id"].get("issuer_id"), {"violating": 0, **{name: 0 for name in ENABLED}})
+        month = per_month.setdefault(group["_id"].get("month"), {"violating": 0, **{name: 0 for name in ENABLED}})
+        issuer["violating"] += count
+        month["violating"] += count
+        for name in rules:
+            per_rule[name] += count
+            issuer[name] += count
+            month[name] += count
+    return violating, per_rule, per_issuer, per_month
@@ -0,0 +1,206 @@
+"""
+Multiple scan datasets served from one process.
+
+Every dataset is a MongoDB database with a `certificates` collection. All
+datasets share one MongoClient (and so one connection pool); each one gets its
+own search index, validity calendar and result cache, created lazily the first
+time the dataset is requested.
+"""
+import os
+import threading
+import time
+
+import warm_state
+from ca_graph import CAGraph
+from cardinality import CardinalityIndex
+from columnar import ColumnarSnapshot
+from compare import ensure_fingerprint_index
+from compliance import ComplianceFlags
+from deltas import ResultHistory
+from domain_coverage import DomainCoverage
+from deadlines import BudgetedCollection
+from issuers import IssuerDimension
+from search_index import DomainIndex
+from validity_calendar import ValidityCalendar, ensure_validity_indexes
+
+
+class ResultCache:
+    """
+    Cache of computed results for one dataset. Entries are tied to the dataset
+    version, so they are dropped as soon as certificates are added or removed.
+    Misses go to the cross-process SharedResultCache when one is configured.
+    """
+
+    def __init__(self, dataset_name, shared=None, max_entries=256):
+        self.dataset_name = dataset_name
+        self.shared = shared
+        self.max_entries = max_entries
+        self.entries = {}
+        self.version = None
+        self.hits = 0
+        self.misses = 0
+        self._lock = threading.Lock()
+
+    @staticmethod
+    def _shared_version(version):
+        # Results persisted by code with other response shapes never match
+        return f"{warm_state.RESULT_VERSION}:{version}"
+
+    def get_or_compute(self, key, version, compute):
+        with self._lock:
+            if version != self.version:
+                self.entries = {}
+                self.version = version
+            if key in self.entries:
+                self.hits += 1
+                return self.entries[key]
+            self.misses += 1
+
+        if self.shared is not None:
+            result = self.shared.get_or_compute(self.dataset_name, key, self._shared_version(version), compute)
+        else:
+            result = compute()
+
+        with self._lock:
+            if version == self.version:
+                if len(self.entries) >= self.max_entries:
+                    # Drop the oldest entry (dicts keep insertion order)
+                    self.entries.pop(next(iter(self.entries)))
+                self.entries[key] = result
+        return result
+
+    def peek(self, key, version):
+        """(True, result) when a result for this version is cached here or in the shared cache, without computing"""
+        with self._lock:
+            if version == self.version and key in self.entries:
+                return True, self.entries[key]
+        if self.shared is not None:
+            return self.shared.get(self.dataset_name, key, self._shared_version(version))
+        return False, None
+
+    def stats(self):
+        return {"entries": len(self.entries), "hits": self.hits, "misses": self.misses}
+
+
+class Dataset:
+    """A scan dataset (one database) and the in-process state built for it"""
+
+    def __init__(self, client, name, refresh_seconds=60, version_check_seconds=5, columnar=False,
+                 shared_cache=None, state_dir=None):
+        self.name = name
+        # Where scan-built structures are saved for warm restarts (None: never saved)
+        self.state_dir = state_dir
+        self.db = client[name]
+        # Request handlers query through the budgeted proxy (maxTimeMS, cancellation);
+        # the shared in-process indexes refresh from the plain collection so an
+        # abandoned request never cancels a refresh other requests depend on
+        self.collection = self.db["certificates"]
+        self.certificates = BudgetedCollection(self.collection)
+        self.domain_index = DomainIndex(refresh_seconds=refresh_seconds)
+        self.validity_calendar = ValidityCalendar(refresh_seconds=refresh_seconds)
+        self.cardinality = CardinalityIndex(refresh_seconds=refresh_seconds)
+        self.ca_graph = CAGraph(refresh_seconds=refresh_seconds)
+        self.issuers = IssuerDimension(refresh_seconds=refresh_seconds)
+        self.compliance = ComplianceFlags(refresh_seconds=refresh_seconds)
+        self.domain_coverage = DomainCoverage(refresh_seconds=refresh_seconds)
+        self.cache = ResultCache(name, shared=shared_cache)
+        # Recent responses per version, for ?since= delta responses
+        self.history = ResultHistory()
+        # In-memory columnar snapshot, only when the columnar analytics engine is enabled
+        self.columns = ColumnarSnapshot(refresh_seconds=refresh_seconds) if columnar else None
+        self.version_check_seconds = version_check_seconds
+        self._version = None
+        self._version_checked = 0.0
+        self._build_lock = threading.Lock()
+        self.indexes_built = False
+        self.state_loaded = []
+
+    def version(self):
+        """
+        Cheap dataset version: document count plus the newest _id. Re-checked at
+        most every version_check_seconds.
+        """
+        if self._version is None or time.monotonic() - self._version_checked > self.version_check_seconds:
+            latest = self.collection.find_one({}, {"_id": 1}, sort=[("_id", -1)])
+            count = self.collection.estimated_document_count()
+            self._version = f"{count}-{latest['_id'] if latest else 'empty'}"
+            self._version_checked = time.monotonic()
+        return self._version
+
+    def expire_version(self):
+        """Make the next version() call re-check (after a change notification)"""
+        self._version_checked = 0.0
+
+    def cached(self, key, compute):
+        return self.cache.get_or_compute(key, self.version(), compute)
+
+    def build_indexes(self):
+        """Create Mongo indexes and build the in-process indexes (safe to call repeatedly)"""
+        with self._build_lock:
+            if not self.indexes_built:
+                ensure_validity_indexes(self.collection)
+                # /api/compare reads every dataset in fingerprint order
+                ensure_fingerprint_index(self.collection)
+                if self.state_dir:
+                    self.state_loaded = self.load_state()
+                self.indexes_built = True
+        self.validity_calendar.refresh(self.collection)
+        self.domain_index.refresh(self.collection)
+        self.cardinality.refresh(self.collection)
+        self.ca_graph.refresh(self.collection)
+        self.issuers.refresh(self.collection, self.version())
+        self.compliance.refresh(self.collection, self.version())
+        self.domain_coverage.refresh(self.collection, self.version())
+        if self.columns is not None:
+            # After the calendar refresh, which backfills the native dates the columns are built from
+            self.columns.refresh(self.collection)
+        if self.state_dir:
+            self.save_state()
+
+    def load_state(self):
+        """Resume the structures built by collection scans from their saved state; returns the ones resumed"""
+        directory = warm_state.dataset_dir(self.state_dir, self.name)
+        loaded = []
+        if not self.cardinality.ready and self.cardinality.load_state(
+                os.path.join(directory, "cardinality.bson"), self.collection):
+            loaded.append("cardinality")
+        if self.columns is not None and not self.columns.ready and self.columns.load_state(directory, self.collection):
+            loaded.append("columns")
+        return loaded
+
+    def save_state(self):
+        directory = warm_state.dataset_dir(self.state_dir, self.name)
+        self.cardinality.save_state(os.path.join(directory, "cardinality.bson"))
+        if self.columns is not None:
+            self.columns.save_state(directory)
+
+
+class DatasetRegistry:
+    """Datasets allowed by configuration, created on first use"""
+
+    def __init__(self, get_client, names, default, refresh_seconds=60, columnar=False, shared_cache=None,
+                 state_dir=None):
+        # get_client is called lazily so nothing touches MongoDB until a dataset is needed
+        self.get_client = get_client
+        self.names = list(names)
+        self.default = default
+        self.refresh_seconds = refresh_seconds
+        self.columnar = columnar
+        self.shared_cache = shared_cache
+        self.state_dir = state_dir
+        self.datasets = {}
+        self._lock = threading.Lock()
+
+    def get(self, name=None):
+        name = name or self.default
+        if name not in self.names:
+            raise KeyError(name)
+        with self._lock:
+            if name not in self.datasets:
+                self.datasets[name] = Dataset(self.get_client(), name, refresh_seconds=self.refresh_seconds,
+                                              columnar=self.columnar, shared_cache=self.shared_cache,
+                                              state_dir=self.state_dir)
+            return self.datasets[name]
+
+    def all(self):
+        return [self.get(name) for name in self.names]
@@ -0,0 +1,216 @@
+"""
+Per-request query deadlines and cancellation.
+
+Every API request gets a QueryBudget: a time budget (per endpoint) and a unique
+comment. Dataset collections are wrapped in BudgetedCollection, which passes
+the remaining budget to MongoDB as maxTimeMS, tags each operation with the
+request's comment and remembers the cursors it opened. QueryDeadlineMiddleware
+watches the connection; when the client disconnects before the response is
+sent, the request's cursors are closed (killCursors), its in-flight operations
+are found by comment and killed (killOp), and any further query from the
+abandoned handler fails immediately.
+"""
+import asyncio
+import contextvars
+import threading
+import time
+import uuid
+from collections.abc import Mapping
+
+from pymongo import errors
+
+current_budget = contextvars.ContextVar("query_budget", default=None)
+
+
+class QueryCancelled(Exception):
+    """The client went away; the request's queries were cancelled"""
+
+
+class QueryBudget:
+
+    def __init__(self, seconds, label):
+        self.seconds = seconds
+        self.deadline = time.monotonic() + seconds if seconds else None
+        self.comment = f"{label} #{uuid.uuid4().hex[:12]}"
+        self.cancelled = False
+        self.partial = False
+        self.finished = False
+        self._cursors = []
+        self._clients = set()
+        self._lock = threading.Lock()
+
+    def remaining_ms(self):
+        """maxTimeMS for the next operation, or None when the request has no deadline"""
+        if self.deadline is None:
+            return None
+        return max(1, int((self.deadline - time.monotonic()) * 1000))
+
+    def check(self):
+        if self.cancelled:
+            raise QueryCancelled(self.comment)
+        if self.deadline is not None and time.monotonic() >= self.deadline:
+            raise errors.ExecutionTimeout(f"Query budget of {self.seconds}s exhausted")
+
+    def track(self, cursor, client):
+        with self._lock:
+            self._cursors.append(cursor)
+            self._clients.add(client)
+
+    def cancel(self):
+        """Close the request's cursors and kill its running operations (blocking; call off the event loop)"""
+        self.cancelled = True
+        with self._lock:
+            cursors, self._cursors = self._cursors, []
+            clients = set(self._clients)
+        for cursor in cursors:
+            try:
+                cursor.close()  # sends killCursors for cursors still open on the server
+            except errors.PyMongoError:
+                pass
+        for client in clients:
+            kill_operations(client, self.comment)
+
+
+def kill_operations(client, comment):
+    """killOp every operation (including getMores of its cursors) tagged with comment"""
+    try:
+        operations = client.admin.aggregate([
+            {"$currentOp": {"allUsers": True}},
+            {"$match": {"$or": [{"command.comment": comment}, {"cursor.originatingCommand.comment": comment}]}},
+            {"$project": {"opid": 1}},
+        ])
+        for op in operations:
+            client.admin.command("killOp", op=op["opid"])
+    except errors.PyMongoError as e:
+        # e.g. missing inprog/killop privileges; killCursors already stopped the cursors
+        print(f"⚠️ Could not kill operations for {comment}: {e}")
+
+
+class BudgetedCollection:
+    """Collection proxy applying the current request's budget to reads"""
+
+    def __init__(self, collection):
+        self._collection = collection
+
+    def __getattr__(self, name):
+        return getattr(self._collection, name)
+
+    def __getitem__(self, name):
+        return self._collection[name]
+
+    def _budget(self):
+        budget = current_budget.get()
+        if budget is not None:
+            budget.check()
+        return budget
+
+    def find(self, *args, **kwargs):
+        budget = self._budget()
+        if budget is None:
+            return self._collection.find(*args, **kwargs)
+        kwargs.setdefault("comment", budget.comment)
+        if budget.deadline is not None:
+            kwargs.setdefault("max_time_ms", budget.remaining_ms())
+        cursor = self._collection.find(*args, **kwargs)
+        budget.track(cursor, self._collection.database.client)
+        return cursor
+
+    def find_one(self, filter=None, *args, **kwargs):
+        if filter is not None and not isinstance(filter, Mapping):
+            filter = {"_id": filter}
+        return next(iter(self.find(filter, *args, **kwargs).limit(-1)), None)
+
+    def aggregate(self, pipeline, **kwargs):
+        budget = self._budget()
+        if budget is None:
+            return self._collection.aggregate(pipeline, **kwargs)
+        kwargs.setdefault("comment", budget.comment)
+        if budget.deadline is not None:
+            kwargs.setdefault("maxTimeMS", budget.remaining_ms())
+        cursor = self._collection.aggregate(pipeline, **kwargs)
+        budget.track(cursor, self._collection.database.client)
+        return cursor
+
+    def count_documents(self, filter, **kwargs):
+        budget = self._budget()
+        if budget is not None:
+            kwargs.setdefault("comment", budget.comment)
+            if budget.deadline is not None:
+                kwargs.setdefault("maxTimeMS", budget.remaining_ms())
+        return self._collection.count_documents(filter, **kwargs)
+
+    def distinct(self, key, filter=None, **kwargs):
+        budget = self._budget()
+        if budget is not None:
+            kwargs.setdefault("comment", budget.comment)
+            if budget.deadline is not None:
+                kwargs.setdefault("maxTimeMS", budget.remaining_ms())
+        return self._collection.distinct(key, filter, **kwargs)
+
+
+def collect(cursor):
+    """
+    list(cursor), except that when the time budget runs out after some documents
+    arrived, those are returned and the response is flagged as partial.
+    """
+    results = []
+    try:
+        for doc in cursor:
+            results.append(doc)
+    except errors.ExecutionTimeout:
+        budget = current_budget.get()
+        if budget is None or not results:
+            raise
+        budget.partial = True
+    return results
+
+
+class QueryDeadlineMiddleware:
+    """
+    ASGI middleware giving each /api/ request a QueryBudget and cancelling its
+    queries when the client disconnects. `budget_for(path)` returns the time
+    budget in seconds for a path (None for no deadline).
+    """
+
+    def __init__(self, app, budget_for):
+        self.app = app
+        self.budget_for = budget_for
+
+    async def __call__(self, scope, receive, send):
+        if scope["type"] != "http" or "/api/" not in scope["path"]:
+            await self.app(scope, receive, send)
+            return
+
+        path = "/api/" + scope["path"].split("/api/", 1)[1]
+        budget = QueryBudget(self.budget_for(path), path)
+        token = current_budget.set(budget)
+
+        # Only the watcher reads the real receive channel; the app reads the messages it forwards
+        messages = asyncio.Queue()
+
+        async def watch_disconnect():
+            while True:
+                message = await receive()
+                await messages.put(message)
+                if message["type"] == "http.disconnect":
+                    if not budget.finished:
+                        await asyncio.get_running_loop().run_in_executor(None, budget.cancel)
+                    return
+
+        async def send_with_status(message):
+            if message["type"] == "http.response.start":
+                headers = list(message.get("headers", []))
+                if budget.partial:
+                    headers.append((b"x-partial-result", b"true"))
+                message = {**message, "headers": headers}
+            elif message["type"] == "http.response.body" and not message.get("more_body", False):
+                budget.finished = True
+            await send(message)
+
+        watcher = asyncio.ensure_future(watch_disconnect())
+        try:
+            await self.app(scope, messages.get, send_with_status)
+        finally:
+            budget.finished = True
+            watcher.cancel()
+            current_budget.reset(token)
@@ -0,0 +1,118 @@
+"""
+Delta responses for dashboard refreshes.
+
+Distribution endpoints return the dataset version with their result. A client
+that passes it back as `since` gets only the buckets that changed since that
+version: rows added or changed (`upserted`), the keys of rows that
+disappeared (`removed`), and the new row order (`order`) when applying the
+changes in place would not give it. Rows are matched on `_id`, `date` or
+`year`, whichever they have. When nothing changed the response is just
+`{"version", "unchanged": true}`.
+
+The last HISTORY_VERSIONS responses of every endpoint (and parameters) are
+kept per dataset and process. A `since` version that is no longer kept, or
+that another worker served, gets the full response, which the client simply
+takes as its new copy.
+"""
+import json
+import threading
+from collections import OrderedDict
+
+HISTORY_VERSIONS = 8
+HISTORY_KEYS = 128
+# Fields that identify a row of a result list, in order of preference
+KEY_FIELDS = ("_id", "date", "year")
+
+# Two different responses were served under one version: diffs against it are not trustworthy
+_CONFLICT = object()
+
+
+def row_key_field(rows):
+    """The field identifying the rows of a result list, or None when they cannot be matched"""
+    if not rows or not all(isinstance(row, dict) for row in rows):
+        return None
+    for field in KEY_FIELDS:
+        if all(field in row for row in rows):
+            return field
+    return None
+
+
+def _identity(value):
+    return json.dumps(value, sort_keys=True, default=str)
+
+
+def diff_rows(previous, current, field):
+    """Upserted rows, removed keys and (when needed) the new key order turning `previous` into `current`"""
+    old = {_identity(row[field]): row for row in previous}
+    new = {_identity(row[field]): row for row in current}
+    change = {
+        "key": field,
+        "upserted": [row for identity, row in new.items() if old.get(identity) != row],
+        "removed": [row[field] for identity, row in old.items() if identity not in new],
+    }
+    # The client keeps surviving rows in place and appends new ones
+    merged = [identity for identity in old if identity in new] + [identity for identity in new if identity not in old]
+    if merged != list(new):
+        change["order"] = [row[field] for row in current]
+    return change
+
+
+def diff(previous, current):
+    """Changes from one response to the next: {"lists": {field: rows diff}, "replace": {field: value}}"""
+    lists = {}
+    replace = {}
+    for name, value in current.items():
+        before = previous.get(name)
+        if before == value:
+            continue
+        field = row_key_field(value) if isinstance(value, list) and isinstance(before, list) else None
+        if field is not None and row_key_field(before) in (field, None):
+            lists[name] = diff_rows(before, value, field)
+        else:
+            replace[name] = value
+    return {"lists": lists, "replace": replace, "dropped": [name for name in previous if name not in current]}
+
+
+class ResultHistory:
+    """Recent responses of one dataset, per endpoint key and version"""
+
+    def __init__(self, versions=HISTORY_VERSIONS, max_keys=HISTORY_KEYS):
+        self.versions = versions
+        self.max_keys = max_keys
+        self.entries = OrderedDict()
+        self._lock = threading.Lock()
+
+    def remember(self, key, version, response):
+        with self._lock:
+            history = self.entries.pop(key, None) or OrderedDict()
+            self.entries[key] = history
+            if len(self.entries) > self.max_keys:
+                self.entries.popitem(last=False)
+            known = history.get(version)
+            if known is None:
+                history[version] = response
+                if len(history) > self.versions:
+                    history.popitem(last=False)
+            elif known is not _CONFLICT and known != response:
+                history[version] = _CONFLICT
+
+    def get(self, key, version):
+        """The response served for `version`, or None when it is not (reliably) known"""
+        with self._lock:
+            response = self.entries.get(key, {}).get(version)
+        return None if response is _CONFLICT else response
+
+    def stats(self):
+        with self._lock:
+            return {"keys": len(self.entries), "versions": sum(len(history) for history in self.entries.values())}
+
+
+def respond(history, key, version, response, since=None):
+    """The response with its version, or only the changes since the client's version when they are known"""
+    history.remember(key, version, response)
+    previous = history.get(key, since) if since else None
+    if previous is None or history.get(key, version) is None:
+        return {**response, "version": version}
+    if previous == response:
+        return {"version": version, "since": since, "unchanged": True}
+    return {"version": version, "since": since, "delta": diff(previous, response)}
@@ -0,0 +1,203 @@
+"""
+Registrable-domain coverage index.
+
+The `domain_coverage` collection holds one entry per (registrable domain,
+certificate): the certificate's names under that domain, its validity
+interval and issuer. It is built in bulk from the certificates and then
+extended by _id watermark like the validity calendar, so certificates are
+added on the first refresh after they are inserted. Per-domain views (which
+certificates cover a domain, when its coverage lapses, which CAs issue for
+it) and the list of domains whose coverage lapses soon are then index
+lookups on `domain_coverage` instead of $unwind-ing the SAN lists of the
+whole collection.
+
+Coverage is the union of the validity intervals of a domain's certificates;
+it lapses at the end of the merged interval that contains the current time.
+Removed certificates are not taken out of the index.
+"""
+import re
+import threading
+import time
+
+from pymongo import ASCENDING, errors
+
+from domains import registrable_domain
+from search_index import extract_names
+from validity_calendar import STATE_COLLECTION, backfill_validity_dates
+
+COVERAGE_COLLECTION = "domain_coverage"
+# Bump when the stored entry format changes so the index is rebuilt from scratch
+COVERAGE_VERSION = 1
+BATCH_SIZE = 10000
+
+
+def _first(value):
+    if isinstance(value, list):
+        return value[0] if value else None
+    return value
+
+
+def coverage_entries(doc):
+    """Index entries of one certificate, one per registrable domain among its names"""
+    if not doc.get("not_before") or not doc.get("not_after"):
+        return []
+    by_domain = {}
+    for name in extract_names(doc):
+        domain = registrable_domain(name)
+        if domain:
+            by_domain.setdefault(domain, []).append(name)
+    issuer = doc.get("parsed", {}).get("issuer", {})
+    return [
+        {
+            "domain": domain,
+            "cert_id": doc["_id"],
+            "fingerprint": doc.get("parsed", {}).get("fingerprint_sha256"),
+            "names": sorted(names),
+            "not_before": doc["not_before"],
+            "not_after": doc["not_after"],
+            "issuer": _first(issuer.get("organization")),
+            "issuer_cn": _first(issuer.get("common_name")),
+        }
+        for domain, names in by_domain.items()
+    ]
+
+
+def merge_intervals(intervals):
+    """Union of (start, end) intervals as a sorted list of disjoint [start, end]"""
+    merged = []
+    for start, end in sorted(intervals):
+        if merged and start <= merged[-1][1]:
+            merged[-1][1] = max(merged[-1][1], end)
+        else:
+            merged.append([start, end])
+    return merged
+
+
+def lapse(merged, now):
+    """(end of the coverage that contains now, or now when uncovered; start of the next coverage or None)"""
+    lapses_at = now
+    for start, end in merged:
+        if start <= now < end:
+            lapses_at = end
+        elif start > lapses_at:
+            return lapses_at, start
+    return lapses_at, None
+
+
+class DomainCoverage:
+    """The domain_coverage collection, kept up to date with new certificates"""
+
+    def __init__(self, refresh_seconds=60):
+        self.refresh_seconds = refresh_seconds
+        self.last_refresh = 0.0
+        self.last_version = None
+        self.ready = False
+        self._lock = threading.Lock()
+
+    def refresh(self, collection, version=None):
+        """Add the entries of new certificates to the index"""
+        with self._lock:
+            db = collection.database
+            state = db[STATE_COLLECTION]
+            coverage = db[COVERAGE_COLLECTION]
+
+            latest = collection.find_one({}, {"_id": 1}, sort=[("_id", -1)])
+            if latest is not None:
+                max_id = latest["_id"]
+                backfill_validity_dates(collection, max_id)
+
+                previous = state.find_one({"_id": COVERAGE_COLLECTION}) or {}
+                if previous and previous.get("version") != COVERAGE_VERSION:
+                    state.delete_one({"_id": COVERAGE_COLLECTION})
+                    coverage.drop()
+                    previous = {}
+                coverage.create_index([("domain", ASCENDING), ("not_before", ASCENDING)])
+                coverage.create_index([("not_after", ASCENDING), ("domain", ASCENDING)])
+                last_id = previous.get("last_id")
+                if last_id != max_id:
+                    # Claim the range first so concurrent workers never index it twice
+                    try:
+                        claimed = state.update_one(
+                            {"_id": COVERAGE_COLLECTION, "last_id": last_id},
+                            {"$set": {"last_id": max_id, "version": COVERAGE_VERSION}},
+                            upsert=last_id is None,
+                        )
+                    except errors.DuplicateKeyError:
+                        claimed = None  # another worker created the state first
+                    if claimed and (claimed.modified_count or claimed.upserted_id is not None):
+                        self._add_range(collection, coverage, last_id, max_id)
+
+            self.last_refresh = time.monotonic()
+            self.last_version = version
+            self.ready = True
+
+    def _add_range(self, collection, coverage, after_id, max_id):
+        id_range = {"$lte": max_id}
+        if after_id is not None:
+            id_range["$gt"] = after_id
+        cursor = collection.find(
+            {"_id": id_range},
+            {"not_before": 1, "not_after": 1, "parsed.subject.common_name": 1,
+             "parsed.extensions.subject_alt_name.dns_names": 1, "parsed.fingerprint_sha256": 1,
+             "parsed.issuer.organization": 1, "parsed.issuer.common_name": 1},
+        ).batch_size(BATCH_SIZE)
+        batch = []
+        for doc in cursor:
+            batch.extend(coverage_entries(doc))
+            if len(batch) >= BATCH_SIZE:
+                coverage.insert_many(batch, ordered=False)
+                batch = []
+        if batch:
+            coverage.insert_many(batch, ordered=False)
+
+    def refresh_if_stale(self, collection, version=None):
+        if (not self.ready or version != self.last_version
+                or time.monotonic() - self.last_refresh > self.refresh_seconds):
+            self.refresh(collection, version)
+
+
+def domain_entries(db, domain):
+    entries = list(db[COVERAGE_COLLECTION].find({"domain": domain}, {"_id": 0}).sort("not_before", ASCENDING))
+    for entry in entries:
+        entry["cert_id"] = str(entry["cert_id"])
+    return entries
+
+
+def lapsing_domains(db, now, horizon, suffix=None):
+    """
+    Domains covered after `now` whose coverage lapses before `horizon`:
+    [{"domain", "lapses_at", "covered_again_at", "issuer", "issuer_cn"}], soonest first.
+    """
+    match = {"not_after": {"$gt": now}}
+    if suffix:
+        match["domain"] = {"$regex": r"(^|\.)" + re.escape(suffix.lower().lstrip(".")) + "$"}
+    rows = db[COVERAGE_COLLECTION].aggregate([
+        {"$match": match},
+        {"$group": {
+            "_id": "$domain",
+            "last_end": {"$max": "$not_after"},
+            # Certificates that start in the future can leave a gap before last_end
+            "future": {"$max": {"$cond": [{"$gt": ["$not_before", now]}, 1, 0]}},
+            "intervals": {"$push": {"start": "$not_before", "end": "$not_after",
+                                    "issuer": "$issuer", "issuer_cn": "$issuer_cn"}},
+        }},
+        {"$match": {"$or": [{"last_end": {"$lt": horizon}}, {"future": 1}]}},
+    ], allowDiskUse=True)
+
+    lapsing = []
+    for row in rows:
+        lapses_at, covered_again_at = lapse(
+            merge_intervals((interval["start"], interval["end"]) for interval in row["intervals"]), now)
+        if lapses_at >= horizon:
+            continue
+        # The certificate whose expiry ends the coverage
+        last = max((interval for interval in row["intervals"] if interval["end"] <= lapses_at),
+                   key=lambda interval: interval["end"], default={})
+        lapsing.append({
+            "domain": row["_id"],
+            "lapses_at": lapses_at,
+            "covered_again_at": covered_again_at,
+            "issuer": last.get("issuer"),
+            "issuer_cn": last.get("issuer_cn"),
+        })
+    return sorted(lapsing, key=lambda row: (row["lapses_at"], row["domain"]))
@@ -0,0 +1,45 @@
+"""
+Registrable domain ("eTLD+1") of a DNS name.
+
+Uses tldextract's bundled Public Suffix List snapshot when it is installed
+(no network access). Otherwise a built-in list of common second-level public
+suffixes is used, e.g. "com.pk", "gov.pk", "co.uk", which covers the scan
+datasets this dashboard serves.
+"""
+try:
+    import tldextract
+    _extract = tldextract.TLDExtract(suffix_list_urls=(), cache_dir=None)
+except ImportError:  # optional; fall back to the built-in suffixes
+    _extract = None
+
+SECOND_LEVEL_SUFFIXES = {
+    # Pakistan (PKNIC)
+    "com.pk", "net.pk", "edu.pk", "org.pk", "fam.pk", "biz.pk", "web.pk", "gov.pk", "gob.pk", "gok.pk",
+    "gon.pk", "gop.pk", "gos.pk", "info.pk",
+    # Common elsewhere
+    "co.uk", "org.uk", "ac.uk", "gov.uk", "com.au", "net.au", "org.au", "edu.au", "gov.au", "co.in", "net.in",
+    "org.in", "gov.in", "ac.in", "co.jp", "ne.jp", "or.jp", "ac.jp", "com.br", "com.cn", "net.cn", "org.cn",
+    "gov.cn", "com.tr", "co.za", "com.sg", "com.my", "co.nz", "com.sa", "com.ae", "co.kr", "com.hk",
+}
+
+
+def normalize_name(name):
+    """Lower-case a DNS name and strip a leading wildcard label and trailing dot"""
+    name = name.strip().lower().rstrip(".")
+    return name[2:] if name.startswith("*.") else name
+
+
+def registrable_domain(name):
+    """"www.example.com.pk" -> "example.com.pk"; None for names without one (e.g. bare suffixes)"""
+    name = normalize_name(name)
+    if not name or "." not in name:
+        return None
+    if _extract is not None:
+        parts = _extract(name)
+        return f"{parts.domain}.{parts.suffix}" if parts.domain and parts.suffix else None
+    labels = name.split(".")
+    if len(labels) >= 3 and ".".join(labels[-2:]) in SECOND_LEVEL_SUFFIXES:
+        return ".".join(labels[-3:])
+    if ".".join(labels[-2:]) in SECOND_LEVEL_SUFFIXES:
+        return None
+    return ".".join(labels[-2:])
@@ -0,0 +1,99 @@
+"""
+Server-side downsampling of time series for charting.
+
+A series with more points than a chart can show is reduced to at most
+`max_points` of its own rows, so payload size and render time stay bounded
+whatever the time range or granularity:
+
+- `lttb` (Largest-Triangle-Three-Buckets) keeps the first and last point and,
+  from each of the buckets in between, the point that forms the largest
+  triangle with the point kept before it and the average of the next bucket.
+  The shape of the line is preserved, including isolated peaks.
+- `minmax` keeps the smallest and largest point of each bucket (an envelope),
+  so no extreme value is lost; it returns up to max_points points.
+
+Rows are returned unchanged (all their fields), in their original order. Rows
+without an x (such as a bucket of undated certificates) are not on the axis:
+they are kept and count against `max_points`. Below MIN_POINTS points, evenly
+spaced rows are kept instead.
+"""
+from datetime import date
+
+METHODS = ("lttb", "minmax")
+MIN_POINTS = 3
+
+
+def date_x(value):
+    """Numeric x of an ISO date ("2021-04-01") or year (2021) for the area computation"""
+    if isinstance(value, str):
+        return date.fromisoformat(value[:10]).toordinal()
+    return value
+
+
+def _buckets(count, buckets):
+    """Index ranges splitting points 1..count-2 into `buckets` nearly equal buckets"""
+    size = (count - 2) / buckets
+    return [(1 + int(i * size), 1 + int((i + 1) * size)) for i in range(buckets)]
+
+
+def lttb(rows, max_points, x, y):
+    if len(rows) <= max_points:
+        return rows
+    points = [(x(row), y(row) or 0) for row in rows]
+    buckets = _buckets(len(rows), max_points - 2)
+    kept = [0]
+    for i, (start, end) in enumerate(buckets):
+        # Average of the next bucket (or the last point)
+        next_start, next_end = buckets[i + 1] if i + 1 < len(buckets) else (len(rows) - 1, len(rows))
+        average_x = sum(point[0] for point in points[next_start:next_end]) / (next_end - next_start)
+        average_y = sum(point[1] for point in points[next_start:next_end]) / (next_end - next_start)
+        previous_x, previous_y = points[kept[-1]]
+        best = max(
+            range(start, end),
+            key=lambda j: abs((previous_x - average_x) * (points[j][1] - previous_y)
+                              - (previous_x - points[j][0]) * (average_y - previous_y)),
+        )
+        kept.append(best)
+    kept.append(len(rows) - 1)
+    return [rows[i] for i in kept]
+
+
+def minmax(rows, max_points, y):
+    if len(rows) <= max_points:
+        return rows
+    buckets = max(1, max_points // 2)
+    size = len(rows) / buckets
+    kept = []
+    for i in range(buckets):
+        indexes = range(int(i * size), int((i + 1) * size))
+        if not indexes:
+            continue
+        low = min(indexes, key=lambda j: y(rows[j]) or 0)
+        high = max(indexes, key=lambda j: y(rows[j]) or 0)
+        kept.extend(sorted({low, high}))
+    return [rows[i] for i in kept]
+
+
+def _even(rows, count):
+    """`count` rows spread evenly over rows, first and last included"""
+    if count <= 1:
+        return rows[:count]
+    return [rows[round(i * (len(rows) - 1) / (count - 1))] for i in range(count)]
+
+
+def downsample(rows, max_points, method="lttb", x_field="date", y_field="count"):
+    """(rows reduced to at most max_points, metadata or None when nothing was dropped)"""
+    if not max_points or len(rows) <= max_points:
+        return rows, None
+    undated = set([i for i, row in enumerate(rows) if row.get(x_field) is None][:max_points])
+    series = [row for row in rows if row.get(x_field) is not None]
+    budget = max_points - len(undated)
+    if budget < MIN_POINTS:
+        kept = _even(series, budget)
+    elif method == "lttb":
+        kept = lttb(series, budget, lambda row: date_x(row[x_field]), lambda row: row.get(y_field))
+    else:
+        kept = minmax(series, budget, lambda row: row.get(y_field))
+    kept = {id(row) for row in kept}
+    reduced = [row for i, row in enumerate(rows) if i in undated or id(row) in kept]
+    return reduced, {"method": method, "points": len(reduced), "original_points": len(rows)}
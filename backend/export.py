@@ -0,0 +1,237 @@
+"""
+Streaming exports of certificate rows and analytics results as CSV, Parquet or Arrow IPC.
+
+Rows are pulled from the pymongo cursor and written in bounded-size record
+batches, and every batch is handed to the client as soon as it is encoded, so
+memory use stays constant no matter how many certificates are exported.
+Parquet and Arrow IPC need pyarrow (optional); CSV only uses the standard library.
+
+Arrow column types are fixed by the first batch, as the schema is written
+before the rest is read: fields that hold a list in any document (or are
+multi-valued in scanner output, LIST_FIELDS) are list<string> with single
+values wrapped, columns of mixed types are strings, and later values that do
+not fit a column's type are written as null instead of failing the stream.
+"""
+import csv
+import io
+import json
+import re
+from datetime import datetime
+
+try:
+    import pyarrow as pa
+    import pyarrow.parquet as pq
+except ImportError:  # only CSV exports are available without pyarrow
+    pa = None
+    pq = None
+
+FORMATS = {
+    "csv": ("text/csv", "csv"),
+    "parquet": ("application/vnd.apache.parquet", "parquet"),
+    "arrow": ("application/vnd.apache.arrow.stream", "arrows"),
+}
+
+DEFAULT_FIELDS = [
+    "parsed.fingerprint_sha256",
+    "parsed.serial_number",
+    "parsed.subject.common_name",
+    "parsed.issuer.common_name",
+    "parsed.issuer.organization",
+    "parsed.issuer.country",
+    "not_before",
+    "not_after",
+    "parsed.signature_algorithm.name",
+    "parsed.subject_key_info.fingerprint_sha256",
+    "parsed.extensions.subject_alt_name.dns_names",
+]
+
+# Multi-valued in scanner output, though a plain string in some documents: always list<string> columns
+LIST_FIELDS = {
+    "parsed.subject.common_name",
+    "parsed.issuer.common_name",
+    "parsed.issuer.organization",
+    "parsed.issuer.country",
+    "parsed.extensions.subject_alt_name.dns_names",
+}
+
+_FIELD_PATTERN = re.compile(r"^(parsed(\.[A-Za-z0-9_]+)+|not_before|not_after)$")
+
+
+def parse_fields(fields):
+    """Validate a comma separated field list (dotted paths under parsed.*, or the native dates)"""
+    if not fields:
+        return list(DEFAULT_FIELDS)
+    names = [name.strip() for name in fields.split(",") if name.strip()]
+    invalid = [name for name in names if not _FIELD_PATTERN.match(name)]
+    if invalid:
+        raise ValueError(f"Unsupported export fields: {', '.join(invalid)}")
+    return names
+
+
+def format_available(fmt):
+    return fmt == "csv" or (fmt in FORMATS and pa is not None)
+
+
+def _get_path(doc, path):
+    value = doc
+    for part in path.split("."):
+        if not isinstance(value, dict):
+            return None
+        value = value.get(part)
+    return value
+
+
+def certificate_rows(cursor, fields):
+    """Flatten certificate documents into rows of the requested fields"""
+    for doc in cursor:
+        yield [_get_path(doc, field) for field in fields]
+
+
+def flatten_record(record, prefix=""):
+    """Flatten nested dicts of an analytics result into dotted columns"""
+    flat = {}
+    for key, value in record.items():
+        name = f"{prefix}{key}"
+        if isinstance(value, dict):
+            flat.update(flatten_record(value, name + "."))
+        elif isinstance(value, list) and any(isinstance(item, dict) for item in value):
+            flat[name] = json.dumps(value, default=str)
+        else:
+            flat[name] = value
+    return flat
+
+
+def _batches(rows, batch_size):
+    batch = []
+    for row in rows:
+        batch.append(row)
+        if len(batch) >= batch_size:
+            yield batch
+            batch = []
+    if batch:
+        yield batch
+
+
+def _csv_value(value):
+    if value is None:
+        return ""
+    if isinstance(value, list):
+        return ";".join(_csv_value(item) for item in value)
+    if isinstance(value, datetime):
+        return value.isoformat()
+    return str(value)
+
+
+def _arrow_value(value):
+    if isinstance(value, list):
+        return [_arrow_value(item) for item in value]
+    if value is None or isinstance(value, (str, int, float, bool, datetime)):
+        return value
+    return str(value)  # ObjectId and friends
+
+
+class _Drain(io.RawIOBase):
+    """Write-only sink that hands written bytes back in chunks but keeps a running position (for Parquet offsets)"""
+
+    def __init__(self):
+        self.chunks = []
+        self.position = 0
+
+    def writable(self):
+        return True
+
+    def write(self, data):
+        self.chunks.append(bytes(data))
+        self.position += len(data)
+        return len(data)
+
+    def tell(self):
+        return self.position
+
+    def take(self):
+        data = b"".join(self.chunks)
+        self.chunks = []
+        return data
+
+
+def _column_type(name, values):
+    """Arrow type of a column, from its values in the first batch"""
+    if name in LIST_FIELDS or any(isinstance(value, list) for value in values):
+        return pa.list_(pa.string())
+    try:
+        inferred = pa.array(values).type
+    except (pa.ArrowInvalid, pa.ArrowTypeError):
+        return pa.string()  # mixed types
+    return pa.string() if pa.types.is_null(inferred) else inferred
+
+
+def _fits(value, arrow_type):
+    try:
+        pa.scalar(value, type=arrow_type)
+    except (pa.ArrowInvalid, pa.ArrowTypeError, TypeError, ValueError):
+        return None
+    return value
+
+
+def _arrow_array(values, arrow_type):
+    if pa.types.is_list(arrow_type):
+        return pa.array([None if value is None else [_csv_value(item) for item in
+                                                     (value if isinstance(value, list) else [value])]
+                         for value in values], type=arrow_type)
+    if pa.types.is_string(arrow_type):
+        return pa.array([None if value is None else _csv_value(value) for value in values], type=arrow_type)
+    try:
+        return pa.array(values, type=arrow_type)
+    except (pa.ArrowInvalid, pa.ArrowTypeError, TypeError, ValueError):
+        # The schema is fixed by the first batch: values of another type are written as null
+        return pa.array([_fits(value, arrow_type) for value in values], type=arrow_type)
+
+
+def _arrow_batch(columns, batch, schema):
+    arrays = []
+    for i, name in enumerate(columns):
+        values = [_arrow_value(row[i]) for row in batch]
+        arrow_type = _column_type(name, values) if schema is None else schema.field(name).type
+        arrays.append(_arrow_array(values, arrow_type))
+    return pa.RecordBatch.from_arrays(arrays, names=columns)
+
+
+def _arrow_writer(sink, schema, fmt):
+    if fmt == "parquet":
+        return pq.ParquetWriter(sink, schema)
+    return pa.ipc.new_stream(sink, schema)
+
+
+def stream(rows, columns, fmt, batch_size=10000):
+    """Yield the encoded export, one record batch at a time"""
+    if fmt == "csv":
+        buffer = io.StringIO()
+        writer = csv.writer(buffer)
+        writer.writerow(columns)
+        for batch in _batches(rows, batch_size):
+            writer.writerows([_csv_value(value) for value in row] for row in batch)
+            yield buffer.getvalue().encode()
+            buffer.seek(0)
+            buffer.truncate()
+        if buffer.tell():
+            yield buffer.getvalue().encode()
+        return
+
+    sink = _Drain()
+    writer = None
+    schema = None
+    for batch in _batches(rows, batch_size):
+        # The schema is fixed by the first batch (see _column_type); later batches are coerced to it
+        record_batch = _arrow_batch(columns, batch, schema)
+        if writer is None:
+            schema = record_batch.schema
+            writer = _arrow_writer(sink, schema, fmt)
+        writer.write_batch(record_batch)
+        yield sink.take()
+
+    if writer is None:
+        # No rows: still produce a valid, empty file with all-string columns
+        schema = pa.schema([(name, pa.string()) for name in columns])
+        writer = _arrow_writer(sink, schema, fmt)
+    writer.close()
+    yield sink.take()
@@ -0,0 +1,240 @@
+"""
+Generic histograms over numeric certificate fields.
+
+A histogram names a field, a binning (explicit boundaries, log scale or
+equal-count "auto" buckets), optional filters and an optional grouping
+dimension. It is computed in a single pass: MongoDB derives each document's
+bucket index in the pipeline (the number of boundaries <= value) and counts
+with one $group, or the columnar engine does the same over the in-memory
+columns. Labels come from the boundaries, so integer fields read "2", "3-4",
+"5-9", "100+" and continuous fields "30-90".
+"""
+import json
+import math
+
+FIELDS = {
+    "validity_days": {
+        "expr": {"$divide": [{"$subtract": ["$not_after", "$not_before"]}, 1000 * 60 * 60 * 24]},
+        "integer": False,
+        "unit": "days",
+        "columnar": "validity_days",
+    },
+    "san_count": {
+        "expr": {"$size": {"$ifNull": ["$parsed.extensions.subject_alt_name.dns_names", []]}},
+        "integer": True,
+        "unit": "names",
+        "columnar": "san_count",
+    },
+    "key_size": {
+        "expr": {"$ifNull": ["$parsed.subject_key_info.rsa_public_key.length",
+                             "$parsed.subject_key_info.ecdsa_public_key.length"]},
+        "integer": True,
+        "unit": "bits",
+        "columnar": None,
+    },
+}
+
+GROUPS = {
+    "issuer": {"expr": "$parsed.issuer.common_name", "columnar": "issuer_cn"},
+    "signature_algorithm": {"expr": "$parsed.signature_algorithm.name", "columnar": "signature_algorithm"},
+    "issue_year": {"expr": {"$year": "$not_before"}, "columnar": "issue_year"},
+}
+
+BINNINGS = ("explicit", "log", "auto")
+
+# Log-scale buckets start at 0, 1 and grow by `base` up to this value; empty ones at the top are dropped
+LOG_LIMIT = 10 ** 12
+
+
+def parse_boundaries(spec):
+    """Parse "0,30,90" into sorted numeric boundaries"""
+    try:
+        values = sorted({float(value) for value in spec.split(",") if value.strip()})
+    except ValueError:
+        raise ValueError(f"Invalid boundaries: {spec}")
+    if len(values) < 2:
+        raise ValueError("At least two boundaries are needed")
+    return [int(value) if value.is_integer() else value for value in values]
+
+
+def log_boundaries(base):
+    if base < 2:
+        raise ValueError("Log-scale base must be >= 2")
+    boundaries = [0, 1]
+    while boundaries[-1] < LOG_LIMIT:
+        boundaries.append(boundaries[-1] * base)
+    return boundaries
+
+
+def _number(value):
+    value = round(float(value), 6)
+    return int(value) if value.is_integer() else value
+
+
+def bucket_label(lower, upper, integer):
+    """Label of the bucket [lower, upper); upper None for the open-ended last bucket"""
+    if upper is None:
+        return f"{_number(lower)}+"
+    if integer:
+        first, last = math.ceil(lower), math.ceil(upper) - 1
+        if first == last:
+            return str(first)
+        if first < last:
+            return f"{first}-{last}"
+    return f"{_number(lower)}-{_number(upper)}"
+
+
+def validate(field, binning, group_by):
+    if field not in FIELDS:
+        raise ValueError(f"Unknown histogram field: {field} (use {', '.join(FIELDS)})")
+    if binning not in BINNINGS:
+        raise ValueError(f"Unknown binning: {binning} (use {', '.join(BINNINGS)})")
+    if group_by is not None and group_by not in GROUPS:
+        raise ValueError(f"Unknown group_by: {group_by} (use {', '.join(GROUPS)})")
+
+
+def mongo_pipeline(field, boundaries, group_by=None, match=None):
+    """One pass: project the value, derive its bucket index and count per (group, index)"""
+    project = {"_id": 0, "value": FIELDS[field]["expr"]}
+    if group_by:
+        project["group"] = GROUPS[group_by]["expr"]
+    bucket = {
+        "$cond": [
+            {"$isNumber": "$value"},
+            {"$size": {"$filter": {"input": boundaries, "cond": {"$lte": ["$$this", "$value"]}}}},
+            -1,
+        ]
+    }
+    return ([{"$match": match}] if match else []) + [
+        {"$project": project},
+        {"$group": {"_id": {"group": "$group" if group_by else None, "bucket": bucket}, "count": {"$sum": 1}}},
+    ]
+
+
+def _mongo_auto_boundaries(collection, field, bins, match, integer):
+    """Equal-count boundaries from $bucketAuto"""
+    pipeline = ([{"$match": match}] if match else []) + [
+        {"$project": {"_id": 0, "value": FIELDS[field]["expr"]}},
+        {"$match": {"value": {"$type": "number"}}},
+        {"$bucketAuto": {"groupBy": "$value", "buckets": bins}},
+    ]
+    buckets = list(collection.aggregate(pipeline))
+    if not buckets:
+        return [], []
+    boundaries = [bucket["_id"]["min"] for bucket in buckets]
+    # $bucketAuto's last bucket includes its maximum
+    top = buckets[-1]["_id"]["max"]
+    boundaries.append(top + 1 if integer else math.nextafter(top, math.inf))
+    rows = [(None, i + 1, bucket["count"]) for i, bucket in enumerate(buckets)]
+    return boundaries, rows
+
+
+def _columnar_values(columns, field):
+    name = FIELDS[field]["columnar"]
+    if name == "validity_days":
+        return columns.validity_days()
+    return columns.columns[name].astype("float64")
+
+
+def _columnar_groups(columns, group_by):
+    name = GROUPS[group_by]["columnar"]
+    if name == "issue_year":
+        return columns.issue_years(), lambda year: year if year >= 0 else None
+    return columns.columns[name], columns.dictionaries[name].decode
+
+
+def supports_columnar(field):
+    return FIELDS[field]["columnar"] is not None
+
+
+def _assemble(rows, boundaries):
+    """Per group: counts indexed like the pipeline (0 below, 1..n-1 buckets, n overflow) plus missing"""
+    groups = {}
+    for group, index, count in rows:
+        key = json.dumps(group, default=str, sort_keys=True)
+        entry = groups.setdefault(key, {"group": group, "counts": [0] * (len(boundaries) + 1), "missing": 0})
+        if index < 0:
+            entry["missing"] += count
+        else:
+            entry["counts"][index] += count
+    return list(groups.values())
+
+
+def _trim(groups, boundaries):
+    """Drop the empty log-scale buckets above the highest value seen"""
+    last = max((i for entry in groups for i, count in enumerate(entry["counts"][1:-1], 1) if count), default=1)
+    keep = boundaries[:last + 1]
+    for entry in groups:
+        counts = entry["counts"]
+        entry["counts"] = counts[:last + 1] + [sum(counts[last + 1:])]
+    return keep
+
+
+def _buckets(entry, boundaries, integer):
+    counts = entry["counts"]
+    buckets = [
+        {"lower": _number(boundaries[i]), "upper": _number(boundaries[i + 1]),
+         "label": bucket_label(boundaries[i], boundaries[i + 1], integer), "count": counts[i + 1]}
+        for i in range(len(boundaries) - 1)
+    ]
+    buckets.append({"lower": _number(boundaries[-1]), "upper": None, "label": bucket_label(boundaries[-1], None, integer),
+                    "count": counts[-1]})
+    return {
+        "buckets": buckets,
+        "below": counts[0],
+        "missing": entry["missing"],
+        "total": sum(counts) + entry["missing"],
+    }
+
+
+def histogram(collection, field, binning="explicit", boundaries=None, bins=10, base=2, group_by=None,
+              group_limit=20, match=None, columns=None, column_mask=None):
+    """
+    Compute a histogram. `match` filters the Mongo pipeline; when `columns` (a
+    ColumnarSnapshot) is given the columns are used instead, filtered by
+    `column_mask` (which must express the same filters).
+    """
+    validate(field, binning, group_by)
+    integer = FIELDS[field]["integer"]
+    if columns is not None and not supports_columnar(field):
+        columns = None
+
+    if binning == "explicit":
+        if not boundaries:
+            raise ValueError("Explicit binning needs boundaries")
+    elif binning == "log":
+        boundaries = log_boundaries(base)
+    elif group_by is not None:
+        raise ValueError("Auto binning cannot be combined with group_by")
+
+    if columns is not None:
+        values = _columnar_values(columns, field)
+        groups, decode = _columnar_groups(columns, group_by) if group_by else (None, None)
+        if binning == "auto":
+            boundaries = columns.quantile_boundaries(values, bins, column_mask)
+        counts = columns.histogram_counts(values, boundaries, column_mask, groups) if boundaries else {}
+        rows = [(decode(group) if decode else None, index, count) for (group, index), count in counts.items()]
+    elif binning == "auto":
+        boundaries, rows = _mongo_auto_boundaries(collection, field, bins, match, integer)
+    else:
+        rows = [
+            (row["_id"].get("group"), row["_id"]["bucket"], row["count"])
+            for row in collection.aggregate(mongo_pipeline(field, boundaries, group_by, match))
+        ]
+
+    result = {"field": field, "unit": FIELDS[field]["unit"], "binning": binning}
+    if not boundaries:
+        return {**result, "boundaries": [], "buckets": [], "below": 0, "missing": 0, "total": 0}
+
+    entries = _assemble(rows, boundaries)
+    if binning == "log":
+        boundaries = _trim(entries, boundaries)
+    result["boundaries"] = [_number(boundary) for boundary in boundaries]
+
+    if group_by is None:
+        entry = entries[0] if entries else {"counts": [0] * (len(boundaries) + 1), "missing": 0}
+        return {**result, **_buckets(entry, boundaries, integer)}
+
+    grouped = [{"group": entry["group"], **_buckets(entry, boundaries, integer)} for entry in entries]
+    grouped.sort(key=lambda entry: -entry["total"])
+    return {**result, "group_by": group_by, "groups": grouped[:group_limit]}
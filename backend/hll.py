@@ -0,0 +1,72 @@
+"""
+HyperLogLog sketches for approximate distinct counts.
+
+A sketch with precision p keeps m = 2**p one-byte registers and estimates the
+number of distinct values added with a relative standard error of about
+1.04 / sqrt(m): 0.81% for p=14 (16 KiB), 1.63% for p=12 (4 KiB). Sketches of
+the same precision merge by taking the register-wise maximum, so sketches
+built per partition (month, worker, shard) combine into the sketch of their
+union without rescanning.
+"""
+import collections
+import hashlib
+import math
+
+_INVERSE_POWERS = [2.0 ** -rank for rank in range(65)]
+
+
+class HyperLogLog:
+
+    def __init__(self, precision=14, registers=None):
+        if not 4 <= precision <= 16:
+            raise ValueError("precision must be between 4 and 16")
+        self.precision = precision
+        self.m = 1 << precision
+        self.registers = bytearray(registers) if registers is not None else bytearray(self.m)
+        if len(self.registers) != self.m:
+            raise ValueError("register count does not match the precision")
+
+    @property
+    def relative_error(self):
+        """Relative standard error of count()"""
+        return 1.04 / math.sqrt(self.m)
+
+    def add(self, value):
+        digest = hashlib.blake2b(value.encode("utf-8"), digest_size=8).digest()
+        x = int.from_bytes(digest, "big")
+        index = x >> (64 - self.precision)
+        rest = x & ((1 << (64 - self.precision)) - 1)
+        rank = (64 - self.precision) - rest.bit_length() + 1
+        if rank > self.registers[index]:
+            self.registers[index] = rank
+
+    def merge(self, other):
+        """Fold another sketch of the same precision into this one"""
+        if other.precision != self.precision:
+            raise ValueError("cannot merge sketches of different precision")
+        self.registers = bytearray(map(max, self.registers, other.registers))
+        return self
+
+    @classmethod
+    def union(cls, sketches, precision):
+        result = cls(precision)
+        for sketch in sketches:
+            result.merge(sketch)
+        return result
+
+    def count(self):
+        m = self.m
+        alpha = 0.7213 / (1 + 1.079 / m)
+        histogram = collections.Counter(self.registers)
+        estimate = alpha * m * m / sum(n * _INVERSE_POWERS[rank] for rank, n in histogram.items())
+        zeros = histogram.get(0, 0)
+        if estimate <= 2.5 * m and zeros:
+            estimate = m * math.log(m / zeros)  # linear counting for small cardinalities
+        return int(round(estimate))
+
+    def to_bytes(self):
+        return bytes([self.precision]) + bytes(self.registers)
+
+    @classmethod
+    def from_bytes(cls, data):
+        return cls(data[0], data[1:])
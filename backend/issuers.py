@@ -0,0 +1,202 @@
+"""
+Canonical issuer dimension.
+
+Every distinct issuer (organization, country and CN after normalization) gets
+a compact integer `issuer_id`, stored on each certificate and in the small
+`issuers` collection with the raw spellings seen for it. Organization names
+are normalized once here: case, punctuation and legal suffixes are ignored
+("DigiCert, Inc." = "DigiCert Inc") and known aliases are merged ("Let's
+Encrypt Authority" = "Let's Encrypt"). Issuer-based groupings then $group on
+the indexed integer and roll the per-issuer rows up through the in-memory
+table, instead of unwinding and normalizing issuer fields per request.
+
+New certificates get their issuer_id on the first refresh after they are
+inserted (refresh_if_stale compares the dataset version).
+"""
+import re
+import threading
+import time
+
+from pymongo import ASCENDING, ReturnDocument, errors
+
+from validity_calendar import STATE_COLLECTION
+
+ISSUERS_COLLECTION = "issuers"
+ISSUER_FIELDS = {
+    "organization": "parsed.issuer.organization",
+    "country": "parsed.issuer.country",
+    "common_name": "parsed.issuer.common_name",
+}
+DIMENSIONS = tuple(ISSUER_FIELDS)
+
+LEGAL_SUFFIXES = {"inc", "ltd", "limited", "llc", "gmbh", "sa", "sas", "bv", "nv", "ag", "plc", "corp",
+                  "corporation", "co", "srl", "spa", "as", "ab", "oy", "pty", "pvt", "kk"}
+# Normalized organization -> the organization it is an alias of
+ORGANIZATION_ALIASES = {
+    "let's encrypt authority": "let's encrypt",
+    "internet security research group": "let's encrypt",
+    "comodo ca": "sectigo",
+}
+# Display names of alias targets; other organizations keep their first spelling seen
+ORGANIZATION_NAMES = {
+    "let's encrypt": "Let's Encrypt",
+    "sectigo": "Sectigo Limited",
+}
+
+
+def _strings(value):
+    if isinstance(value, str):
+        value = [value]
+    return [item.strip() for item in value or [] if isinstance(item, str) and item.strip()]
+
+
+def organization_key(name):
+    """"DigiCert, Inc." -> "digicert"; aliases resolve to the organization they stand for"""
+    key = name.replace("’", "'").lower().replace(".", "").replace(",", " ")
+    words = key.split()
+    while len(words) > 1 and words[-1] in LEGAL_SUFFIXES:
+        words.pop()
+    key = " ".join(words)
+    return ORGANIZATION_ALIASES.get(key, key)
+
+
+def issuer_key(organizations, countries, common_names):
+    """Identity of an issuer after normalization"""
+    return "|".join([
+        "+".join(sorted({organization_key(org) for org in organizations})),
+        "+".join(sorted({country.upper() for country in countries})),
+        "+".join(sorted(set(common_names))),
+    ])
+
+
+class IssuerDimension:
+    """The issuers collection, cached in memory as issuer_id -> canonical values"""
+
+    def __init__(self, refresh_seconds=60):
+        self.refresh_seconds = refresh_seconds
+        self.issuers = {}
+        self.organization_names = {}
+        self.last_refresh = 0.0
+        self.last_version = None
+        self.ready = False
+        self._lock = threading.Lock()
+
+    def refresh(self, collection, version=None):
+        """Assign issuer ids to the certificates that have none yet, then reload the table"""
+        with self._lock:
+            db = collection.database
+            issuers = db[ISSUERS_COLLECTION]
+            issuers.create_index([("key", ASCENDING)], unique=True)
+            collection.create_index([("issuer_id", ASCENDING)])
+
+            unassigned = {"issuer_id": {"$exists": False}}
+            rows = list(collection.aggregate([
+                {"$match": unassigned},
+                {"$group": {"_id": {name: "$" + field for name, field in ISSUER_FIELDS.items()}}},
+            ]))
+            # Array values first: equality on a scalar also matches arrays containing it,
+            # and by then those certificates are no longer unassigned
+            rows.sort(key=lambda row: not any(isinstance(value, list) for value in row["_id"].values()))
+            for row in rows:
+                raw = {name: row["_id"].get(name) for name in ISSUER_FIELDS}
+                issuer_id = self._issuer_id(db, raw)
+                collection.update_many(
+                    {**unassigned, **{field: raw[name] for name, field in ISSUER_FIELDS.items()}},
+                    {"$set": {"issuer_id": issuer_id}},
+                )
+
+            self._load(issuers)
+            self.last_refresh = time.monotonic()
+            self.last_version = version
+            self.ready = True
+
+    def _issuer_id(self, db, raw):
+        organizations = _strings(raw["organization"])
+        countries = _strings(raw["country"])
+        common_names = _strings(raw["common_name"])
+        key = issuer_key(organizations, countries, common_names)
+        issuers = db[ISSUERS_COLLECTION]
+        existing = issuers.find_one_and_update({"key": key}, {"$addToSet": {"aliases": {"$each": organizations}}})
+        if existing is not None:
+            return existing["_id"]
+        counter = db[STATE_COLLECTION].find_one_and_update(
+            {"_id": ISSUERS_COLLECTION}, {"$inc": {"next_id": 1}}, upsert=True, return_document=ReturnDocument.AFTER,
+        )
+        try:
+            issuers.insert_one({
+                "_id": counter["next_id"],
+                "key": key,
+                "organization_keys": sorted({organization_key(org) for org in organizations}),
+                "aliases": organizations,
+                "countries": sorted({country.upper() for country in countries}),
+                "common_names": sorted(set(common_names)),
+            })
+            return counter["next_id"]
+        except errors.DuplicateKeyError:  # another worker registered the issuer first
+            return issuers.find_one({"key": key})["_id"]
+
+    def _load(self, issuers):
+        docs = list(issuers.find().sort("_id", 1))
+        names = dict(ORGANIZATION_NAMES)
+        for doc in docs:
+            for org in doc.get("aliases", []):
+                names.setdefault(organization_key(org), org)
+        self.organization_names = names
+        self.issuers = {
+            doc["_id"]: {
+                "organization": [names[key] for key in doc.get("organization_keys", [])],
+                "country": doc.get("countries", []),
+                "common_name": doc.get("common_names", []),
+            }
+            for doc in docs
+        }
+
+    def refresh_if_stale(self, collection, version=None):
+        if (not self.ready or version != self.last_version
+                or time.monotonic() - self.last_refresh > self.refresh_seconds):
+            self.refresh(collection, version)
+
+    def values(self, issuer_id, dimension):
+        """Canonical values of one issuer ([None] when it has none, like $unwind with preserveNullAndEmptyArrays)"""
+        issuer = self.issuers.get(issuer_id)
+        return (issuer and issuer[dimension]) or [None]
+
+    def ids(self, dimension, value):
+        """issuer_ids whose canonical values of a dimension include `value` (any spelling of it)"""
+        value = self.canonical(dimension, value)
+        return [issuer_id for issuer_id, issuer in self.issuers.items() if value in issuer[dimension]]
+
+    def canonical(self, dimension, value):
+        if value is None:
+            return None
+        if dimension == "organization":
+            key = organization_key(value)
+            return self.organization_names.get(key, value.strip())
+        return value.strip().upper() if dimension == "country" else value.strip()
+
+    def rollup(self, rows, dimension, count_fields=("count",)):
+        """
+        Merge per-issuer rows ({"_id": issuer_id, "count": n, ...}) into
+        per-value rows of a dimension, largest first. A certificate counts once
+        for every value of its issuer, as with $unwind.
+        """
+        totals = {}
+        for row in rows:
+            for value in self.values(row["_id"], dimension):
+                entry = totals.setdefault(value, {"_id": value, **{field: 0 for field in count_fields}})
+                for field in count_fields:
+                    entry[field] += row[field]
+        return sorted(totals.values(), key=lambda entry: -entry[count_fields[0]])
+
+    def canonical_counts(self, rows, dimension):
+        """
+        Merge [{"_id": raw value, "count": n}] rows into canonical values, largest
+        first. Array values count once per element, as with $unwind (and rollup).
+        """
+        totals = {}
+        for row in rows:
+            raw = row["_id"]
+            elements = (raw or [None]) if isinstance(raw, (list, tuple)) else [raw]
+            for value in {self.canonical(dimension, element) for element in elements}:
+                totals[value] = totals.get(value, 0) + row["count"]
+        return [{"_id": value, "count": count} for value, count in sorted(totals.items(), key=lambda kv: -kv[1])]
@@ -0,0 +1,211 @@
+"""
+Live dashboard updates pushed as Server-Sent Events.
+
+A ChangeFeed per dataset follows the `certificates` collection and turns
+changes into small deltas: documents inserted / deleted / updated, +n per
+bucket of the dimensions the dashboard charts (types, issuers, ...) and the
+newly added certificates that expire soon. Deltas are batched for
+`batch_seconds` and fanned out to every subscriber's asyncio queue, so clients
+update their charts in place instead of re-running the full aggregations.
+
+The feed follows a MongoDB change stream when the server supports one
+(replica set or sharded cluster). On a standalone server it falls back to
+polling for new _ids; mode="polling" skips the change stream altogether (e.g.
+for in-process fakes). Deletes only
+change the counts (neither source carries the deleted document, so clients
+reload the bucketed counters), and updates are counted but not re-bucketed. The feed thread runs only while
+somebody is subscribed.
+"""
+import asyncio
+import json
+import threading
+import time
+from datetime import datetime, timedelta
+
+from pymongo import errors
+
+from validity_calendar import validity_dates
+
+# "$changeStream stage is only supported on replica sets"
+CHANGE_STREAMS_UNSUPPORTED = 40573
+
+
+class _Delta:
+    """Changes accumulated during one batch"""
+
+    def __init__(self, summarize, expiring_days):
+        self.summarize = summarize
+        self.expiring_days = expiring_days
+        self.inserted = 0
+        self.deleted = 0
+        self.updated = 0
+        self.buckets = {}
+        self.expiring = []
+
+    def __bool__(self):
+        return bool(self.inserted or self.deleted or self.updated)
+
+    def insert(self, doc):
+        self.inserted += 1
+        for dimension, value in self.summarize(doc).items():
+            key = json.dumps(value, default=str, sort_keys=True)
+            entry = self.buckets.setdefault(dimension, {}).setdefault(key, {"_id": value, "delta": 0})
+            entry["delta"] += 1
+
+        # New certificates have no native dates until the next backfill
+        not_after = validity_dates(doc)[1]
+        now = datetime.utcnow()
+        if isinstance(not_after, datetime) and now < not_after <= now + timedelta(days=self.expiring_days):
+            parsed = doc.get("parsed", {})
+            self.expiring.append({
+                "subject_common_name": parsed.get("subject", {}).get("common_name"),
+                "issuer_common_name": parsed.get("issuer", {}).get("common_name"),
+                "fingerprint_sha256": parsed.get("fingerprint_sha256"),
+                "not_after": not_after.isoformat(),
+                "days_remaining": (not_after - now).days,
+            })
+
+    def event(self):
+        return {
+            "type": "delta",
+            "inserted": self.inserted,
+            "deleted": self.deleted,
+            "updated": self.updated,
+            "buckets": {dimension: list(entries.values()) for dimension, entries in self.buckets.items()},
+            "expiring": self.expiring,
+        }
+
+
+class ChangeFeed:
+    """Follows one dataset's certificates and publishes deltas to subscribers"""
+
+    def __init__(self, collection, summarize, on_change=None, mode=None, batch_seconds=1.0, poll_seconds=5.0,
+                 expiring_days=30, queue_size=100):
+        self.collection = collection
+        # summarize(doc) -> {dimension: bucket value} for an inserted certificate
+        self.summarize = summarize
+        self.on_change = on_change
+        self.batch_seconds = batch_seconds
+        self.poll_seconds = poll_seconds
+        self.expiring_days = expiring_days
+        self.queue_size = queue_size
+        # None: change stream if the server supports it, else "polling"
+        self.mode = mode
+        self.sequence = 0
+        self.subscribers = set()
+        self._resume_token = None
+        self._thread = None
+        self._lock = threading.Lock()
+
+    def subscribe(self):
+        """Register the calling event loop; returns the asyncio.Queue deltas arrive on"""
+        queue = asyncio.Queue(maxsize=self.queue_size)
+        with self._lock:
+            self.subscribers.add((asyncio.get_running_loop(), queue))
+            if self._thread is None:
+                self._thread = threading.Thread(target=self._run, daemon=True)
+                self._thread.start()
+        return queue
+
+    def unsubscribe(self, queue):
+        with self._lock:
+            self.subscribers = {(loop, q) for loop, q in self.subscribers if q is not queue}
+
+    def _active(self):
+        return bool(self.subscribers)
+
+    def _publish(self, delta):
+        self.sequence += 1
+        event = delta.event()
+        event["id"] = self.sequence
+        if self.on_change is not None:
+            self.on_change()
+        for loop, queue in list(self.subscribers):
+            loop.call_soon_threadsafe(self._offer, queue, event)
+
+    @staticmethod
+    def _offer(queue, event):
+        if queue.full():
+            # A slow client fell behind: drop its backlog and tell it to reload
+            while not queue.empty():
+                queue.get_nowait()
+            event = {"type": "resync", "id": event["id"]}
+        queue.put_nowait(event)
+
+    def _run(self):
+        while True:
+            with self._lock:
+                if not self.subscribers:
+                    self._thread = None
+                    return
+            try:
+                if self.mode == "polling":
+                    self._poll()
+                else:
+                    self._watch()
+            except Exception as e:
+                print(f"❌ Live update feed error ({self.collection.full_name}):", e)
+                time.sleep(self.poll_seconds)
+
+    def _watch(self):
+        pipeline = [{"$match": {"operationType": {"$in": ["insert", "replace", "update", "delete"]}}}]
+        try:
+            stream = self.collection.watch(pipeline, full_document="updateLookup", resume_after=self._resume_token,
+                                           max_await_time_ms=int(self.batch_seconds * 1000))
+        except NotImplementedError:
+            self.mode = "polling"
+            return
+        except errors.OperationFailure as e:
+            if e.code != CHANGE_STREAMS_UNSUPPORTED:
+                raise
+            self.mode = "polling"
+            return
+
+        self.mode = "change_stream"
+        with stream:
+            delta = _Delta(self.summarize, self.expiring_days)
+            flush_at = time.monotonic() + self.batch_seconds
+            while self._active():
+                change = stream.try_next()
+                if change is not None:
+                    self._resume_token = stream.resume_token
+                    operation = change["operationType"]
+                    if operation == "insert":
+                        delta.insert(change["fullDocument"])
+                    elif operation == "delete":
+                        delta.deleted += 1
+                    else:
+                        delta.updated += 1
+                if time.monotonic() >= flush_at:
+                    if delta:
+                        self._publish(delta)
+                        delta = _Delta(self.summarize, self.expiring_days)
+                    flush_at = time.monotonic() + self.batch_seconds
+
+    def _poll(self):
+        latest = self.collection.find_one({}, {"_id": 1}, sort=[("_id", -1)])
+        last_id = latest["_id"] if latest else None
+        count = self.collection.estimated_document_count()
+        while self._active():
+            deadline = time.monotonic() + self.poll_seconds
+            while self._active() and time.monotonic() < deadline:
+                time.sleep(min(0.5, self.poll_seconds))
+
+            delta = _Delta(self.summarize, self.expiring_days)
+            query = {"_id": {"$gt": last_id}} if last_id is not None else {}
+            for doc in self.collection.find(query).sort("_id", 1):
+                delta.insert(doc)
+                last_id = doc["_id"]
+            previous, count = count, self.collection.estimated_document_count()
+            delta.deleted = max(0, previous + delta.inserted - count)
+            if delta:
+                self._publish(delta)
+
+
+def sse(event, data):
+    """Encode one Server-Sent Event"""
+    lines = [f"event: {event}"]
+    if "id" in data:
+        lines.append(f"id: {data['id']}")
+    lines.append("data: " + json.dumps(data, default=str))
+    return "\n".join(lines) + "\n\n"
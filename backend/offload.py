@@ -0,0 +1,166 @@
+"""
+Process-pool offload for CPU-bound stages.
+
+Python loops over many certificates (risk scoring, per-certificate
+post-processing) hold the GIL, so while one runs every other request in the
+process waits. Such a stage is written as a kernel over typed columns and
+run with run_columns(): the input columns are copied once into shared memory
+blocks, the rows are split into chunks of CHUNK_ROWS, and each chunk is
+computed by a pool process that attaches to the blocks by name and writes its
+slice of the output columns in place. Only block names and row ranges are
+pickled, never the rows themselves.
+
+A kernel is a module-level function kernel(inputs, outputs, start, stop)
+that reads rows start..stop-1 of its input columns and writes the same rows
+of its output columns (dicts of name -> indexable column). Columns are
+array.array typecodes ("d", "q", "b", ...). Small inputs (fewer than
+PROCESS_MIN_ROWS rows) and PROCESS_POOL_WORKERS=0 run the kernel in the
+calling thread.
+
+Pool processes are started with "spawn", so they never inherit the API's
+threads or MongoDB connections.
+"""
+import multiprocessing
+import os
+import threading
+import time
+from array import array
+from concurrent.futures import ProcessPoolExecutor
+from multiprocessing import shared_memory
+
+PROCESS_POOL_WORKERS = int(os.getenv("PROCESS_POOL_WORKERS", str(min(4, os.cpu_count() or 1))))
+PROCESS_MIN_ROWS = int(os.getenv("PROCESS_MIN_ROWS", "20000"))
+CHUNK_ROWS = int(os.getenv("PROCESS_CHUNK_ROWS", "50000"))
+
+_pool = None
+_pool_lock = threading.Lock()
+_metrics_lock = threading.Lock()
+_metrics = {
+    "runs": 0,
+    "inline_runs": 0,
+    "chunks": 0,
+    "rows": 0,
+    "failures": 0,
+    "wall_seconds": 0.0,
+    "worker_seconds": 0.0,
+}
+
+
+def pool():
+    global _pool
+    with _pool_lock:
+        if _pool is None:
+            _pool = ProcessPoolExecutor(max_workers=PROCESS_POOL_WORKERS,
+                                        mp_context=multiprocessing.get_context("spawn"))
+        return _pool
+
+
+def shutdown():
+    global _pool
+    with _pool_lock:
+        if _pool is not None:
+            _pool.shutdown(wait=False, cancel_futures=True)
+            _pool = None
+
+
+def _record(**increments):
+    with _metrics_lock:
+        for name, value in increments.items():
+            _metrics[name] += value
+
+
+def metrics():
+    with _metrics_lock:
+        report = dict(_metrics)
+    report["workers"] = PROCESS_POOL_WORKERS
+    report["min_rows"] = PROCESS_MIN_ROWS
+    report["chunk_rows"] = CHUNK_ROWS
+    report["pool_started"] = _pool is not None
+    return report
+
+
+def _attach(spec):
+    """Shared memory blocks and typed views for {name: (block, typecode, rows)}"""
+    blocks = {}
+    views = {}
+    for name, (block_name, typecode, rows) in spec.items():
+        block = shared_memory.SharedMemory(name=block_name)
+        blocks[name] = block
+        views[name] = block.buf[:rows * array(typecode).itemsize].cast(typecode)
+    return blocks, views
+
+
+def _run_chunk(kernel, input_spec, output_spec, start, stop):
+    """Pool side: run the kernel over one row range of the shared columns"""
+    started = time.perf_counter()
+    input_blocks, inputs = _attach(input_spec)
+    output_blocks, outputs = _attach(output_spec)
+    try:
+        kernel(inputs, outputs, start, stop)
+    finally:
+        # Views must be released before the blocks can be closed
+        for view in list(inputs.values()) + list(outputs.values()):
+            view.release()
+        for block in list(input_blocks.values()) + list(output_blocks.values()):
+            block.close()
+    return time.perf_counter() - started
+
+
+def _share(typecode, rows, values=None):
+    block = shared_memory.SharedMemory(create=True, size=max(1, rows * array(typecode).itemsize))
+    if values is not None and rows:
+        block.buf[:len(values) * values.itemsize] = values.tobytes()
+    return block
+
+
+def run_columns(kernel, inputs, outputs):
+    """
+    Run kernel over all rows of the `inputs` columns ({name: array.array}, all
+    the same length); returns the `outputs` columns ({name: typecode}) as
+    arrays.
+    """
+    rows = len(next(iter(inputs.values()))) if inputs else 0
+    started = time.perf_counter()
+
+    if PROCESS_POOL_WORKERS <= 0 or rows < PROCESS_MIN_ROWS:
+        results = {name: array(typecode, bytes(rows * array(typecode).itemsize)) for name, typecode in outputs.items()}
+        kernel(inputs, results, 0, rows)
+        _record(runs=1, inline_runs=1, rows=rows, wall_seconds=time.perf_counter() - started)
+        return results
+
+    blocks = []
+    try:
+        input_spec = {}
+        for name, values in inputs.items():
+            block = _share(values.typecode, rows, values)
+            blocks.append(block)
+            input_spec[name] = (block.name, values.typecode, rows)
+        output_spec = {}
+        for name, typecode in outputs.items():
+            block = _share(typecode, rows)
+            blocks.append(block)
+            output_spec[name] = (block.name, typecode, rows)
+
+        futures = [
+            pool().submit(_run_chunk, kernel, input_spec, output_spec, start, min(rows, start + CHUNK_ROWS))
+            for start in range(0, rows, CHUNK_ROWS)
+        ]
+        try:
+            worker_seconds = sum(future.result() for future in futures)
+        except Exception:
+            _record(failures=1)
+            for future in futures:
+                future.cancel()
+            raise
+
+        results = {}
+        for name, (block_name, typecode, _) in output_spec.items():
+            block = next(block for block in blocks if block.name == block_name)
+            results[name] = array(typecode, bytes(block.buf[:rows * array(typecode).itemsize]))
+        _record(runs=1, chunks=len(futures), rows=rows, wall_seconds=time.perf_counter() - started,
+                worker_seconds=worker_seconds)
+        return results
+    finally:
+        for block in blocks:
+            block.close()
+            block.unlink()
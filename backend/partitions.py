@@ -0,0 +1,181 @@
+"""
+Partitioned parallel aggregation.
+
+A large aggregation runs as one pipeline per partition of the collection, on a
+bounded thread pool, and the partial results are merged here: counts are
+summed, sets unioned, lists concatenated, and top-K is taken after the merge
+so it stays exact. Partitions are `_id` ranges (or ranges of another indexed
+field such as `not_before`) cut at quantiles of a small `$sample`, so they
+hold roughly equal numbers of documents even when inserts were bursty.
+
+Each partial pipeline is a separate operation on mongod, so a grouping that
+ran on one core runs on up to PARALLEL_WORKERS. Partial results cross the
+wire in full, so partial pipelines should project their groups down to the
+keys and accumulators they need, and only be merged whole for low-cardinality
+groupings. Top-K over high-cardinality groupings (DNS names, keys) goes
+through top_groups, where no partition returns more than a bounded number of
+groups. The pool threads run in a copy of the
+request's context, so query deadlines and cancellation (deadlines.py) apply
+to every partition.
+"""
+import contextvars
+import math
+import os
+import threading
+from concurrent.futures import ThreadPoolExecutor
+
+PARALLEL_WORKERS = int(os.getenv("PARALLEL_WORKERS", str(min(8, os.cpu_count() or 1))))
+PARALLEL_PARTITIONS = int(os.getenv("PARALLEL_PARTITIONS", str(PARALLEL_WORKERS)))
+# Collections smaller than this are aggregated in one pipeline
+PARALLEL_MIN_DOCUMENTS = int(os.getenv("PARALLEL_MIN_DOCUMENTS", "100000"))
+# Sampled values per partition used to place the partition boundaries
+SAMPLES_PER_PARTITION = 64
+# Most groups a partition returns in the threshold pass of top_groups; beyond it
+# the top-K is taken by a single pipeline
+TOP_K_MAX_PARTIAL = int(os.getenv("PARALLEL_TOP_K_MAX_PARTIAL", "10000"))
+
+_executor = None
+_executor_lock = threading.Lock()
+
+
+def executor():
+    global _executor
+    with _executor_lock:
+        if _executor is None:
+            _executor = ThreadPoolExecutor(max_workers=PARALLEL_WORKERS, thread_name_prefix="partition")
+        return _executor
+
+
+def partition_matches(collection, partitions, field="_id"):
+    """$match filters for `partitions` ranges of `field` that together cover the collection"""
+    if partitions <= 1:
+        return [{}]
+    values = sorted({
+        row["value"] for row in collection.aggregate([
+            {"$sample": {"size": partitions * SAMPLES_PER_PARTITION}},
+            {"$match": {field: {"$exists": True, "$ne": None}}},
+            {"$project": {"_id": 0, "value": "$" + field}},
+        ])
+    })
+    cuts = sorted({values[len(values) * i // partitions] for i in range(1, partitions)}) if values else []
+    matches = []
+    lower = None
+    for cut in cuts + [None]:
+        bounds = {}
+        if lower is not None:
+            bounds["$gte"] = lower
+        if cut is not None:
+            bounds["$lt"] = cut
+        matches.append({field: bounds} if bounds else {})
+        lower = cut
+    if field != "_id" and len(matches) > 1:
+        # Ranges skip documents without the field
+        matches.append({field: None})
+    return matches
+
+
+def run_partitioned(collection, matches, stages):
+    """Run [$match partition] + stages for every partition concurrently; returns one result list per partition"""
+    if len(matches) == 1:
+        return [list(collection.aggregate(([{"$match": matches[0]}] if matches[0] else []) + stages))]
+    futures = [
+        executor().submit(contextvars.copy_context().run,
+                          lambda match=match: list(collection.aggregate([{"$match": match}] + stages)))
+        for match in matches
+    ]
+    return [future.result() for future in futures]
+
+
+def merge_groups(partials, sums=("count",), sets=(), lists=()):
+    """
+    Merge per-partition $group rows by _id (which must be hashable): `sums`
+    fields are added, `sets` ($addToSet) fields unioned and `lists` ($push)
+    fields concatenated.
+    """
+    merged = {}
+    unions = {}
+    for rows in partials:
+        for row in rows:
+            key = row["_id"]
+            entry = merged.get(key)
+            if entry is None:
+                merged[key] = {**row, **{field: list(row.get(field) or []) for field in lists}}
+                unions[key] = {field: set(row.get(field) or []) for field in sets}
+                continue
+            for field in sums:
+                entry[field] += row[field]
+            for field in sets:
+                unions[key][field].update(row.get(field) or [])
+            for field in lists:
+                entry[field] += row.get(field) or []
+    for key, entry in merged.items():
+        for field in sets:
+            entry[field] = list(unions[key][field])
+    return list(merged.values())
+
+
+def top(rows, k, field="count"):
+    return sorted(rows, key=lambda row: -row[field])[:k]
+
+
+def _ranked(stages, field, limit, minimum=0):
+    """stages + the `limit` largest groups by `field`, of at least `minimum`"""
+    return stages + ([{"$match": {field: {"$gte": minimum}}}] if minimum else []) + [
+        {"$sort": {field: -1}}, {"$limit": limit}]
+
+
+def _only(stages, key, groups):
+    """stages restricted to the documents and the groups with these _ids"""
+    match = {key: {"$in": groups}}
+    if None in groups:
+        match = {"$or": [match, {key: []}]}  # unwound with preserveNullAndEmptyArrays
+    return [{"$match": match}] + stages + [{"$match": {"_id": {"$in": groups}}}]
+
+
+def _kth(values, k):
+    values = sorted(values, reverse=True)
+    return values[k - 1] if len(values) >= k else 0
+
+
+def top_groups(collection, matches, stages, k, key, field="count"):
+    """
+    Exact top k rows by the count `field` of a pipeline ending in a $group on
+    the document path `key`, over all partitions (three-phase uniform
+    threshold):
+
+    1. every partition returns its k largest groups; the k-th largest of their
+       sums, tau, is at most the k-th largest total;
+    2. every partition returns its groups counting at least tau / partitions
+       (a group in the top k reaches that in some partition); groups whose
+       upper bound is below the new k-th largest lower bound are dropped;
+    3. the remaining groups that some partition did not return are counted
+       exactly.
+
+    When a partition has more than TOP_K_MAX_PARTIAL groups above the
+    threshold (a flat distribution), one pipeline takes the top k instead.
+    """
+    if len(matches) == 1:
+        return run_partitioned(collection, matches, _ranked(stages, field, k))[0]
+
+    first = run_partitioned(collection, matches, _ranked(stages, field, k))
+    threshold = math.ceil(_kth((row[field] for row in merge_groups(first, sums=(field,))), k) / len(matches))
+    second = run_partitioned(collection, matches, _ranked(stages, field, TOP_K_MAX_PARTIAL + 1, threshold))
+    if any(len(rows) > TOP_K_MAX_PARTIAL for rows in second):
+        return list(collection.aggregate(_ranked(stages, field, k)))
+
+    seen = {}
+    for rows in second:
+        for row in rows:
+            seen.setdefault(row["_id"], []).append(row[field])
+    lower = {group: sum(counts) for group, counts in seen.items()}
+    bound = _kth(lower.values(), k)
+    # A group a partition did not return counts less than the threshold there
+    below = max(0, threshold - 1)
+    candidates = [group for group, counts in seen.items()
+                  if lower[group] + (len(matches) - len(counts)) * below >= bound]
+    inexact = [group for group in candidates if below and len(seen[group]) < len(matches)]
+    totals = {group: lower[group] for group in candidates}
+    if inexact:
+        for row in merge_groups(run_partitioned(collection, matches, _only(stages, key, inexact)), sums=(field,)):
+            totals[row["_id"]] = row[field]
+    return top([{"_id": group, field: total} for group, total in totals.items()], k, field)
@@ -0,0 +1,101 @@
+"""
+Approximate analytics over a uniform random sample.
+
+With `approx=true` an analytics endpoint runs its pipeline behind a `$sample`
+stage of `sample` documents instead of scanning the collection, and scales
+each count by population / sample size. Counts come with 95% Wilson score
+intervals (with the finite population correction), averages with normal
+intervals. Counts of unwound values (e.g. SAN domains) are estimated the same
+way with Poisson intervals, which assume the values are independent and so
+are somewhat optimistic.
+
+When the exact result is already cached it is returned instead. Otherwise the
+exact computation can be started in the background (`refine`), so a later
+request gets the exact answer.
+"""
+import math
+import threading
+
+DEFAULT_SAMPLE = 10000
+MAX_SAMPLE = 200000
+CONFIDENCE = 0.95
+Z = 1.96
+
+
+def sample_size(population, requested):
+    return max(1, min(requested, MAX_SAMPLE, population or 1))
+
+
+def sample_stages(size):
+    # $sample as the first stage picks documents with a random cursor instead of scanning
+    return [{"$sample": {"size": size}}]
+
+
+def count_interval(k, n, population, z=Z, unwound=False):
+    """
+    Estimated population count and interval for k hits in a sample of n
+    documents. Unwound counts (several per document) use a Poisson interval.
+    """
+    if n >= population:
+        return k, k, k
+    correction = math.sqrt((population - n) / (population - 1))
+    if unwound:
+        estimate = k * population / n
+        half = z * math.sqrt(k) * population / n * correction
+        return round(estimate), math.floor(max(k, estimate - half)), math.ceil(estimate + half)
+    p = k / n
+    denominator = 1 + z * z / n
+    center = (p + z * z / (2 * n)) / denominator
+    half = z * math.sqrt(p * (1 - p) / n + z * z / (4 * n * n)) / denominator * correction
+    low = max(k, (center - half) * population)
+    high = min(population, (center + half) * population)
+    return round(p * population), math.floor(low), math.ceil(high)
+
+
+def mean_interval(mean, std, k, z=Z):
+    if mean is None or not k:
+        return None
+    half = z * (std or 0) / math.sqrt(k)
+    return [mean - half, mean + half]
+
+
+def scale(row, n, population, fields=("count",), unwound=False):
+    """Replace sampled counts in a row by population estimates, adding a <field>_ci interval for each"""
+    for field in fields:
+        estimate, low, high = count_interval(row[field], n, population, unwound=unwound)
+        row[field] = estimate
+        row[field + "_ci"] = [low, high]
+    return row
+
+
+def metadata(n, population, refining):
+    return {
+        "approximate": True,
+        "sample_size": n,
+        "population": population,
+        "confidence": CONFIDENCE,
+        "refining": refining,
+    }
+
+
+_refining = set()
+_refining_lock = threading.Lock()
+
+
+def refine_in_background(name, compute):
+    """Run compute() in a thread unless a refinement with the same name is already running"""
+    with _refining_lock:
+        if name in _refining:
+            return
+        _refining.add(name)
+
+    def run():
+        try:
+            compute()
+        except Exception as e:
+            print(f"❌ Error computing exact result for {name}:", e)
+        finally:
+            with _refining_lock:
+                _refining.discard(name)
+
+    threading.Thread(target=run, daemon=True).start()
@@ -0,0 +1,27 @@
+"""
+Per-certificate scoring kernels, run over typed columns by offload.run_columns
+(in a pool process for large inputs). Kernels only use the standard library so
+pool processes start without importing the API.
+"""
+import random
+
+
+def expiry_risk(inputs, outputs, start, stop):
+    """
+    Mock expiry risk (0-10) from days until expiry, key strength and
+    auto-renewal: inputs days_remaining, key_strength, auto_renewal; output
+    risk_score.
+    """
+    days_remaining = inputs["days_remaining"]
+    key_strength = inputs["key_strength"]
+    auto_renewal = inputs["auto_renewal"]
+    risk_score = outputs["risk_score"]
+    for i in range(start, stop):
+        auto_renewal_factor = 0.3 if auto_renewal[i] else 0.7
+        # Risk combines days until expiry, key strength, auto-renewal status and some randomness
+        risk_score[i] = round(min(10, max(0,
+            (1.0 - (days_remaining[i] / 365)) * 7 +  # Time factor
+            (1.0 - (key_strength[i] / 4096)) * 1.5 +  # Key strength factor
+            auto_renewal_factor +  # Auto-renewal factor
+            random.uniform(-1, 1)
+        )), 1)
@@ -0,0 +1,177 @@
+"""
+In-process search index over subject common names and SAN DNS names.
+
+Names are kept in two sorted lists: one in normal order (for prefix lookups)
+and one with the DNS labels reversed, e.g. "www.example.pk" -> "pk.example.www"
+(for suffix and wildcard lookups). Every lookup is a binary search followed by
+a short range scan, so it stays fast no matter how many names are indexed.
+"""
+import bisect
+import fnmatch
+import heapq
+import threading
+import time
+
+
+def reverse_labels(name):
+    """Reverse the DNS labels of a name: "www.example.pk" -> "pk.example.www" """
+    return ".".join(reversed(name.split(".")))
+
+
+def extract_names(doc):
+    """Return the lower-cased subject CNs and SAN DNS names of a certificate document"""
+    parsed = doc.get("parsed", {})
+    names = set()
+
+    common_name = parsed.get("subject", {}).get("common_name")
+    if isinstance(common_name, str):
+        common_name = [common_name]
+    for name in common_name or []:
+        if isinstance(name, str) and name:
+            names.add(name.strip().lower())
+
+    dns_names = parsed.get("extensions", {}).get("subject_alt_name", {}).get("dns_names")
+    for name in dns_names or []:
+        if isinstance(name, str) and name:
+            names.add(name.strip().lower())
+
+    return names
+
+
+def _range_scan(sorted_keys, prefix):
+    """Yield the keys of a sorted list that start with prefix"""
+    i = bisect.bisect_left(sorted_keys, prefix)
+    while i < len(sorted_keys) and sorted_keys[i].startswith(prefix):
+        yield sorted_keys[i]
+        i += 1
+
+
+class DomainIndex:
+    """Prefix / suffix / wildcard index mapping domain names to certificate ids"""
+
+    PROJECTION = {
+        "_id": 1,
+        "parsed.subject.common_name": 1,
+        "parsed.extensions.subject_alt_name.dns_names": 1,
+    }
+
+    def __init__(self, refresh_seconds=60):
+        self.refresh_seconds = refresh_seconds
+        self.certs_by_name = {}
+        self.forward = []
+        self.reversed = []
+        self.last_id = None
+        self.last_refresh = 0.0
+        self.ready = False
+        self._lock = threading.Lock()
+
+    def refresh(self, collection):
+        """Index the certificates added since the last refresh (all of them the first time)"""
+        with self._lock:
+            query = {"_id": {"$gt": self.last_id}} if self.last_id is not None else {}
+            cursor = collection.find(query, self.PROJECTION).sort("_id", 1).batch_size(5000)
+
+            new_names = set()
+            for doc in cursor:
+                for name in extract_names(doc):
+                    if name not in self.certs_by_name:
+                        self.certs_by_name[name] = []
+                        new_names.add(name)
+                    self.certs_by_name[name].append(doc["_id"])
+                self.last_id = doc["_id"]
+
+            if new_names:
+                # Merge the new keys in one pass instead of re-sorting everything
+                self.forward = list(heapq.merge(self.forward, sorted(new_names)))
+                self.reversed = list(heapq.merge(self.reversed, sorted(reverse_labels(n) for n in new_names)))
+
+            self.last_refresh = time.monotonic()
+            self.ready = True
+            return len(new_names)
+
+    def refresh_if_stale(self, collection):
+        if not self.ready or time.monotonic() - self.last_refresh > self.refresh_seconds:
+            self.refresh(collection)
+
+    def exact(self, name):
+        return [name] if name in self.certs_by_name else []
+
+    def prefix(self, prefix, limit):
+        names = []
+        for name in _range_scan(self.forward, prefix):
+            names.append(name)
+            if len(names) >= limit:
+                break
+        return names
+
+    def suffix(self, suffix, limit):
+        """Names equal to suffix or ending in "." + suffix (label aligned)"""
+        key = reverse_labels(suffix)
+        names = []
+        for rkey in _range_scan(self.reversed, key):
+            if rkey == key or rkey[len(key)] == ".":
+                names.append(reverse_labels(rkey))
+                if len(names) >= limit:
+                    break
+        return names
+
+    def wildcard(self, pattern, limit):
+        """
+        "*.example.pk" matches names exactly one label below example.pk (including
+        the literal wildcard name); any other "*" / "?" pattern is matched with
+        fnmatch after narrowing the scan down to its literal prefix (forward
+        list) or to the whole labels of its literal suffix (reversed list),
+        whichever is longer. Patterns with neither are rejected.
+        """
+        names = []
+        if pattern.startswith("*.") and "*" not in pattern[2:] and "?" not in pattern:
+            key = reverse_labels(pattern[2:]) + "."
+            for rkey in _range_scan(self.reversed, key):
+                if "." not in rkey[len(key):]:
+                    names.append(reverse_labels(rkey))
+                    if len(names) >= limit:
+                        break
+            return names
+
+        literal = pattern.split("*", 1)[0].split("?", 1)[0]
+        # "*mail.example.pk" -> "example.pk": the labels of the suffix that no wildcard reaches into
+        suffix = pattern.rsplit("*", 1)[-1].rsplit("?", 1)[-1]
+        labels = suffix.split(".", 1)[1] if "." in suffix else ""
+        if not literal and not labels:
+            raise ValueError(f"Wildcard pattern needs a literal prefix or domain suffix: {pattern}")
+
+        if len(labels) > len(literal):
+            candidates = (reverse_labels(rkey) for rkey in _range_scan(self.reversed, reverse_labels(labels) + "."))
+        else:
+            candidates = _range_scan(self.forward, literal)
+        for name in candidates:
+            if fnmatch.fnmatchcase(name, pattern):
+                names.append(name)
+                if len(names) >= limit:
+                    break
+        return names
+
+    def search(self, query, mode, limit):
+        query = query.strip().lower()
+        if mode == "exact":
+            return self.exact(query)
+        if mode == "prefix":
+            return self.prefix(query, limit)
+        if mode == "suffix":
+            return self.suffix(query.lstrip("*."), limit)
+        if mode == "wildcard":
+            return self.wildcard(query, limit)
+        raise ValueError(f"Unknown search mode: {mode}")
+
+    def cert_ids(self, names, limit):
+        """Return up to limit distinct certificate ids covering the given names"""
+        ids = []
+        seen = set()
+        for name in names:
+            for cert_id in self.certs_by_name.get(name, []):
+                if cert_id not in seen:
+                    seen.add(cert_id)
+                    ids.append(cert_id)
+                    if len(ids) >= limit:
+                        return ids
+        return ids
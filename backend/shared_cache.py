@@ -0,0 +1,138 @@
+"""
+Result cache shared by all worker processes on a host.
+
+Backed by a local SQLite file in WAL mode, so when the API runs with several
+uvicorn workers a heavy aggregation computed by one worker is reused by the
+others instead of being recomputed per process. Values are stored as BSON,
+which round-trips everything the endpoints return (including ObjectId and
+datetime). While a worker computes a result it holds a short-lived claim on the
+key; other workers asking for the same key wait for it instead of starting the
+same aggregation in parallel, for as long as their request's query budget
+allows (see deadlines.py).
+
+Every put prunes the store: results of other versions of the dataset (they are
+never asked for again), results older than max_age_seconds and, beyond
+max_bytes, the oldest results.
+"""
+import os
+import sqlite3
+import threading
+import time
+
+import bson
+
+from deadlines import current_budget
+
+
+class SharedResultCache:
+
+    def __init__(self, path, claim_seconds=120, poll_seconds=0.05, max_bytes=None, max_age_seconds=None):
+        self.path = path
+        self.claim_seconds = claim_seconds
+        self.poll_seconds = poll_seconds
+        self.max_bytes = max_bytes
+        self.max_age_seconds = max_age_seconds
+        self._local = threading.local()
+        directory = os.path.dirname(path)
+        if directory:
+            os.makedirs(directory, exist_ok=True)
+        with self._connection() as conn:
+            conn.execute("PRAGMA journal_mode=WAL")
+            conn.execute(
+                "CREATE TABLE IF NOT EXISTS results ("
+                " dataset TEXT, key TEXT, version TEXT, value BLOB, created REAL,"
+                " PRIMARY KEY (dataset, key))"
+            )
+            conn.execute("CREATE INDEX IF NOT EXISTS results_created ON results (created)")
+            conn.execute(
+                "CREATE TABLE IF NOT EXISTS claims ("
+                " dataset TEXT, key TEXT, version TEXT, expires REAL,"
+                " PRIMARY KEY (dataset, key, version))"
+            )
+
+    def _connection(self):
+        # sqlite3 connections must not be shared between threads
+        conn = getattr(self._local, "conn", None)
+        if conn is None:
+            conn = sqlite3.connect(self.path, timeout=30, isolation_level=None)
+            conn.execute("PRAGMA synchronous=NORMAL")
+            self._local.conn = conn
+        return conn
+
+    def get(self, dataset, key, version):
+        """Return (True, value) if a result for this dataset version is stored, else (False, None)"""
+        row = self._connection().execute(
+            "SELECT value FROM results WHERE dataset = ? AND key = ? AND version = ?",
+            (dataset, key, version),
+        ).fetchone()
+        if row is None:
+            return False, None
+        return True, bson.decode(row[0])["value"]
+
+    def put(self, dataset, key, version, value):
+        conn = self._connection()
+        conn.execute(
+            "INSERT OR REPLACE INTO results (dataset, key, version, value, created) VALUES (?, ?, ?, ?, ?)",
+            (dataset, key, version, bson.encode({"value": value}), time.time()),
+        )
+        conn.execute("DELETE FROM claims WHERE dataset = ? AND key = ? AND version = ?", (dataset, key, version))
+        self._prune(conn, dataset, version)
+
+    def _prune(self, conn, dataset, version):
+        conn.execute("DELETE FROM results WHERE dataset = ? AND version != ?", (dataset, version))
+        if self.max_age_seconds is not None:
+            conn.execute("DELETE FROM results WHERE created < ?", (time.time() - self.max_age_seconds,))
+        if self.max_bytes is not None:
+            excess = conn.execute("SELECT COALESCE(SUM(LENGTH(value)), 0) FROM results").fetchone()[0] - self.max_bytes
+            if excess > 0:
+                oldest = conn.execute("SELECT rowid, LENGTH(value) FROM results ORDER BY created")
+                stale = []
+                for rowid, size in oldest:
+                    if excess <= 0:
+                        break
+                    stale.append((rowid,))
+                    excess -= size
+                conn.executemany("DELETE FROM results WHERE rowid = ?", stale)
+
+    def _claim(self, dataset, key, version):
+        conn = self._connection()
+        now = time.time()
+        conn.execute("DELETE FROM claims WHERE expires < ?", (now,))
+        cursor = conn.execute(
+            "INSERT OR IGNORE INTO claims (dataset, key, version, expires) VALUES (?, ?, ?, ?)",
+            (dataset, key, version, now + self.claim_seconds),
+        )
+        return cursor.rowcount == 1
+
+    def _release(self, dataset, key, version):
+        self._connection().execute(
+            "DELETE FROM claims WHERE dataset = ? AND key = ? AND version = ?", (dataset, key, version)
+        )
+
+    def get_or_compute(self, dataset, key, version, compute):
+        while True:
+            found, value = self.get(dataset, key, version)
+            if found:
+                return value
+            if self._claim(dataset, key, version):
+                try:
+                    value = compute()
+                except BaseException:
+                    self._release(dataset, key, version)
+                    raise
+                try:
+                    self.put(dataset, key, version, value)
+                except bson.errors.InvalidDocument:
+                    self._release(dataset, key, version)  # not BSON-serializable: just don't share it
+                return value
+            # Another worker is computing it; wait for its result (or for its claim to expire),
+            # but not past this request's deadline or after its client went away
+            budget = current_budget.get()
+            if budget is not None:
+                budget.check()
+            time.sleep(self.poll_seconds)
+
+    def stats(self):
+        conn = self._connection()
+        entries, size = conn.execute("SELECT COUNT(*), COALESCE(SUM(LENGTH(value)), 0) FROM results").fetchone()
+        return {"path": self.path, "entries": entries, "bytes": size}
@@ -0,0 +1,52 @@
+import os
+import sys
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+# app.py refuses to import without it; nothing connects until a dataset is used
+os.environ.setdefault("MONGO_URI", "mongodb://localhost:27017")
+
+from validity_calendar import validity_dates  # noqa: E402
+
+
+class _Cursor(list):
+    def sort(self, *args, **kwargs):
+        return self
+
+    def batch_size(self, size):
+        return self
+
+
+class ListCollection:
+    """
+    The subset of a collection the in-process indexes use, over a list of
+    documents with integer _ids. update_many only runs backfill_validity_dates.
+    """
+
+    def __init__(self, docs):
+        self.docs = []
+        self.insert_many(docs)
+
+    def insert_many(self, docs):
+        for doc in docs:
+            self.docs.append({"_id": len(self.docs) + 1, **doc})
+
+    def _in_range(self, doc, query):
+        id_range = (query or {}).get("_id") or {}
+        return doc["_id"] > id_range.get("$gt", 0) and doc["_id"] <= id_range.get("$lte", len(self.docs))
+
+    def find(self, query=None, projection=None):
+        return _Cursor(doc for doc in self.docs if self._in_range(doc, query))
+
+    def find_one(self, query=None, projection=None, sort=None):
+        return self.docs[-1] if self.docs else None
+
+    def update_many(self, query, update):
+        modified = 0
+        for doc in self.docs:
+            if "not_after" not in doc and self._in_range(doc, query):
+                doc["not_before"], doc["not_after"] = validity_dates(doc)
+                modified += 1
+        return type("UpdateResult", (), {"modified_count": modified})()
+
+    def estimated_document_count(self):
+        return len(self.docs)
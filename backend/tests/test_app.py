@@ -0,0 +1,112 @@
+from datetime import datetime, timedelta
+from types import SimpleNamespace
+
+import pytest
+
+import app
+from validity_calendar import ValidityCalendar
+
+
+class RecordingDataset:
+    """A dataset without the columnar engine that records the cache keys asked for"""
+
+    columns = None
+
+    def __init__(self):
+        self.keys = []
+
+    def cached(self, key, compute):
+        self.keys.append(key)
+        return {"buckets": []}
+
+
+def test_distributions_are_cached_per_as_of():
+    ds = RecordingDataset()
+    for endpoint in (app.get_validity_distribution, app.get_san_distribution):
+        endpoint(ds=ds)
+        endpoint(as_of="2024-01-31", ds=ds)
+
+    assert len(set(ds.keys)) == 4
+    assert sum("2024-01-31" in key for key in ds.keys) == 2
+
+
+def test_expiring_total_matches_the_rows():
+    mongomock = pytest.importorskip("mongomock")
+    collection = mongomock.MongoClient().scans.certificates
+    now = datetime.utcnow()
+    # Expired earlier today, expiring later today, in between, on the last day and just after it
+    collection.insert_many([{"not_before": now - timedelta(days=90), "not_after": now + timedelta(hours=hours)}
+                            for hours in (-1, 1, 24 * 12, 24 * 30 - 1, 24 * 30 + 1)])
+    ds = SimpleNamespace(collection=collection, certificates=collection, validity_calendar=ValidityCalendar())
+
+    response = app.get_expiring_certificates(days=30, ds=ds)
+
+    assert response["total"] == len(response["expiring"]) == 3
+    assert app.count_expiring(ds, now, now + timedelta(days=30)) == 3
+    assert app.get_expiring_summary(horizons="30", ds=ds)["counts"] == {"30": 3}
+
+
+def test_key_clusters_are_served():
+    mongomock = pytest.importorskip("mongomock")
+    from fastapi.testclient import TestClient
+
+    db = mongomock.MongoClient().scans
+    db.key_clusters.insert_many([{"_id": 1, "size": 2, "domains": 1, "keys": 1},
+                                 {"_id": 2, "size": 5, "domains": 3, "keys": 2}])
+    ds = SimpleNamespace(name="scans", db=db, collection=db.certificates, certificates=db.certificates)
+    app.app.dependency_overrides[app.get_dataset] = lambda: ds
+    try:
+        response = TestClient(app.app).get("/api/key-clusters")
+    finally:
+        app.app.dependency_overrides.clear()
+
+    assert response.status_code == 200
+    assert [cluster["cluster"] for cluster in response.json()["clusters"]] == [2, 1]
+
+
+def test_histogram_backfills_dates_before_computing(monkeypatch):
+    calls = []
+    monkeypatch.setattr(app, "backfill_validity_dates", lambda collection: calls.append("backfill"))
+    monkeypatch.setattr(app.histograms, "histogram", lambda *args, **kwargs: calls.append("histogram") or {"buckets": []})
+    ds = SimpleNamespace(columns=None, collection=None, certificates=None, cached=lambda key, compute: compute())
+
+    app.get_validity_distribution(as_of="2024-01-31", ds=ds)
+
+    assert calls == ["backfill", "histogram"]
+
+
+def test_clock_dependent_results_are_cached_per_hour(monkeypatch):
+    ds = RecordingDataset()
+    ds.collection = None
+    ds.version = lambda: "10-abc"
+    ds.issuers = ds.domain_coverage = SimpleNamespace(refresh_if_stale=lambda collection, version: None)
+    ds.cached = lambda key, compute: ds.keys.append(key) or []
+    monkeypatch.setattr(app, "compliance_match", lambda ds, active, issuer: {})
+
+    before = datetime.utcnow().strftime("%Y-%m-%dT%H")
+    app.get_compliance(ds=ds)
+    app.get_coverage_gaps(ds=ds)
+    after = datetime.utcnow().strftime("%Y-%m-%dT%H")
+
+    assert len(ds.keys) == 2
+    assert all(key.endswith(before) or key.endswith(after) for key in ds.keys)
+
+
+def test_versioned_skips_work_for_clients_at_the_current_version():
+    from datasets import ResultCache
+    from deltas import ResultHistory
+
+    cache = ResultCache("scans")
+    ds = SimpleNamespace(version=lambda: "10-abc", history=ResultHistory(),
+                         cached=lambda key, compute: cache.get_or_compute(key, "10-abc", compute))
+    computed = []
+
+    def compute():
+        computed.append(1)
+        return {"types": [{"_id": "SHA256-RSA", "count": 3}]}
+
+    assert app.versioned(ds, "types:None", "10-abc", compute) == {
+        "version": "10-abc", "since": "10-abc", "unchanged": True}
+    assert app.versioned(ds, "types:None", None, compute)["types"] == [{"_id": "SHA256-RSA", "count": 3}]
+    assert app.versioned(ds, "types:None", "9-xyz", compute)["version"] == "10-abc"
+    assert len(computed) == 1
@@ -0,0 +1,21 @@
+from datetime import datetime
+
+from cardinality import CardinalityIndex
+from conftest import ListCollection
+
+
+def test_refresh_counts_new_certificates_in_their_month_of_issue():
+    collection = ListCollection([])
+    index = CardinalityIndex()
+    index.refresh(collection)
+
+    # Inserted by the scanner after the first refresh: no native dates yet
+    collection.insert_many([{"parsed": {
+        "validity": {"start": "2024-03-05T00:00:00Z", "end": "2024-06-03T00:00:00Z"},
+        "extensions": {"subject_alt_name": {"dns_names": ["a.example.pk", "b.example.pk"]}},
+    }}])
+    assert index.refresh(collection) == 1
+
+    assert collection.docs[0]["not_before"] == datetime(2024, 3, 5)
+    assert [row["month"] for row in index.trends()] == ["2024-03"]
+    assert index.trends()[0]["dns_names"] == 2
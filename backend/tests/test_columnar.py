@@ -0,0 +1,27 @@
+from datetime import datetime, timedelta
+
+import pytest
+
+from conftest import ListCollection
+
+np = pytest.importorskip("numpy")
+from columnar import MISSING_DATE, ColumnarSnapshot  # noqa: E402
+
+
+def scanner_document(not_before, not_after):
+    return {"parsed": {"validity": {"start": not_before.isoformat() + "Z", "end": not_after.isoformat() + "Z"}}}
+
+
+def test_refresh_backfills_dates_before_appending():
+    now = datetime.utcnow().replace(microsecond=0)
+    collection = ListCollection([scanner_document(now - timedelta(days=10), now + timedelta(days=80))])
+    snapshot = ColumnarSnapshot()
+    snapshot.refresh(collection)
+
+    # Inserted after the first refresh, before any backfill
+    collection.insert_many([scanner_document(now - timedelta(days=5), now + timedelta(days=30))])
+    assert snapshot.refresh(collection) == 1
+
+    assert snapshot.rows == 2
+    assert MISSING_DATE not in snapshot.columns["not_after"]
+    assert int(snapshot.active_mask(now).sum()) == 2
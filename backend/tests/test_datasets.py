@@ -0,0 +1,14 @@
+import warm_state
+from datasets import ResultCache
+from shared_cache import SharedResultCache
+
+
+def test_persisted_results_are_tied_to_the_result_version(tmp_path, monkeypatch):
+    shared = SharedResultCache(str(tmp_path / "results.sqlite"))
+    ResultCache("scans", shared=shared).get_or_compute("types", "10-abc", lambda: {"shape": 1})
+
+    # A restart with the same code serves the stored result
+    assert ResultCache("scans", shared=shared).get_or_compute("types", "10-abc", lambda: {"shape": 2}) == {"shape": 1}
+
+    monkeypatch.setattr(warm_state, "RESULT_VERSION", warm_state.RESULT_VERSION + 1)
+    assert ResultCache("scans", shared=shared).get_or_compute("types", "10-abc", lambda: {"shape": 2}) == {"shape": 2}
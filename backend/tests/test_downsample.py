@@ -0,0 +1,33 @@
+import pytest
+
+from downsample import METHODS, downsample
+
+
+def series(days=60):
+    rows = [{"date": f"2024-01-{day:02d}", "count": 10} for day in range(1, 32)]
+    rows += [{"date": f"2024-02-{day:02d}", "count": 10} for day in range(1, days - 30)]
+    rows[20]["count"] = 500
+    return rows
+
+
+@pytest.mark.parametrize("method", METHODS)
+def test_spike_is_kept(method):
+    reduced, meta = downsample(series(), 10, method)
+    assert len(reduced) <= 10
+    assert any(row["count"] == 500 for row in reduced)
+    assert meta["original_points"] == 60
+
+
+@pytest.mark.parametrize("method", METHODS)
+def test_rows_without_x_are_kept(method):
+    rows = [{"date": None, "count": 7}] + series()
+    reduced, meta = downsample(rows, 10, method)
+    assert reduced[0] == {"date": None, "count": 7}
+    assert len(reduced) == meta["points"] <= 10
+
+
+@pytest.mark.parametrize("method", METHODS)
+@pytest.mark.parametrize("max_points", [1, 2, 3, 4, 5])
+def test_output_never_exceeds_max_points(method, max_points):
+    reduced, meta = downsample([{"date": None, "count": 1}] + series(), max_points, method)
+    assert 0 < len(reduced) <= max_points
@@ -0,0 +1,41 @@
+import io
+from datetime import datetime
+
+import pytest
+
+import export
+
+pa = pytest.importorskip("pyarrow")
+import pyarrow.parquet as pq  # noqa: E402
+
+FIELDS = ["parsed.issuer.organization", "parsed.serial_number", "parsed.subject_key_info.rsa_public_key.length",
+          "not_after"]
+
+
+def document(organization, serial, length):
+    return {"parsed": {"issuer": {"organization": organization}, "serial_number": serial,
+                       "subject_key_info": {"rsa_public_key": {"length": length}}},
+            "not_after": datetime(2025, 1, 1)}
+
+
+# List and scalar organizations, string and list serials, in the first batch and in later ones
+DOCUMENTS = [
+    document("DigiCert Inc", "01", 2048),
+    document(["Let's Encrypt", "ISRG"], ["02", "03"], 4096),
+    document(None, "04", None),
+    document(["Sectigo Limited"], "05", "n/a"),
+    document("GoDaddy.com, Inc.", ["06"], 2048),
+]
+
+
+@pytest.mark.parametrize("fmt", ["parquet", "arrow"])
+def test_mixed_list_and_scalar_values_export(fmt):
+    data = b"".join(export.stream(export.certificate_rows(DOCUMENTS, FIELDS), FIELDS, fmt, batch_size=2))
+    table = pq.read_table(io.BytesIO(data)) if fmt == "parquet" else pa.ipc.open_stream(data).read_all()
+
+    assert table.num_rows == len(DOCUMENTS)
+    assert table.column("parsed.issuer.organization").to_pylist() == [
+        ["DigiCert Inc"], ["Let's Encrypt", "ISRG"], None, ["Sectigo Limited"], ["GoDaddy.com, Inc."]]
+    # A list in the first batch makes it a list column
+    assert table.column("parsed.serial_number").to_pylist() == [["01"], ["02", "03"], ["04"], ["05"], ["06"]]
+    assert table.column("parsed.subject_key_info.rsa_public_key.length").to_pylist() == [2048, 4096, None, None, 2048]
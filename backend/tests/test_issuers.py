@@ -0,0 +1,45 @@
+from datetime import datetime
+
+import pytest
+
+from conftest import ListCollection
+from issuers import IssuerDimension, organization_key
+
+np = pytest.importorskip("numpy")
+from columnar import ColumnarSnapshot  # noqa: E402
+
+
+def certificate(organizations):
+    return {
+        "not_before": datetime(2024, 1, 1),
+        "not_after": datetime(2025, 1, 1),
+        "parsed": {"issuer": {"organization": organizations, "country": ["US"]}},
+    }
+
+
+def test_columnar_issuer_counts_expand_multi_valued_organizations():
+    snapshot = ColumnarSnapshot()
+    snapshot.refresh(ListCollection([
+        certificate(["DigiCert Inc", "DigiCert, Inc."]),
+        certificate(["Let's Encrypt", "Internet Security Research Group"]),
+        certificate(["DigiCert Inc"]),
+        certificate([]),
+    ]))
+
+    dimension = IssuerDimension()
+    # As learned from the issuer catalog on refresh
+    dimension.organization_names = {
+        organization_key(name): name for name in ("DigiCert Inc", "Internet Security Research Group")
+    }
+    counts = dimension.canonical_counts(snapshot.group_counts("issuer_org"), "organization")
+
+    # Each certificate counts once per canonical organization, like the Mongo rollup (Let's Encrypt is
+    # an alias of ISRG)
+    assert {row["_id"]: row["count"] for row in counts} == {
+        "DigiCert Inc": 2, "Internet Security Research Group": 1, None: 1,
+    }
+
+
+def test_canonical_counts_accepts_scalars():
+    counts = IssuerDimension().canonical_counts([{"_id": "us", "count": 2}, {"_id": "US", "count": 1}], "country")
+    assert counts == [{"_id": "US", "count": 3}]
@@ -0,0 +1,45 @@
+from datetime import datetime, timedelta
+
+from live import _Delta
+
+
+def scanner_document(not_before, not_after):
+    """A certificate as the scanner inserts it: ISO validity strings, no native dates yet"""
+    return {
+        "parsed": {
+            "signature_algorithm": {"name": "SHA256-RSA"},
+            "issuer": {"common_name": "R3"},
+            "subject": {"common_name": "example.pk"},
+            "fingerprint_sha256": "ab" * 32,
+            "validity": {"start": not_before.strftime("%Y-%m-%dT%H:%M:%SZ"),
+                         "end": not_after.strftime("%Y-%m-%dT%H:%M:%SZ")},
+        },
+    }
+
+
+def test_live_dimensions_parse_validity_of_new_documents():
+    from app import live_dimensions
+
+    now = datetime.utcnow()
+    doc = scanner_document(now - timedelta(days=100), now + timedelta(days=10))
+
+    assert live_dimensions(doc) == {
+        "types": "SHA256-RSA",
+        "issuers": "R3",
+        "status": "active",
+        "validity-distribution": 90,
+    }
+
+
+def test_delta_lists_new_documents_expiring_soon():
+    from app import live_dimensions
+
+    now = datetime.utcnow()
+    delta = _Delta(live_dimensions, expiring_days=30)
+    delta.insert(scanner_document(now - timedelta(days=80), now + timedelta(days=10, hours=1)))
+    delta.insert(scanner_document(now - timedelta(days=400), now - timedelta(days=1)))
+    event = delta.event()
+
+    assert [row["subject_common_name"] for row in event["expiring"]] == ["example.pk"]
+    assert event["expiring"][0]["days_remaining"] == 10
+    assert {row["_id"]: row["delta"] for row in event["buckets"]["status"]} == {"active": 1, "expired": 1}
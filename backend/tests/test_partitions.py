@@ -0,0 +1,65 @@
+import random
+from collections import Counter
+
+import pytest
+
+import partitions
+
+mongomock = pytest.importorskip("mongomock")
+
+KEY = "parsed.extensions.subject_alt_name.dns_names"
+STAGES = [
+    {"$unwind": {"path": "$" + KEY, "preserveNullAndEmptyArrays": False}},
+    {"$group": {"_id": "$" + KEY, "count": {"$sum": 1}}},
+]
+
+
+@pytest.fixture
+def certificates():
+    generator = random.Random(7)
+    # A long tail of rare names under a few frequent ones
+    names = [f"host{i}.example.pk" for i in range(400)]
+    weights = [1 / (i + 1) for i in range(len(names))]
+    collection = mongomock.MongoClient().db.certificates
+    collection.insert_many([
+        {"_id": i, "parsed": {"extensions": {"subject_alt_name": {
+            "dns_names": sorted(set(generator.choices(names, weights, k=3)))}}}}
+        for i in range(2000)
+    ])
+    expected = Counter(name for doc in collection.find()
+                       for name in doc["parsed"]["extensions"]["subject_alt_name"]["dns_names"])
+    return collection, expected
+
+
+MATCHES = [{"_id": {"$lt": 500}}, {"_id": {"$gte": 500, "$lt": 1000}}, {"_id": {"$gte": 1000, "$lt": 1500}},
+           {"_id": {"$gte": 1500}}]
+
+
+def test_top_groups_is_exact_with_bounded_partials(certificates, monkeypatch):
+    collection, expected = certificates
+    monkeypatch.setattr(partitions, "TOP_K_MAX_PARTIAL", 100)
+    returned = []
+    original = partitions.run_partitioned
+
+    def run_partitioned(*args):
+        returned.append(original(*args))
+        return returned[-1]
+
+    monkeypatch.setattr(partitions, "run_partitioned", run_partitioned)
+
+    top = partitions.top_groups(collection, MATCHES, STAGES, 10, KEY)
+
+    assert [row["count"] for row in top] == [count for _, count in expected.most_common(10)]
+    assert all(expected[row["_id"]] == row["count"] for row in top)
+    # Top k, threshold and verification passes, each returning a fraction of the ~400 groups per partition
+    assert len(returned) == 3
+    assert max(len(rows) for partials in returned for rows in partials) < 50
+
+
+def test_top_groups_of_a_flat_distribution_uses_one_pipeline(certificates, monkeypatch):
+    collection, expected = certificates
+    monkeypatch.setattr(partitions, "TOP_K_MAX_PARTIAL", 5)
+
+    top = partitions.top_groups(collection, MATCHES, STAGES, 10, KEY)
+
+    assert [row["count"] for row in top] == [count for _, count in expected.most_common(10)]
@@ -0,0 +1,37 @@
+import fnmatch
+
+import pytest
+
+from conftest import ListCollection
+from search_index import DomainIndex
+
+NAMES = ["example.pk", "www.example.pk", "mail.example.pk", "webmail.example.pk", "a.b.example.pk",
+         "mail.other.pk", "*.example.pk", "example.com"]
+
+
+@pytest.fixture
+def index():
+    index = DomainIndex()
+    index.refresh(ListCollection([{"parsed": {"extensions": {"subject_alt_name": {"dns_names": [name]}}}}
+                                  for name in NAMES]))
+    return index
+
+
+@pytest.mark.parametrize("pattern", ["*mail.example.pk", "*.b.example.pk", "?ww.example.pk", "*ai?.example.pk",
+                                     "mail*", "w*.pk", "*.example.pk"])
+def test_wildcard_matches_like_fnmatch(index, pattern):
+    expected = {name for name in NAMES if fnmatch.fnmatchcase(name, pattern)}
+    if pattern == "*.example.pk":
+        expected = {name for name in expected if name.count(".") == 2}
+    assert set(index.wildcard(pattern, 100)) == expected
+
+
+def test_leading_wildcard_scans_the_reversed_list(index):
+    index.forward = []
+    assert sorted(index.wildcard("*mail.example.pk", 100)) == ["mail.example.pk", "webmail.example.pk"]
+
+
+@pytest.mark.parametrize("pattern", ["*", "*?", "*mail", "?*"])
+def test_wildcard_without_literal_prefix_or_suffix_is_rejected(index, pattern):
+    with pytest.raises(ValueError):
+        index.wildcard(pattern, 100)
@@ -0,0 +1,49 @@
+import pytest
+from pymongo import errors
+
+from deadlines import QueryBudget, QueryCancelled, current_budget
+from shared_cache import SharedResultCache
+
+
+def test_put_drops_results_of_older_dataset_versions(tmp_path):
+    cache = SharedResultCache(str(tmp_path / "results.sqlite"))
+    cache.put("scans", "types", "1:10-a", [1])
+    cache.put("scans", "issuers", "1:10-a", [2])
+    cache.put("other", "types", "1:5-b", [3])
+
+    cache.put("scans", "types", "1:11-c", [4])
+
+    assert cache.get("scans", "issuers", "1:10-a") == (False, None)
+    assert cache.get("scans", "types", "1:11-c") == (True, [4])
+    assert cache.get("other", "types", "1:5-b") == (True, [3])
+
+
+def test_put_keeps_the_store_under_max_bytes(tmp_path):
+    cache = SharedResultCache(str(tmp_path / "results.sqlite"), max_bytes=3000)
+    for i in range(10):
+        cache.put("scans", f"key-{i}", "1:10-a", "x" * 1000)
+
+    assert cache.stats()["bytes"] <= 3000
+    assert cache.get("scans", "key-9", "1:10-a")[0]
+    assert not cache.get("scans", "key-0", "1:10-a")[0]
+
+
+def test_waiting_for_another_worker_stops_at_the_request_budget(tmp_path):
+    cache = SharedResultCache(str(tmp_path / "results.sqlite"), poll_seconds=0.01)
+    assert cache._claim("scans", "types", "1:10-a")  # held by another worker
+
+    token = current_budget.set(QueryBudget(0.05, "/api/types"))
+    try:
+        with pytest.raises(errors.ExecutionTimeout):
+            cache.get_or_compute("scans", "types", "1:10-a", lambda: [1])
+    finally:
+        current_budget.reset(token)
+
+    budget = QueryBudget(None, "/api/types")
+    budget.cancelled = True
+    token = current_budget.set(budget)
+    try:
+        with pytest.raises(QueryCancelled):
+            cache.get_or_compute("scans", "types", "1:10-a", lambda: [1])
+    finally:
+        current_budget.reset(token)
@@ -0,0 +1,223 @@
+"""
+Validity calendar: native validity dates plus precomputed per-day rollups.
+
+`parsed.validity.start/end` are ISO strings, which cannot be range-queried
+reliably or used for date arithmetic without parsing. `backfill_validity_dates`
+stores them once as native dates (`not_before` / `not_after`) so they can be
+indexed, and `ValidityCalendar` keeps the number of certificates issued and
+expiring on each day in the `validity_calendar` collection. Counting the
+certificates that expire in a window, or that were active / expired on any past
+date, is then a couple of binary searches over prefix-sum arrays in memory.
+"""
+import bisect
+import threading
+import time
+from datetime import datetime, timedelta, timezone
+
+from pymongo import ASCENDING, UpdateOne, errors
+
+
+CALENDAR_COLLECTION = "validity_calendar"
+STATE_COLLECTION = "rollup_state"
+# Bump when the stored rollup format changes so it is rebuilt from scratch
+CALENDAR_VERSION = 2
+
+
+def _to_date(field):
+    # Malformed dates become null instead of failing the whole update
+    return {"$convert": {"input": field, "to": "date", "onError": None, "onNull": None}}
+
+
+def parse_validity_date(value):
+    """In-process counterpart of _to_date: a naive UTC datetime, or None when missing or malformed"""
+    if isinstance(value, datetime):
+        return value
+    if not isinstance(value, str):
+        return None
+    try:
+        parsed = datetime.fromisoformat(value.replace("Z", "+00:00"))
+    except ValueError:
+        return None
+    if parsed.tzinfo is not None:
+        parsed = parsed.astimezone(timezone.utc).replace(tzinfo=None)
+    return parsed
+
+
+def validity_dates(doc):
+    """(not_before, not_after) of a certificate, parsed from parsed.validity if it is not backfilled yet"""
+    validity = doc.get("parsed", {}).get("validity", {})
+    return (parse_validity_date(doc.get("not_before", validity.get("start"))),
+            parse_validity_date(doc.get("not_after", validity.get("end"))))
+
+
+def ensure_validity_indexes(collection):
+    collection.create_index([("not_after", ASCENDING)])
+    collection.create_index([("not_before", ASCENDING)])
+    # Interval index for "active on date X": range on not_after, filter on not_before in the index
+    collection.create_index([("not_after", ASCENDING), ("not_before", ASCENDING)])
+    collection.create_index([("parsed.issuer.common_name", ASCENDING), ("not_after", ASCENDING)])
+
+
+def backfill_validity_dates(collection, max_id=None):
+    """Store native not_before/not_after dates on every certificate that does not have them yet"""
+    query = {"not_after": {"$exists": False}}
+    if max_id is not None:
+        query["_id"] = {"$lte": max_id}
+    result = collection.update_many(query, [
+        {"$set": {
+            "not_before": _to_date("$parsed.validity.start"),
+            "not_after": _to_date("$parsed.validity.end"),
+        }}
+    ])
+    return result.modified_count
+
+
+def snapshot_boundary(as_of):
+    """
+    Parse an as_of date ("YYYY-MM-DD" or an ISO datetime). Snapshots are taken at
+    the end of that day, so the boundary returned is midnight of the next day.
+    """
+    try:
+        day = datetime.fromisoformat(as_of.replace("Z", "")).date()
+    except ValueError:
+        raise ValueError(f"Invalid as_of date: {as_of}")
+    return datetime(day.year, day.month, day.day) + timedelta(days=1)
+
+
+def active_at(boundary):
+    """Query for certificates valid at the given instant"""
+    return {"not_after": {"$gte": boundary}, "not_before": {"$lt": boundary}}
+
+
+def expired_at(boundary):
+    return {"not_after": {"$lt": boundary}}
+
+
+class _PrefixSums:
+    """Sorted day ordinals with cumulative counts"""
+
+    def __init__(self, rows=()):
+        self.days = []
+        self.cumulative = []
+        total = 0
+        for day, count in rows:
+            total += count
+            self.days.append(day)
+            self.cumulative.append(total)
+
+    def through(self, ordinal):
+        """Count on or before the given day ordinal"""
+        i = bisect.bisect_right(self.days, ordinal)
+        return self.cumulative[i - 1] if i else 0
+
+    def histogram(self, first, last):
+        lo = bisect.bisect_left(self.days, first)
+        hi = bisect.bisect_right(self.days, last)
+        return [
+            (self.days[i], self.cumulative[i] - (self.cumulative[i - 1] if i else 0))
+            for i in range(lo, hi)
+        ]
+
+
+class ValidityCalendar:
+    """Per-day issuance and expiry counts, persisted in Mongo and cached in memory as prefix sums"""
+
+    def __init__(self, refresh_seconds=60):
+        self.refresh_seconds = refresh_seconds
+        self.issued = _PrefixSums()
+        self.expiring = _PrefixSums()
+        self.last_refresh = 0.0
+        self.ready = False
+        self._lock = threading.Lock()
+
+    def refresh(self, collection):
+        """Bring the stored calendar up to date with new certificates, then reload it"""
+        with self._lock:
+            db = collection.database
+            state = db[STATE_COLLECTION]
+            calendar = db[CALENDAR_COLLECTION]
+
+            latest = collection.find_one({}, {"_id": 1}, sort=[("_id", -1)])
+            if latest is not None:
+                max_id = latest["_id"]
+                backfill_validity_dates(collection, max_id)
+
+                previous = state.find_one({"_id": CALENDAR_COLLECTION}) or {}
+                if previous and previous.get("version") != CALENDAR_VERSION:
+                    state.delete_one({"_id": CALENDAR_COLLECTION})
+                    calendar.drop()
+                    previous = {}
+                last_id = previous.get("last_id")
+                if last_id != max_id:
+                    # Claim the range first so concurrent workers never count it twice
+                    try:
+                        claimed = state.update_one(
+                            {"_id": CALENDAR_COLLECTION, "last_id": last_id},
+                            {"$set": {"last_id": max_id, "version": CALENDAR_VERSION}},
+                            upsert=last_id is None,
+                        )
+                    except errors.DuplicateKeyError:
+                        claimed = None  # another worker created the state first
+                    if claimed and (claimed.modified_count or claimed.upserted_id is not None):
+                        self._add_range(collection, calendar, last_id, max_id)
+
+            self._load(calendar)
+            self.last_refresh = time.monotonic()
+            self.ready = True
+
+    def _add_range(self, collection, calendar, after_id, max_id):
+        id_range = {"$lte": max_id}
+        if after_id is not None:
+            id_range["$gt"] = after_id
+        updates = []
+        for counter, field in (("issued", "$not_before"), ("expiring", "$not_after")):
+            per_day = collection.aggregate([
+                {"$match": {"_id": id_range, field[1:]: {"$type": "date"}}},
+                {"$group": {
+                    "_id": {"$dateToString": {"format": "%Y-%m-%d", "date": field}},
+                    "count": {"$sum": 1},
+                }},
+            ])
+            updates.extend(
+                UpdateOne(
+                    {"_id": datetime.strptime(row["_id"], "%Y-%m-%d")},
+                    {"$inc": {counter: row["count"]}},
+                    upsert=True,
+                )
+                for row in per_day
+            )
+        if updates:
+            calendar.bulk_write(updates, ordered=False)
+
+    def _load(self, calendar):
+        issued = []
+        expiring = []
+        for row in calendar.find().sort("_id", 1):
+            day = row["_id"].toordinal()
+            if row.get("issued"):
+                issued.append((day, row["issued"]))
+            if row.get("expiring"):
+                expiring.append((day, row["expiring"]))
+        self.issued, self.expiring = _PrefixSums(issued), _PrefixSums(expiring)
+
+    def refresh_if_stale(self, collection):
+        if not self.ready or time.monotonic() - self.last_refresh > self.refresh_seconds:
+            self.refresh(collection)
+
+    def count_expiring(self, start, end):
+        """Certificates expiring from the day of start through the day of end (day resolution)"""
+        return self.expiring.through(end.toordinal()) - self.expiring.through(start.toordinal() - 1)
+
+    def snapshot(self, boundary):
+        """Issued / active / expired counts at the end of the day before boundary"""
+        last_day = boundary.toordinal() - 1
+        issued = self.issued.through(last_day)
+        expired = self.expiring.through(last_day)
+        return {"issued": issued, "active": issued - expired, "expired": expired}
+
+    def histogram(self, start, end):
+        """Per-day expiry counts from the day of start through the day of end"""
+        return [
+            {"date": datetime.fromordinal(day).strftime("%Y-%m-%d"), "count": count}
+            for day, count in self.expiring.histogram(start.toordinal(), end.toordinal())
+        ]
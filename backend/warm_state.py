@@ -0,0 +1,68 @@
+"""
+On-disk state for warm restarts.
+
+Computed analytics results are kept in the SQLite result cache under
+CACHE_DIR (see shared_cache.py), keyed by dataset, endpoint/params, dataset
+version and RESULT_VERSION, so after a restart every result whose dataset has not changed is
+served without recomputing it. The in-process structures that otherwise need
+a full collection scan at startup (distinct-count sketches, columnar
+snapshot) are saved next to it, one directory per dataset, together with the
+_id watermark and row count they cover.
+
+A saved snapshot is used only if the collection still holds exactly that many
+certificates up to the watermark (an _id index count); the certificates added
+since are then appended by the usual incremental refresh. Files are written
+to a temporary name and renamed, so concurrent workers and crashes never
+leave a partial file behind.
+"""
+import os
+import tempfile
+
+import bson
+
+# Bump when a saved format changes; older snapshots are then ignored
+STATE_VERSION = 1
+# Bump when the response shape of a cached endpoint changes; persisted results
+# stored by older code are then never served
+RESULT_VERSION = 1
+
+
+def dataset_dir(root, dataset):
+    path = os.path.join(root, dataset)
+    os.makedirs(path, exist_ok=True)
+    return path
+
+
+def write_atomic(path, write):
+    """Call write(file) on a temporary file next to `path`, then move it into place"""
+    directory = os.path.dirname(path)
+    fd, temporary = tempfile.mkstemp(dir=directory, prefix=".tmp-")
+    try:
+        with os.fdopen(fd, "wb") as f:
+            write(f)
+        os.replace(temporary, path)
+    except BaseException:
+        if os.path.exists(temporary):
+            os.remove(temporary)
+        raise
+
+
+def save_document(path, document):
+    write_atomic(path, lambda f: f.write(bson.encode({**document, "state_version": STATE_VERSION})))
+
+
+def load_document(path):
+    """The saved document, or None when there is none or it has an older format"""
+    try:
+        with open(path, "rb") as f:
+            document = bson.decode(f.read())
+    except (OSError, bson.errors.BSONError):
+        return None
+    return document if document.get("state_version") == STATE_VERSION else None
+
+
+def covers(collection, last_id, rows):
+    """True if the collection holds exactly `rows` certificates with _id <= last_id (nothing removed since the save)"""
+    if last_id is None:
+        return rows == 0
+    return collection.count_documents({"_id": {"$lte": last_id}}) == rows
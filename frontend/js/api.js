@@ -3,7 +3,67 @@
  */
 
 /**
- * Fetch data from the API
+ * Last full response of each endpoint that reports a dataset version, so
+ * later requests can ask for only what changed since that version
+ */
+const versionedResponses = {};
+
+/**
+ * Deep copy of a JSON response (views may modify the data they are given)
+ * @param {Object} data - Response data
+ * @returns {Object} Copy of the data
+ */
+function copyResponse(data) {
+  return JSON.parse(JSON.stringify(data));
+}
+
+/**
+ * Apply the changes to one result list: remove rows, replace or append upserted rows, then reorder
+ * @param {Array} rows - Rows of the local copy
+ * @param {Object} change - Changes ({key, upserted, removed, order})
+ * @returns {Array} Updated rows
+ */
+function mergeRows(rows, change) {
+  const identity = (row) => JSON.stringify(row[change.key]);
+  const removed = new Set(change.removed.map((key) => JSON.stringify(key)));
+  const upserted = new Map(change.upserted.map((row) => [identity(row), row]));
+
+  const merged = rows
+    .filter((row) => !removed.has(identity(row)))
+    .map((row) => {
+      const replacement = upserted.get(identity(row));
+      upserted.delete(identity(row));
+      return replacement || row;
+    });
+  merged.push(...upserted.values());
+
+  if (!change.order) {
+    return merged;
+  }
+  const byKey = new Map(merged.map((row) => [identity(row), row]));
+  return change.order.map((key) => byKey.get(JSON.stringify(key)));
+}
+
+/**
+ * Apply a delta response to the local copy of an endpoint's data
+ * @param {Object} data - Local copy (last full response)
+ * @param {Object} delta - Changes ({lists, replace, dropped})
+ * @returns {Object} Updated data
+ */
+function mergeDelta(data, delta) {
+  const merged = { ...data };
+  Object.entries(delta.lists).forEach(([name, change]) => {
+    merged[name] = mergeRows(data[name] || [], change);
+  });
+  Object.assign(merged, delta.replace);
+  delta.dropped.forEach((name) => delete merged[name]);
+  return merged;
+}
+
+/**
+ * Fetch data from the API. Endpoints that report a dataset version are asked
+ * for only the changes since the version already held, which are merged into
+ * the local copy.
  * @param {string} endpoint - API endpoint path
  * @param {string|null} containerId - ID of the container to show loading indicator (if any)
  * @returns {Promise<Object>} Response data
@@ -15,13 +75,29 @@ async function fetchFromAPI(endpoint, containerId = null) {
       addApiLoader(containerId);
     }
 
-    const response = await fetch(`${CONFIG.API_BASE_URL}${endpoint}`);
+    const known = versionedResponses[endpoint];
+    let url = `${CONFIG.API_BASE_URL}${endpoint}`;
+    if (known) {
+      const separator = endpoint.includes("?") ? "&" : "?";
+      url += `${separator}since=${encodeURIComponent(known.version)}`;
+    }
+
+    const response = await fetch(url);
 
     if (!response.ok) {
       throw new Error(`API Error: ${response.status} ${response.statusText}`);
     }
 
-    const data = await response.json();
+    let data = await response.json();
+
+    if (known && data.since === known.version && (data.unchanged || data.delta)) {
+      const merged = data.unchanged ? known.data : mergeDelta(known.data, data.delta);
+      data = { ...merged, version: data.version };
+    }
+    if (data.version) {
+      versionedResponses[endpoint] = { version: data.version, data: copyResponse(data) };
+      data = copyResponse(data);
+    }
 
     // Remove API loading indicator if container ID was provided
     if (containerId) {
@@ -40,6 +116,28 @@ async function fetchFromAPI(endpoint, containerId = null) {
   }
 }
 
+/**
+ * Subscribe to live updates pushed by the API as Server-Sent Events
+ * @param {Function} onDelta - Called with each delta (inserted/deleted counts, bucket increments, new expiring certificates)
+ * @param {Function|null} onResync - Called when updates were missed and the view should reload
+ * @returns {EventSource|null} Event source (call close() to unsubscribe), null if unsupported
+ */
+function subscribeToUpdates(onDelta, onResync = null) {
+  if (typeof EventSource === "undefined") {
+    return null;
+  }
+
+  // EventSource reconnects by itself if the connection drops
+  const source = new EventSource(
+    `${CONFIG.API_BASE_URL}${CONFIG.API_ENDPOINTS.STREAM}`
+  );
+  source.addEventListener("delta", (event) => onDelta(JSON.parse(event.data)));
+  if (onResync) {
+    source.addEventListener("resync", () => onResync());
+  }
+  return source;
+}
+
 /**
  * Dashboard API methods
  */
@@ -101,7 +199,10 @@ const API = {
    * @returns {Promise<Object>} Timeline data
    */
   getIssuanceTimeline: async function (containerId = null) {
-    return await fetchFromAPI(CONFIG.API_ENDPOINTS.TIMELINE, containerId);
+    return await fetchFromAPI(
+      `${CONFIG.API_ENDPOINTS.TIMELINE}?max_points=${CONFIG.MAX_CHART_POINTS}`,
+      containerId
+    );
   },
 
   /**
@@ -246,7 +347,7 @@ const API = {
    */
   getValidityTrends: async function (containerId = null) {
     return await fetchFromAPI(
-      CONFIG.API_ENDPOINTS.VALIDITY_TRENDS,
+      `${CONFIG.API_ENDPOINTS.VALIDITY_TRENDS}?max_points=${CONFIG.MAX_CHART_POINTS}`,
       containerId
     );
   },
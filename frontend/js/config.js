@@ -33,8 +33,12 @@ const CONFIG = {
     CA_URL_ANALYSIS: "/api/ca-url-analysis",
     CA_PUBKEY_ANALYSIS: "/api/ca-pubkey-analysis",
     SHARED_PUBKEYS: "/api/shared-pubkeys",
+    STREAM: "/api/stream",
   },
 
+  // Most points requested for time series charts (downsampled by the API)
+  MAX_CHART_POINTS: 500,
+
   // Chart Colors
   CHART_COLORS: {
     PRIMARY: "#1976d2",
@@ -220,6 +220,14 @@ const overviewView = {
         );
       }
 
+      // Keep the counters and charts current without re-fetching
+      if (!this.liveUpdates) {
+        this.liveUpdates = subscribeToUpdates(
+          (delta) => this.applyDelta(delta),
+          () => this.loadData()
+        );
+      }
+
       // Fetch certificates for the table
       if (recentCertsTable) {
         const certificates = await API.getAllCertificates();
@@ -280,7 +288,71 @@ const overviewView = {
     }
   },
 
+  /**
+   * Apply a live update to the overview counters and charts in place
+   * @param {Object} delta - Delta event from the /api/stream endpoint
+   */
+  applyDelta(delta) {
+    const data = dashboardData.overview;
+    if (!data) return;
+
+    // Deleted certificates are not sent, so their buckets are unknown: reload the counters
+    if (delta.deleted > 0) {
+      this.loadData();
+      return;
+    }
+
+    const statusDelta = {};
+    (delta.buckets.status || []).forEach((bucket) => {
+      statusDelta[bucket._id] = bucket.delta;
+    });
+    data.total += delta.inserted;
+    data.active += statusDelta.active || 0;
+    data.expired += statusDelta.expired || 0;
+    data.expiring_soon += delta.expiring.length;
+
+    const counters = {
+      "total-certificates": data.total,
+      "active-certificates": data.active,
+      "expired-certificates": data.expired,
+      "expiring-certificates": data.expiring_soon,
+    };
+    Object.entries(counters).forEach(([id, value]) => {
+      const el = safeGetElement(id);
+      if (el) {
+        el.textContent = formatNumber(value);
+      }
+    });
+
+    if (dashboardCharts.statusChart) {
+      dashboardCharts.statusChart.data.datasets[0].data = [
+        data.active,
+        data.expired,
+      ];
+      dashboardCharts.statusChart.update();
+    }
+
+    if (dashboardCharts.typesChart && delta.buckets.types) {
+      const chart = dashboardCharts.typesChart;
+      delta.buckets.types.forEach((bucket) => {
+        const index = chart.data.labels.indexOf(bucket._id);
+        if (index === -1) {
+          chart.data.labels.push(bucket._id);
+          chart.data.datasets[0].data.push(bucket.delta);
+        } else {
+          chart.data.datasets[0].data[index] += bucket.delta;
+        }
+      });
+      chart.update();
+    }
+  },
+
   destroy() {
+    if (this.liveUpdates) {
+      this.liveUpdates.close();
+      this.liveUpdates = null;
+    }
+
     // Clean up charts to prevent memory leaks
     if (dashboardCharts.statusChart) {
       destroyChart(dashboardCharts.statusChart);
@@ -1,4 +1,7 @@
 #!/bin/bash
 echo "Starting Certificate Dashboard Backend..."
 cd backend || exit
-python3 -m uvicorn app:app --host 0.0.0.0 --port $PORT
+# One worker per CPU core unless WEB_CONCURRENCY is set. Workers share computed
+# results through the SQLite cache at SHARED_CACHE_PATH.
+WORKERS="${WEB_CONCURRENCY:-$(nproc)}"
+python3 -m uvicorn app:app --host 0.0.0.0 --port $PORT --workers "$WORKERS"